@@ -1,11 +1,12 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.utils import timezone
 from store.admin import ProductAdmin
 from tags.models import TaggedItem
 from store.models import Product
 
-from .models import User
+from .models import Task, User
 # We need to add the app to settings.py
 
 # Registering admin with the new extended User model
@@ -41,4 +42,21 @@ class CustomProductAdmin(ProductAdmin):
 admin.site.unregister(Product)
 
 # Register a model with a custom admin
-admin.site.register(Product, CustomProductAdmin)
\ No newline at end of file
+admin.site.register(Product, CustomProductAdmin)
+
+
+# Read only view of the task queue, to check the failed tasks and their errors
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['name', 'args', 'kwargs', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_at', 'last_error', 'created_at', 'finished_at']
+    actions = ['retry']
+    
+    @admin.action(description='Retry selected failed tasks')
+    def retry(self, request, queryset):
+        count = queryset.filter(status=Task.STATUS_FAILED).update(status=Task.STATUS_PENDING, attempts=0, run_at=timezone.now(), finished_at=None)
+        self.message_user(request, f'{count} tasks queued again.')
+    
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+    
+    # Connecting our signal handlers when the app is loaded
+    def ready(self) -> None:
+        import core.signals.handlers
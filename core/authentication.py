@@ -0,0 +1,66 @@
+# Stateless JWT authentication
+# The claims the permissions need (user id, is_staff, customer_id) travel inside the access token, so authenticating a request
+# doesn't load core.User from the database. Disabled or changed users are rejected with a revocation list in the shared cache.
+# Settings (see storefront/settings_api.py):
+# REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = ['core.authentication.StatelessJWTAuthentication']
+# SIMPLE_JWT['TOKEN_OBTAIN_SERIALIZER'] = 'core.serializers.TokenObtainPairSerializer'
+# SIMPLE_JWT['TOKEN_REFRESH_SERIALIZER'] = 'core.serializers.TokenRefreshSerializer'
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from store.caches import LRUCache
+
+# Full users loaded for the rare cases that need more than the claims, kept for a few seconds in this process
+user_cache = LRUCache(max_size=1000, ttl=getattr(settings, 'STATELESS_USER_CACHE_TTL', 30))
+
+
+def revocation_key(user_id):
+    return f'core:revoked:{user_id}'
+
+
+# Tokens of this user issued before now are rejected (ex: the user was disabled or lost is_staff)
+# Access and refresh tokens are checked (the refresh by TokenRefreshSerializer), the entry lives as long as the longest of them
+def revoke_tokens(user_id):
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    cache.set(revocation_key(user_id), time.time(), int(lifetime.total_seconds()) + 1)
+    user_cache.invalidate(lambda key: key == str(user_id))
+
+
+def is_revoked(token):
+    revoked_at = cache.get(revocation_key(token[api_settings.USER_ID_CLAIM]))
+    return revoked_at is not None and token.get('iat', 0) <= revoked_at
+
+
+# request.user for StatelessJWTAuthentication, it works with the claims and loads the real user only when another atribute is needed
+class ClaimsUser(TokenUser):
+    @cached_property
+    def customer_id(self):
+        return self.token.get('customer_id')
+    
+    @cached_property
+    def user(self):
+        # The user id claim can be a string, the key is always a string
+        return user_cache.get_or_compute(str(self.id), lambda: get_user_model().objects.get(pk=self.id))
+    
+    # Called only for atributes that are not claims, ex: request.user.email
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'token':
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        if is_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+        return ClaimsUser(validated_token)
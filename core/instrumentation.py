@@ -0,0 +1,151 @@
+# Query instrumentation, a lightweight replacement of debug_toolbar's SQL panel that we can leave on in production
+# Configured with the QUERY_INSTRUMENTATION dictionary in settings.py (see DEFAULTS)
+import heapq
+import random
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Fraction of requests that are measured, 1.0 measures every request
+    'SAMPLE_RATE': 1.0,
+    # Adds X-DB-Query-Count, X-DB-Time-Ms and X-DB-View headers to the responses
+    'RESPONSE_HEADERS': False,
+    # How many of the slowest statements are kept per request and per view
+    'SLOWEST': 3,
+    # Size of the rolling window in seconds, kept in one minute slots
+    'WINDOW': 300,
+}
+
+# Upper limits (ms) of the DB time histogram buckets, the last one catches everything else
+TIME_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf')]
+
+
+def get_setting(name):
+    return getattr(settings, 'QUERY_INSTRUMENTATION', {}).get(name, DEFAULTS[name])
+
+
+def should_sample():
+    sample_rate = get_setting('SAMPLE_RATE')
+    return get_setting('ENABLED') and (sample_rate >= 1 or random.random() < sample_rate)
+
+
+# Callable for connection.execute_wrapper(), it's called for every statement executed while it's installed
+class QueryRecorder:
+    def __init__(self, slowest=None):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_size = slowest or get_setting('SLOWEST')
+        # Min-heap of (duration, sql), so the fastest of the kept statements is the one we replace
+        self.slowest = []
+    
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+    
+    def record(self, sql, duration):
+        self.count += 1
+        self.total_time += duration
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, (duration, sql))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sql))
+    
+    @property
+    def total_ms(self):
+        return self.total_time * 1000
+    
+    def slowest_statements(self):
+        return [{'sql': sql, 'ms': round(duration * 1000, 3)} for duration, sql in sorted(self.slowest, reverse=True)]
+
+
+# Per view statistics for one minute
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_ms = 0.0
+        self.histogram = [0] * len(TIME_BUCKETS)
+        self.slowest = []
+    
+    def add(self, recorder):
+        self.requests += 1
+        self.queries += recorder.count
+        self.max_queries = max(self.max_queries, recorder.count)
+        self.db_ms += recorder.total_ms
+        self.histogram[next(i for i, limit in enumerate(TIME_BUCKETS) if recorder.total_ms <= limit)] += 1
+        self.slowest = heapq.nlargest(get_setting('SLOWEST'), self.slowest + recorder.slowest_statements(), key=lambda statement: statement['ms'])
+    
+    def merge(self, other):
+        self.requests += other.requests
+        self.queries += other.queries
+        self.max_queries = max(self.max_queries, other.max_queries)
+        self.db_ms += other.db_ms
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.slowest = heapq.nlargest(get_setting('SLOWEST'), self.slowest + other.slowest, key=lambda statement: statement['ms'])
+    
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'avg_queries': round(self.queries / self.requests, 2) if self.requests else 0,
+            'max_queries': self.max_queries,
+            'db_ms': round(self.db_ms, 3),
+            'avg_db_ms': round(self.db_ms / self.requests, 3) if self.requests else 0,
+            'db_ms_histogram': {('+Inf' if limit == float('inf') else f'<={limit}'): count for limit, count in zip(TIME_BUCKETS, self.histogram)},
+            'slowest': self.slowest,
+        }
+
+
+# Rolling window of per minute slots {view: ViewStats}, it lives in the process memory so each worker has its own
+class QueryStatsStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = deque()
+    
+    def add(self, view, recorder):
+        minute = int(time.time() // 60)
+        with self.lock:
+            if not self.slots or self.slots[-1][0] != minute:
+                self.slots.append((minute, {}))
+                self.expire(minute)
+            self.slots[-1][1].setdefault(view, ViewStats()).add(recorder)
+    
+    def expire(self, minute):
+        oldest = minute - get_setting('WINDOW') // 60
+        while self.slots and self.slots[0][0] < oldest:
+            self.slots.popleft()
+    
+    def snapshot(self):
+        totals = {}
+        with self.lock:
+            self.expire(int(time.time() // 60))
+            for minute, views in self.slots:
+                for view, stats in views.items():
+                    totals.setdefault(view, ViewStats()).merge(stats)
+        return {view: stats.as_dict() for view, stats in sorted(totals.items())}
+    
+    def clear(self):
+        with self.lock:
+            self.slots.clear()
+
+
+query_stats = QueryStatsStore()
+
+
+# Name of the view and action, ex: ProductViewSet.list, CartItemViewSet.create or CustomerViewSet.me
+def view_name(view_func, method):
+    # DRF stores the class and the {method: action} mapping on the function returned by as_view()
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower(), method.lower())
+    return f'{view_class.__name__}.{action}'
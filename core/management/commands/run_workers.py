@@ -0,0 +1,70 @@
+# Custom management command: python manage.py run_workers
+# Executes the background tasks of the Task table (core/tasks.py) until it's stopped with Ctrl+C or SIGTERM
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.tasks import claim, execute, get_setting
+
+
+# Every process of the pool opens its own database connections
+def init_process():
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Runs the background task workers'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['thread', 'process'], default=None, help='Default: TASKS["MODE"]')
+        parser.add_argument('--workers', type=int, default=None, help='Default: TASKS["WORKERS"]')
+        parser.add_argument('--once', action='store_true', help='Exit when there are no due tasks left')
+    
+    def handle(self, *args, **options):
+        mode = options['mode'] or get_setting('MODE')
+        workers = options['workers'] or get_setting('WORKERS')
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+        
+        if mode == 'process':
+            # The forked processes can't share the connections of this one
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_process)
+        else:
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task-worker')
+        self.stdout.write(f'Running {workers} {mode} workers.')
+        
+        running = set()
+        done = failed = 0
+        try:
+            while not stop.is_set():
+                # We only claim what the pool can start now, the rest stays available for other run_workers
+                free = workers - len(running)
+                ids = claim(min(free, get_setting('BATCH_SIZE'))) if free else []
+                running |= {pool.submit(execute, task_id) for task_id in ids}
+                if not running:
+                    if options['once']:
+                        break
+                    stop.wait(get_setting('POLL_INTERVAL'))
+                    continue
+                finished, running = wait(running, timeout=get_setting('POLL_INTERVAL'), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    # execute() saves the errors of the tasks, an exception here is a problem of the worker (ex: database down)
+                    # The task stays running and is claimed again after TASKS['TIMEOUT']
+                    if future.exception() is not None:
+                        self.stderr.write(f'Worker error: {future.exception()!r}')
+                        failed += 1
+                    elif future.result():
+                        done += 1
+                    else:
+                        failed += 1
+        finally:
+            # The tasks already started are finished before exiting
+            pool.shutdown(wait=True)
+        self.stdout.write(f'{done} tasks done, {failed} failed (retried or given up).')
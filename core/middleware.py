@@ -0,0 +1,50 @@
+# Middleware of the core app
+# Add 'core.middleware.QueryInstrumentationMiddleware' at the top of MIDDLEWARE to enable it
+# 'core.middleware.NPlusOneMiddleware' reports the N+1 queries of each request, in tests and staging (core/nplusone.py)
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import nplusone
+from .instrumentation import QueryRecorder, query_stats, should_sample, get_setting, view_name
+
+
+# Measures the queries of each request (count, DB time, slowest statements) and groups them by view and action
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        if not should_sample():
+            return self.get_response(request)
+        
+        recorder = QueryRecorder()
+        # The wrapper is installed in every database alias, so reads sent to replicas are also counted
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        
+        view = getattr(request, 'instrumentation_view', None) or 'unresolved'
+        query_stats.add(view, recorder)
+        if get_setting('RESPONSE_HEADERS'):
+            response['X-DB-Query-Count'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = f'{recorder.total_ms:.3f}'
+            response['X-DB-View'] = view
+        return response
+    
+    # Called after the URL is resolved, here we know which view will handle the request
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumentation_view = view_name(view_func, request.method)
+
+
+# Reports the statements repeated more than N_PLUS_ONE['THRESHOLD'] times in a request, as a warning or an NPlusOneError
+class NPlusOneMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        if not nplusone.get_setting('ENABLED'):
+            return self.get_response(request)
+        with nplusone.detect_n_plus_one(f'{request.method} {request.path}'):
+            return self.get_response(request)
@@ -8,4 +8,37 @@ from django.db import models
 # If you do this in middle of a proyect you will have errors with migrations, and will need to restart the database, so it's a best practice to start this class with pass at the begining of a proyect, despite you will not use it
 class User(AbstractUser):
     # Adding a new field to the user model, to enable login with email
-    email = models.EmailField(unique=True)
\ No newline at end of file
+    email = models.EmailField(unique=True)
+
+# Outbox of background tasks (see core/tasks.py), rows are inserted by task.delay() and executed by manage.py run_workers
+class Task(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_RUNNING = 'R'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    # Dotted path of the task function, ex: store.tasks.send_order_confirmation
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField()
+    # The task is not executed before this time, retries move it to the future (backoff)
+    run_at = models.DateTimeField()
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
+    
+    class Meta:
+        # The workers look for pending tasks ordered by run_at
+        indexes = [models.Index(fields=['status', 'run_at'], name='task_queue_idx')]
@@ -0,0 +1,143 @@
+# N+1 query detector, for the test suite and staging (it inspects the stack of every statement, don't enable it in production)
+# The statements of each request are reduced to a fingerprint (the SQL without values), and the fingerprints executed more
+# than THRESHOLD times are reported with the serializer field or admin column that executed them
+# Add 'core.middleware.NPlusOneMiddleware' to MIDDLEWARE and configure it with the N_PLUS_ONE dictionary in settings.py:
+# N_PLUS_ONE = {
+#     'ENABLED': True,
+#     'THRESHOLD': 5,   # executions of the same fingerprint allowed per request
+#     'RAISE': False,   # raise NPlusOneError instead of logging a warning, for the tests
+#     'IGNORE': [],     # regular expressions of fingerprints that are never reported
+# }
+# In tests it can also wrap any block of code: with detect_n_plus_one(threshold=2, raise_error=True): ...
+import logging
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD': 5,
+    'RAISE': False,
+    'IGNORE': [],
+}
+
+logger = logging.getLogger(__name__)
+
+# Single quoted literals ('' is an escaped quote), numbers that aren't part of a name, and the placeholders
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.\"`])-?\d+(?:\.\d+)?\b|%s|\?")
+# IN (?, ?, ?) has a different length for each number of values
+IN_LISTS = re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+# Statements of the transactions, they are repeated by design
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+PACKAGE_DIRS = ('site-packages', 'dist-packages')
+# Frames that run every statement, they don't say where it comes from
+SKIP_FILES = (__file__, str(Path(__file__).with_name('middleware.py')))
+ORM_DIR = str(Path('django', 'db'))
+
+
+def get_setting(name):
+    return getattr(settings, 'N_PLUS_ONE', {}).get(name, DEFAULTS[name])
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+# SELECT ... WHERE "store_customer"."id" = %s LIMIT 21 -> SELECT ... WHERE "store_customer"."id" = ? LIMIT ?
+def fingerprint(sql):
+    sql = SPACES.sub(' ', LITERALS.sub('?', sql)).strip()
+    return IN_LISTS.sub('IN (...)', sql)
+
+
+# Where the statement comes from: the innermost serializer field or admin column being rendered,
+# otherwise the innermost line of our own code, otherwise the innermost line outside the ORM
+def call_site():
+    frame = sys._getframe(2)
+    own_code = other_code = None
+    while frame is not None:
+        code = frame.f_code
+        local = frame.f_locals
+        # rest_framework Serializer.to_representation: for field in fields: ... field.get_attribute(instance)
+        if code.co_name == 'to_representation' and 'field' in local and hasattr(local.get('self'), 'fields'):
+            return f'{type(local["self"]).__name__}.{getattr(local["field"], "field_name", local["field"])}'
+        # django.contrib.admin items_for_result(): for field_index, field_name in enumerate(cl.list_display)
+        if code.co_name == 'items_for_result' and 'field_name' in local and 'cl' in local:
+            return f'{type(local["cl"].model_admin).__name__}.{local["field_name"]}'
+        if code.co_filename not in SKIP_FILES:
+            line = f'{code.co_filename}:{frame.f_lineno} in {code.co_name}'
+            if own_code is None and is_own_code(code.co_filename):
+                own_code = line
+            if other_code is None and ORM_DIR not in code.co_filename:
+                other_code = line
+        frame = frame.f_back
+    return own_code or other_code or 'unknown'
+
+
+def is_own_code(filename):
+    if any(part in filename for part in PACKAGE_DIRS):
+        return False
+    base_dir = getattr(settings, 'BASE_DIR', None)
+    return base_dir is None or filename.startswith(str(Path(base_dir)))
+
+
+# Callable for connection.execute_wrapper(), counts the fingerprints and the call sites of each one
+class NPlusOneDetector:
+    def __init__(self, threshold=None, ignore=None):
+        self.threshold = threshold if threshold is not None else get_setting('THRESHOLD')
+        self.ignore = [re.compile(pattern) for pattern in (ignore if ignore is not None else get_setting('IGNORE'))]
+        self.counts = Counter()
+        # {fingerprint: Counter({call site: executions})}
+        self.call_sites = {}
+        self.examples = {}
+    
+    def __call__(self, execute, sql, params, many, context):
+        self.record(sql)
+        return execute(sql, params, many, context)
+    
+    def record(self, sql):
+        if sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS):
+            return
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        self.call_sites.setdefault(key, Counter())[call_site()] += 1
+        self.examples.setdefault(key, sql)
+    
+    def problems(self):
+        return [
+            {'fingerprint': key, 'count': count, 'call_sites': self.call_sites[key].most_common(), 'example': self.examples[key]}
+            for key, count in self.counts.most_common()
+            if count > self.threshold and not any(pattern.search(key) for pattern in self.ignore)
+        ]
+    
+    def report(self, label=None):
+        lines = [f'N+1 queries{f" in {label}" if label else ""}:']
+        for problem in self.problems():
+            sites = ', '.join(f'{site} ({count})' for site, count in problem['call_sites'])
+            lines.append(f'  {problem["count"]} x {problem["fingerprint"]}\n    from {sites}')
+        return '\n'.join(lines)
+    
+    def check(self, label=None, raise_error=None):
+        if not self.problems():
+            return
+        raise_error = raise_error if raise_error is not None else get_setting('RAISE')
+        if raise_error:
+            raise NPlusOneError(self.report(label))
+        logger.warning(self.report(label))
+
+
+# The wrapper is installed in every database alias, so the reads sent to the replicas are also checked
+@contextmanager
+def detect_n_plus_one(label=None, threshold=None, raise_error=None, ignore=None):
+    detector = NPlusOneDetector(threshold, ignore)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(detector))
+        yield detector
+    detector.check(label, raise_error)
@@ -0,0 +1,82 @@
+# Read replica routing
+# ReplicaMiddleware decides for each request if its reads can go to a replica, and ReplicaRouter sends them there
+# Settings:
+# DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+# DATABASE_REPLICAS = ['replica']  Aliases of DATABASES that are replicas of 'default' (default: every alias except 'default')
+# REPLICA_STICKY_SECONDS = 5       After a write, the same client reads from the primary for this many seconds
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Cookie that marks a client that just wrote, it contains the time until it should read from the primary
+STICKY_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# ContextVar works like a thread local, but it also works with async requests
+use_replica = ContextVar('use_replica', default=False)
+
+
+def get_replicas():
+    replicas = getattr(settings, 'DATABASE_REPLICAS', None)
+    if replicas is None:
+        replicas = [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+    return replicas
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if use_replica.get() and replicas:
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+    
+    # Writes always go to the primary
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+    
+    # Every alias has the same data, so relations between objects loaded from different aliases are allowed
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+    
+    # Replicas receive the tables from the primary, we never migrate them directly
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False
+        return None
+
+
+# Views opt in with the class atribute read_from_replica = True (see store.views)
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        token = use_replica.set(False)
+        request.replica_sticky = self.is_sticky(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        
+        # The client just wrote, its next reads go to the primary so it can read its own writes
+        if request.method not in SAFE_METHODS:
+            sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds, httponly=True, samesite='Lax')
+        return response
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if (request.method in SAFE_METHODS 
+            and getattr(view_class, 'read_from_replica', False) 
+            and not request.replica_sticky):
+            use_replica.set(True)
+    
+    @staticmethod
+    def is_sticky(request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
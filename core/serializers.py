@@ -1,18 +1,84 @@
 # Importing serializer for UserCreation
+from django.contrib.auth import get_user_model
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer as BaseUCS, UserSerializer as BaseUS
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTOPS, TokenRefreshSerializer as BaseTRS
+from rest_framework_simplejwt.settings import api_settings
+from store.models import Customer
+
+from .authentication import is_revoked
 
 # Creating a custom serializer for registering users
 class UserCreateSerializer(BaseUCS):
     # We can access birth_date because we have a relationship with user in the Customer model
-    birth_date = serializers.DateField()
+    # write_only because the birth date is saved in the Customer, not in the User
+    birth_date = serializers.DateField(write_only=True)
     
     # Always is better to inherit all from a class and overwrite only the fields you need
     class Meta(BaseUCS.Meta):
         # Adding extra fields to the serializer
         fields = ['id', 'username', 'password', 'email', 'first_name', 'last_name', 'birth_date']
+    
+    # birth_date is not a User field, we take it out before djoser builds the User
+    def validate(self, attrs):
+        birth_date = attrs.pop('birth_date', None)
+        attrs = super().validate(attrs)
+        attrs['birth_date'] = birth_date
+        return attrs
+    
+    # The customer is created by the post_save signal of the user (store/signals/handlers.py), here we only save its birth_date
+    def perform_create(self, validated_data):
+        birth_date = validated_data.pop('birth_date', None)
+        with transaction.atomic():
+            user = super().perform_create(validated_data)
+            if birth_date is not None:
+                Customer.objects.filter(user=user).update(birth_date=birth_date)
+        return user
         
 # Custom serializer to show first and last name of current user
 class UserSerializer(BaseUS):
     class Meta(BaseUS.Meta):
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+# Claims used by StatelessJWTAuthentication (core/authentication.py)
+def add_claims(token, user):
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    token['customer_id'] = Customer.objects.filter(user=user).values_list('id', flat=True).first()
+    return token
+
+# Adding the claims to the tokens
+# They are added to the refresh token, and simplejwt copies them to every access token created from it
+class TokenObtainPairSerializer(BaseTOPS):
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
+
+# Refresh tokens issued before a revocation (the user was disabled or changed) are rejected, and the claims of the new
+# access token are read again from the database, instead of copying the ones of the refresh token
+class TokenRefreshSerializer(BaseTRS):
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_revoked(refresh):
+            raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        add_claims(refresh, user)
+        
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except AttributeError:
+                    # The blacklist app is not installed
+                    pass
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
@@ -0,0 +1,24 @@
+# Signal handlers, they are connected when the app is ready (see CoreConfig.ready)
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_delete
+from django.dispatch import receiver
+
+from core.authentication import revoke_tokens
+
+# Claims that are copied into the tokens, if they change the old tokens can't be trusted anymore
+TOKEN_FIELDS = ['is_active', 'is_staff', 'is_superuser']
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def revoke_tokens_on_change(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*TOKEN_FIELDS).first()
+    if old is not None and any(old[field] != getattr(instance, field) for field in TOKEN_FIELDS):
+        transaction.on_commit(lambda: revoke_tokens(instance.pk))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def revoke_tokens_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: revoke_tokens(instance.pk))
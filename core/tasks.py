@@ -0,0 +1,113 @@
+# Small background task queue, for the side effects that don't have to run inside the request (emails, alerts...)
+# task.delay() inserts a row in the Task table (outbox) in the current transaction: the workers only see it after the
+# commit, and a rollback discards it together with the data that produced it
+# manage.py run_workers executes the tasks in a pool of threads or processes, with retries and exponential backoff
+# Settings:
+# TASKS = {
+#     'MODE': 'thread',        # or 'process'
+#     'WORKERS': 4,
+#     'BATCH_SIZE': 20,        # tasks claimed per query
+#     'POLL_INTERVAL': 1,      # seconds to wait when the queue is empty
+#     'MAX_ATTEMPTS': 5,
+#     'BACKOFF': 2,            # seconds before the first retry, doubled on each attempt
+#     'MAX_BACKOFF': 600,
+#     'TIMEOUT': 600,          # seconds, running tasks older than this (dead worker) are executed again
+# }
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task as TaskRecord
+
+DEFAULTS = {
+    'MODE': 'thread',
+    'WORKERS': 4,
+    'BATCH_SIZE': 20,
+    'POLL_INTERVAL': 1,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2,
+    'MAX_BACKOFF': 600,
+    'TIMEOUT': 600,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TASKS', {}).get(name, DEFAULTS[name])
+
+
+# A function that can be executed by the workers, created with the @task decorator
+class TaskFunction:
+    def __init__(self, func, max_attempts=None):
+        self.func = func
+        self.max_attempts = max_attempts
+        self.name = f'{func.__module__}.{func.__name__}'
+        self.__doc__ = func.__doc__
+    
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+    
+    # Enqueues the task, the arguments must be JSON serializable (ids, not model instances)
+    def delay(self, *args, **kwargs):
+        return TaskRecord.objects.create(
+            name=self.name, args=list(args), kwargs=kwargs,
+            max_attempts=self.max_attempts or get_setting('MAX_ATTEMPTS'), run_at=timezone.now()
+        )
+
+
+# @task or @task(max_attempts=3)
+# def send_order_confirmation(order_id): ...
+# send_order_confirmation.delay(order.id)
+def task(func=None, max_attempts=None):
+    if func is None:
+        return lambda func: TaskFunction(func, max_attempts)
+    return TaskFunction(func, max_attempts)
+
+
+def backoff(attempts):
+    seconds = min(get_setting('BACKOFF') * 2 ** (attempts - 1), get_setting('MAX_BACKOFF'))
+    # Jitter, so the tasks that failed together don't retry together
+    return timedelta(seconds=seconds * random.uniform(0.5, 1))
+
+
+# Marks up to limit due tasks as running and returns their ids
+# skip_locked lets several run_workers claim batches at the same time without waiting for each other
+def claim(limit):
+    now = timezone.now()
+    expired = now - timedelta(seconds=get_setting('TIMEOUT'))
+    with transaction.atomic():
+        ids = list(
+            TaskRecord.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=TaskRecord.STATUS_PENDING, run_at__lte=now) | Q(status=TaskRecord.STATUS_RUNNING, locked_at__lt=expired))
+            .order_by('run_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        TaskRecord.objects.filter(pk__in=ids).update(status=TaskRecord.STATUS_RUNNING, locked_at=now)
+    return ids
+
+
+# Runs a claimed task and saves the result, it's called from the threads or processes of the pool
+def execute(task_id):
+    close_old_connections()
+    record = TaskRecord.objects.get(pk=task_id)
+    attempts = record.attempts + 1
+    try:
+        func = import_string(record.name)
+        func(*record.args, **record.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if attempts < record.max_attempts:
+            TaskRecord.objects.filter(pk=task_id).update(
+                status=TaskRecord.STATUS_PENDING, attempts=attempts, last_error=error,
+                run_at=timezone.now() + backoff(attempts), locked_at=None
+            )
+        else:
+            TaskRecord.objects.filter(pk=task_id).update(status=TaskRecord.STATUS_FAILED, attempts=attempts, last_error=error, finished_at=timezone.now())
+        return False
+    TaskRecord.objects.filter(pk=task_id).update(status=TaskRecord.STATUS_DONE, attempts=attempts, finished_at=timezone.now())
+    return True
@@ -1,3 +1,284 @@
-from django.test import TestCase
+import importlib
+import os
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, modify_settings, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from store.models import Cart, Collection, Customer, Product
+from store.permissions import IsAdminOrReadOnly
+from store.views import CustomerViewSet
+
+from .authentication import StatelessJWTAuthentication, revoke_tokens, user_cache
+from .instrumentation import QueryRecorder, QueryStatsStore, query_stats
+from .nplusone import NPlusOneDetector, fingerprint
+from .replicas import ReplicaRouter, use_replica
+from .serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+
+
+class FingerprintTests(SimpleTestCase):
+    def test_values_are_removed(self):
+        self.assertEqual(
+            fingerprint('SELECT "store_customer"."id" FROM "store_customer"  WHERE "store_customer"."id" = %s LIMIT 21'),
+            'SELECT "store_customer"."id" FROM "store_customer" WHERE "store_customer"."id" = ? LIMIT ?'
+        )
+        self.assertEqual(fingerprint("SELECT 1 FROM t2 WHERE name = 'O''Brien' AND price > 9.99"), 'SELECT ? FROM t2 WHERE name = ? AND price > ?')
+    
+    def test_in_lists_of_any_length_are_the_same(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'), fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s, %s)'))
+    
+    def test_threshold_and_ignore(self):
+        detector = NPlusOneDetector(threshold=2, ignore=[r'django_session'])
+        for i in range(3):
+            detector.record(f'SELECT * FROM store_product WHERE id = {i}')
+            detector.record(f'SELECT * FROM django_session WHERE session_key = \'{i}\'')
+            detector.record(f'SAVEPOINT "s1_x{i}"')
+        detector.record('SELECT * FROM store_collection')
+        self.assertEqual([problem['fingerprint'] for problem in detector.problems()], ['SELECT * FROM store_product WHERE id = ?'])
+
+
+class QueryRecorderTests(SimpleTestCase):
+    def test_keeps_the_slowest_statements(self):
+        recorder = QueryRecorder(slowest=2)
+        for sql, duration in [('a', 0.003), ('b', 0.001), ('c', 0.005), ('d', 0.002)]:
+            recorder.record(sql, duration)
+        self.assertEqual(recorder.count, 4)
+        self.assertAlmostEqual(recorder.total_ms, 11)
+        self.assertEqual([statement['sql'] for statement in recorder.slowest_statements()], ['c', 'a'])
+    
+    def test_window_drops_the_old_minutes(self):
+        store = QueryStatsStore()
+        recorder = QueryRecorder()
+        recorder.record('SELECT 1', 0.002)
+        with override_settings(QUERY_INSTRUMENTATION={'WINDOW': 120}):
+            with mock.patch('core.instrumentation.time.time', return_value=600):
+                store.add('ProductViewSet.list', recorder)
+                store.add('ProductViewSet.list', recorder)
+            with mock.patch('core.instrumentation.time.time', return_value=660):
+                stats = store.snapshot()['ProductViewSet.list']
+                self.assertEqual((stats['requests'], stats['queries'], stats['db_ms_histogram']['<=5']), (2, 2, 2))
+            with mock.patch('core.instrumentation.time.time', return_value=800):
+                self.assertEqual(store.snapshot(), {})
+
+
+@override_settings(QUERY_INSTRUMENTATION={'RESPONSE_HEADERS': True})
+@modify_settings(MIDDLEWARE={'prepend': 'core.middleware.QueryInstrumentationMiddleware'})
+class QueryInstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        Product.objects.create(title='Product', slug='product', inventory=20, unit_price=1, collection=collection)
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.user = User.objects.create_user('user', 'user@example.com', 'password')
+    
+    def setUp(self):
+        cache.clear()
+        query_stats.clear()
+    
+    def test_headers_and_stats_by_view_and_action(self):
+        for i in range(2):
+            response = self.client.get(reverse('products-list'))
+            self.assertEqual(response['X-DB-View'], 'ProductViewSet.list')
+            self.assertGreater(int(response['X-DB-Query-Count']), 0)
+        response = self.client.get(reverse('products-detail', args=[1000]))
+        self.assertEqual(response['X-DB-View'], 'ProductViewSet.retrieve')
+        
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        stats = api.get(reverse('query-stats')).data
+        self.assertEqual(set(stats), {'ProductViewSet.list', 'ProductViewSet.retrieve'})
+        product_list = stats['ProductViewSet.list']
+        self.assertEqual(product_list['requests'], 2)
+        self.assertEqual(sum(product_list['db_ms_histogram'].values()), 2)
+        self.assertLessEqual(len(product_list['slowest']), 3)
+        self.assertEqual(product_list['slowest'], sorted(product_list['slowest'], key=lambda statement: statement['ms'], reverse=True))
+    
+    def test_stats_are_staff_only(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        self.assertEqual(api.get(reverse('query-stats')).status_code, 403)
+    
+    @override_settings(QUERY_INSTRUMENTATION={'RESPONSE_HEADERS': True, 'SAMPLE_RATE': 0})
+    def test_requests_that_are_not_sampled(self):
+        response = self.client.get(reverse('products-list'))
+        self.assertNotIn('X-DB-View', response)
+        self.assertEqual(query_stats.snapshot(), {})
+
+
+# storefront.settings_api serves the API with its own URLconf, registration and the profile stay available
+class ApiUrlsTests(SimpleTestCase):
+    def test_djoser_user_and_jwt_routes(self):
+        for name, url in [('user-list', '/auth/users/'), ('user-me', '/auth/users/me/'), ('jwt-create', '/auth/jwt/create')]:
+            self.assertEqual(reverse(name, urlconf='storefront.urls_api'), url)
+
+
+# The settings modules are imported again with other environment variables, the settings in use don't change
+class SettingsProfileTests(SimpleTestCase):
+    def load(self, module, **environ):
+        with mock.patch.dict(os.environ, environ):
+            import storefront.settings_connections
+            importlib.reload(storefront.settings_connections)
+            return importlib.reload(importlib.import_module(module))
+    
+    def test_connection_profile_alone(self):
+        settings_module = self.load('storefront.settings_connections', DB_CONNECTIONS='persistent')
+        self.assertTrue(all(database['CONN_MAX_AGE'] == 60 for database in settings_module.DATABASES.values()))
+        self.assertEqual(settings_module.REST_FRAMEWORK, importlib.import_module('storefront.settings').REST_FRAMEWORK)
+        self.assertNotIn('core.replicas.ReplicaRouter', getattr(settings_module, 'DATABASE_ROUTERS', []))
+    
+    def test_api_optimizations_can_be_disabled_one_by_one(self):
+        settings_module = self.load('storefront.settings_api', DB_CONNECTIONS='persistent', API_REPLICAS='0', API_FAST_JSON='0')
+        self.assertNotIn('core.replicas.ReplicaRouter', getattr(settings_module, 'DATABASE_ROUTERS', []))
+        self.assertNotIn('store.renderers.FastJSONRenderer', settings_module.REST_FRAMEWORK.get('DEFAULT_RENDERER_CLASSES', []))
+        self.assertEqual(settings_module.REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'], ['core.authentication.StatelessJWTAuthentication'])
+        self.assertTrue(all(database['CONN_MAX_AGE'] == 60 for database in settings_module.DATABASES.values()))
+
+
+# The views read DEFAULT_AUTHENTICATION_CLASSES when they are imported, the setting of storefront.settings_api is patched in the view
+@mock.patch.object(CustomerViewSet, 'authentication_classes', [StatelessJWTAuthentication])
+class StatelessJWTTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+    
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.api = APIClient()
+        access = TokenObtainPairSerializer.get_token(self.user).access_token
+        self.authorization = f'{jwt_settings.AUTH_HEADER_TYPES[0]} {access}'
+        self.api.credentials(HTTP_AUTHORIZATION=self.authorization)
+    
+    def me(self):
+        return self.api.get(reverse('customer-me'))
+    
+    def test_authenticated_request_without_queries(self):
+        self.assertEqual(self.me().status_code, 200)
+        # The profile is cached now, the user and the customer come from the claims
+        with self.assertNumQueries(0):
+            response = self.me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user_id'], self.user.pk)
+    
+    def test_permissions_use_the_claims(self):
+        customer_id = Customer.objects.get(user=self.user).pk
+        request = APIRequestFactory().post('/store/collections/', HTTP_AUTHORIZATION=self.authorization)
+        with self.assertNumQueries(0):
+            user, token = StatelessJWTAuthentication().authenticate(request)
+            request.user = user
+            self.assertTrue(IsAdminOrReadOnly().has_permission(request, None))
+            # simplejwt writes the user id claim as a string
+            self.assertEqual((user.id, user.customer_id), (str(self.user.pk), customer_id))
+        # Other atributes load the user once
+        with self.assertNumQueries(1):
+            self.assertEqual((user.email, user.email), ('staff@example.com', 'staff@example.com'))
+    
+    def test_revoked_token_is_rejected(self):
+        self.assertEqual(self.me().status_code, 200)
+        revoke_tokens(self.user.pk)
+        response = self.me()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_revoked')
+    
+    def test_tokens_are_revoked_when_the_user_loses_is_staff(self):
+        self.user.is_staff = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.me().status_code, 401)
+
+
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.refresh = str(TokenObtainPairSerializer.get_token(self.user))
+    
+    def demote(self):
+        self.user.is_staff = False
+        # The revocation is saved after the commit (core/signals/handlers.py)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+    
+    def refresh_access(self):
+        serializer = TokenRefreshSerializer(data={'refresh': self.refresh})
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['access']
+    
+    def test_refresh_copies_fresh_claims(self):
+        access = StatelessJWTAuthentication().get_validated_token(self.refresh_access())
+        self.assertTrue(access['is_staff'])
+    
+    def test_demoted_user_cannot_refresh(self):
+        self.demote()
+        with self.assertRaises(AuthenticationFailed):
+            self.refresh_access()
+    
+    def test_claims_are_read_again_when_minting(self):
+        self.demote()
+        # Without the revocation entry (ex: it expired), the new access token still gets the current claims
+        cache.clear()
+        access = StatelessJWTAuthentication().get_validated_token(self.refresh_access())
+        self.assertFalse(access['is_staff'])
+    
+    def test_disabled_user_cannot_refresh(self):
+        self.user.is_active = False
+        self.user.save()
+        cache.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.refresh_access()
+
+
+# Needs the 'replica' alias of storefront.settings_test: python manage.py test --settings=storefront.settings_test
+# Both files have the same tables and different rows, the titles in the responses show which one answered
+@skipUnless('replica' in settings.DATABASES, 'needs the replica database of storefront.settings_test')
+@override_settings(DATABASE_ROUTERS=['core.replicas.ReplicaRouter'], DATABASE_REPLICAS=['replica'])
+@modify_settings(MIDDLEWARE={'append': 'core.replicas.ReplicaMiddleware'})
+class ReplicaTests(TestCase):
+    # The test runner sets up the databases of the skipped classes too
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+    
+    @classmethod
+    def setUpTestData(cls):
+        Collection.objects.using('default').create(title='Primary')
+        Collection.objects.using('replica').create(title='Replica')
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+    
+    def setUp(self):
+        self.api = APIClient()
+    
+    def collection_titles(self):
+        response = self.api.get(reverse('collection-list'))
+        self.assertEqual(response.status_code, 200)
+        return sorted(collection['title'] for collection in response.data)
+    
+    def test_safe_reads_of_catalog_views_use_the_replica(self):
+        self.assertEqual(self.collection_titles(), ['Replica'])
+    
+    def test_other_views_read_the_primary(self):
+        cart = Cart.objects.using('default').create()
+        self.assertEqual(self.api.get(reverse('cart-detail', args=[cart.pk])).status_code, 200)
+    
+    def test_writes_go_to_the_primary_and_pin_the_next_reads(self):
+        self.api.force_authenticate(self.admin)
+        response = self.api.post(reverse('collection-list'), {'title': 'New'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Collection.objects.using('default').filter(title='New').exists())
+        self.assertFalse(Collection.objects.using('replica').filter(title='New').exists())
+        # The sticky cookie sends the reads of this client to the primary, it reads its own write
+        self.assertEqual(self.collection_titles(), ['New', 'Primary'])
+        self.api.cookies.clear()
+        self.assertEqual(self.collection_titles(), ['Replica'])
+    
+    def test_the_pin_is_cleared_after_each_request(self):
+        self.collection_titles()
+        self.assertFalse(use_replica.get())
+        self.assertEqual(ReplicaRouter().db_for_read(Collection), 'default')
+        self.assertEqual(ReplicaRouter().db_for_write(Collection), 'default')
 
-# Create your tests here.
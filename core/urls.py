@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+# Operational endpoints, mounted on /metrics/
+urlpatterns = [
+    path('queries/', views.query_stats_view, name='query-stats'),
+    path('caches/', views.cache_stats_view, name='cache-stats'),
+]
@@ -1,3 +1,21 @@
-from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 
-# Create your views here.
+from store.caches import cache_stats
+
+from .instrumentation import query_stats
+
+
+# Staff only endpoint that shows the query statistics of this worker for the last QUERY_INSTRUMENTATION['WINDOW'] seconds
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def query_stats_view(request):
+    return Response(query_stats.snapshot())
+
+
+# Staff only endpoint with the hit/miss statistics of the in-process caches of this worker
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats_view(request):
+    return Response(cache_stats())
@@ -32,7 +32,7 @@ from tags.models import TaggedItem
 def say_hello(request):
     # Pull data from db
     # Transform
-    # Send email
+    # Send email -> side effects like emails are background tasks (core/tasks.py), ex: send_order_confirmation.delay(order.id)
     # A basic way to return a httpresponse
     return HttpResponse('Hello World')
 
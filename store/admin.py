@@ -1,19 +1,31 @@
 # It's useful to sort your imports by alphabeth
 
+from decimal import Decimal
+
+from django import forms
 from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db.models import DecimalField, F, Value
 from django.db.models.aggregates import Count
+from django.db.models.functions import Greatest, Least, Now, Round
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 # Importing models module from the same directory
 from . import models
+from .archive import customer_orders_count, restore_orders
+from .autocomplete import PrefixIndexAdminMixin, collection_title_index, customer_name_index, product_title_index
+from .jobs import start_job
+from .tasks import alert_low_inventory
 
 # Here you can customize the admin interfaz of this app
     
 # Registering Collection model, now it will be displayed in the admin interfaz
 @admin.register(models.Collection)
-class CollectionAdmin(admin.ModelAdmin):
+class CollectionAdmin(PrefixIndexAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'products_count']
     search_fields = ['title']
+    # ProductAdmin.autocomplete_fields searches the in-memory index (store/autocomplete.py)
+    autocomplete_index = collection_title_index
     
     # Adding a Computed Column
     @admin.display(ordering='products_count')
@@ -59,9 +71,38 @@ class InventoryFilter(admin.SimpleListFilter):
         if self.value() == '<10':
             return queryset.filter(inventory__lt=10)
 
+# Extra fields shown next to the actions dropdown, used by the price and collection actions
+class ProductActionForm(ActionForm):
+    value = forms.DecimalField(required=False, max_digits=8, decimal_places=2, help_text='Percentage or amount')
+    collection = forms.ModelChoiceField(queryset=models.Collection.objects.all(), required=False)
+
+# New price as an SQL expression, rounded and kept inside the limits of unit_price (1 - 9999.99)
+def bounded_price(expression):
+    price_field = DecimalField(max_digits=6, decimal_places=2)
+    return Least(Greatest(Round(expression, 2, output_field=price_field), Value(Decimal('1.00'))), Value(Decimal('9999.99')), output_field=price_field)
+
+# Chunk functions of the bulk actions, the task workers import them by their dotted path (store/jobs.py)
+# update() doesn't change auto_now fields, we set last_update so the product caches see the change
+def clear_inventory_chunk(chunk):
+    chunk.update(inventory=0, last_update=Now())
+    # update() doesn't send post_save
+    alert_low_inventory(chunk.values_list('pk', flat=True))
+
+def move_to_collection_chunk(chunk, collection_id):
+    chunk.update(collection_id=collection_id, last_update=Now())
+
+# The change is a JSON string (Decimal), price_with_tax is calculated from the new price in the same UPDATE
+def change_price_chunk(chunk, percentage=None, amount=None):
+    if percentage is not None:
+        price = bounded_price(F('unit_price') * (1 + Decimal(percentage) / 100))
+    else:
+        price = bounded_price(F('unit_price') + Decimal(amount))
+    rate = models.TaxRate.objects.current_rate()
+    chunk.update(unit_price=price, price_with_tax=models.price_with_tax_expression(rate, price), last_update=Now())
+
 # In this class we can specify how we want to view/edit our products
 # For convention you need to use ModelnameAdmin
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(PrefixIndexAdminMixin, admin.ModelAdmin):
     # Customizing Forms (a form to add new objects to the db)
     # Autocomplete the field with a search method from the model
     autocomplete_fields = ['collection']
@@ -73,8 +114,12 @@ class ProductAdmin(admin.ModelAdmin):
     # readonly_fields to converte a field to read only, fields to select the fields to show
     exclude = ['promotions']
     # List of actions
-    actions = ['clear_inventory']
+    # They run in the background in chunks (store/jobs.py), the progress can be followed in Bulk jobs
+    actions = ['clear_inventory', 'change_price_by_percentage', 'change_price_by_amount', 'move_to_collection']
+    action_form = ProductActionForm
     search_fields = ['title']
+    # OrderItemInline.autocomplete_fields searches the in-memory index (store/autocomplete.py)
+    autocomplete_index = product_title_index
     # What fileds will be diaplayed
     list_display = ['title', 'unit_price', 'inventory_status', 'collection_title']
     # What field will de editable
@@ -104,31 +149,105 @@ class ProductAdmin(admin.ModelAdmin):
     # Name of the action
     def clear_inventory(self, request, queryset):
         # Actual action
-        updated_count = queryset.update(inventory=0)
+        self.start_job(request, 'Clear inventory', queryset, 'store.admin.clear_inventory_chunk')
+    
+    @admin.action(description='Change price by percentage')
+    def change_price_by_percentage(self, request, queryset):
+        percentage = self.get_action_value(request, 'value')
+        if percentage is None:
+            return
+        self.start_job(request, f'Change price by {percentage}%', queryset, 'store.admin.change_price_chunk', {'percentage': str(percentage)})
+    
+    @admin.action(description='Change price by amount')
+    def change_price_by_amount(self, request, queryset):
+        amount = self.get_action_value(request, 'value')
+        if amount is None:
+            return
+        self.start_job(request, f'Change price by {amount}', queryset, 'store.admin.change_price_chunk', {'amount': str(amount)})
+    
+    @admin.action(description='Move to collection')
+    def move_to_collection(self, request, queryset):
+        collection = self.get_action_value(request, 'collection')
+        if collection is None:
+            return
+        self.start_job(request, f'Move to collection {collection}', queryset, 'store.admin.move_to_collection_chunk', {'collection_id': collection.pk})
+    
+    def get_action_value(self, request, field):
+        form = self.action_form(request.POST)
+        # The admin fills the action choices when it shows the form, we need them to validate it
+        form.fields['action'].choices = self.get_action_choices(request)
+        if not form.is_valid() or form.cleaned_data.get(field) is None:
+            self.message_user(request, f'Please fill the {field} field next to the action.', messages.ERROR)
+            return None
+        return form.cleaned_data[field]
+    
+    def start_job(self, request, description, queryset, function, params=None):
+        job = start_job(description, queryset, function, params, user=request.user)
+        url = reverse('admin:store_bulkjob_change', args=[job.pk])
         # Shows a message to the user when the action is aplied
         self.message_user(
-            request, 
-            f'{updated_count} products were succcessfully updated.',
+            request,
+            format_html('{} products will be updated in the background. <a href="{}">Follow the progress</a>.', job.total, url),
             # Type of message
-            messages.ERROR
+            messages.INFO
         )
         
 # Registering Product model with its ProductAdmin class
 admin.site.register(models.Product, ProductAdmin)
 
 
+# Read only page to follow the progress of the bulk actions
+@admin.register(models.BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ['description', 'status', 'progress', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status']
+    list_select_related = ['created_by']
+    readonly_fields = ['description', 'status', 'progress', 'total', 'processed', 'error', 'created_by', 'created_at', 'finished_at']
+    
+    @admin.display()
+    def progress(self, job):
+        if not job.total:
+            return '100%'
+        return f'{job.processed * 100 // job.total}%'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+# Changing the storefront rate recalculates every product price_with_tax
+@admin.register(models.TaxRate)
+class TaxRateAdmin(admin.ModelAdmin):
+    list_display = ['id', 'rate']
+    list_editable = ['rate']
+    
+    # A single row, there is nothing to choose between several rates
+    def has_add_permission(self, request):
+        return not models.TaxRate.objects.exists()
+
 # You can also register the model with a decorator
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(PrefixIndexAdminMixin, admin.ModelAdmin):
     autocomplete_fields = ['user']
+    # OrderAdmin.autocomplete_fields searches the in-memory index (store/autocomplete.py)
+    autocomplete_index = customer_name_index
     list_display = ['user__first_name', 'user__last_name', 'membership', 'orders_count']
     list_editable = ['membership']
     list_per_page = 10
     list_select_related = ['user']
     ordering = ['user__first_name', 'user__last_name']
     # Adding Search to the List Page
-    # __istartswith Is a lookup to indicate no-sesitive string start
-    search_fields = ['first_name__istartswith', 'last_name__istartswith']
+    # The names and the email are in core.User, the search uses the indexed normalized columns of Customer instead
+    # of a case insensitive LIKE across the join (see get_search_results and CustomerQuerySet.search)
+    search_fields = ['search_first_name', 'search_last_name', 'search_email', 'search_phone']
+    search_help_text = 'Start of the first name, last name, email or phone'
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or request.path.endswith('/autocomplete/'):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.search(search_term), False
+    
     @admin.display(ordering='orders_count')
     def orders_count(self, customer):
         url = (
@@ -140,8 +259,9 @@ class CustomerAdmin(admin.ModelAdmin):
         return format_html('<a href="{}">{}</a>', url, customer.orders_count)
     
     def get_queryset(self, request):
+        # Orders in the hot table and in the archive (store/archive.py)
         return super().get_queryset(request).annotate(
-            orders_count=Count('order')
+            orders_count=customer_orders_count()
             )
 
 # Editing Childs Using Inlines
@@ -166,3 +286,34 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['id','placed_at', 'payment_status', 'customer']
     list_per_page = 10
     
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = models.ArchivedOrderItem
+    fields = ['product', 'quantity', 'unit_price']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+# Read only view of the archived orders (store/archive.py), they can be moved back to the orders with the restore action
+@admin.register(models.ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    inlines = [ArchivedOrderItemInline]
+    list_display = ['id', 'placed_at', 'payment_status', 'customer', 'archived_at']
+    list_filter = ['payment_status']
+    list_per_page = 10
+    list_select_related = ['customer__user']
+    readonly_fields = ['id', 'placed_at', 'customer', 'payment_status', 'archived_at']
+    actions = ['restore']
+    
+    @admin.action(description='Restore selected orders')
+    def restore(self, request, queryset):
+        orders, items = restore_orders(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'{orders} orders restored.', messages.SUCCESS)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
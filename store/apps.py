@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+    
+    # Connecting our signal handlers when the app is loaded
+    def ready(self) -> None:
+        import store.signals.handlers
@@ -0,0 +1,141 @@
+# Archiving of old orders: Complete and Failed orders placed before a cutoff are moved with their items from
+# Order/OrderItem to ArchivedOrder/ArchivedOrderItem, so the hot tables (admin changelists, counts, guards) stay small
+# Each batch is moved in its own transaction, rows locked by other transactions are skipped and moved in a later run
+# The order history and the analytics read both tables with the functions of this module
+# Settings: ORDER_ARCHIVE = {'AFTER_DAYS': 365, 'BATCH_SIZE': 1000}
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+DEFAULTS = {
+    'AFTER_DAYS': 365,
+    'BATCH_SIZE': 1000,
+}
+
+ORDER_FIELDS = ['id', 'placed_at', 'customer_id', 'payment_status']
+ORDER_ITEM_FIELDS = ['id', 'order_id', 'product_id', 'quantity', 'unit_price']
+# Only finished orders are archived, pending orders can still change
+ARCHIVABLE_STATUSES = [Order.PS_COMPLETE, Order.PS_FAILED]
+
+
+def get_setting(name):
+    return getattr(settings, 'ORDER_ARCHIVE', {}).get(name, DEFAULTS[name])
+
+
+# Copies the rows of the given ids from one pair of tables to the other and deletes them from the source
+def move_batch(ids, source_order, source_item, target_order, target_item):
+    orders = list(source_order.objects.filter(pk__in=ids).values(*ORDER_FIELDS))
+    items = list(source_item.objects.filter(order_id__in=ids).values(*ORDER_ITEM_FIELDS))
+    target_order.objects.bulk_create([target_order(**order) for order in orders])
+    # bulk_create runs pre_save, that sets auto_now_add fields (Order.placed_at) to now, the original dates are written back
+    if target_order._meta.get_field('placed_at').auto_now_add:
+        target_order.objects.bulk_update([target_order(**order) for order in orders], ['placed_at'])
+    target_item.objects.bulk_create([target_item(**item) for item in items])
+    # Items first, OrderItem.order is PROTECT
+    source_item.objects.filter(order_id__in=ids).delete()
+    source_order.objects.filter(pk__in=ids).delete()
+    return len(orders), len(items)
+
+
+def archive_orders(before=None, batch_size=None, log=None):
+    """
+    Moves the Complete and Failed orders placed before `before` (default: ORDER_ARCHIVE['AFTER_DAYS'] ago) to the archive
+    Returns (orders, items) moved
+    """
+    before = before or timezone.now() - timedelta(days=get_setting('AFTER_DAYS'))
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    log = log or (lambda message: None)
+    total_orders = total_items = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # Keyset over the id, skip_locked leaves the orders that are being changed right now for the next run
+            ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(pk__gt=last_id, payment_status__in=ARCHIVABLE_STATUSES, placed_at__lt=before)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            orders, items = move_batch(ids, Order, OrderItem, ArchivedOrder, ArchivedOrderItem)
+        last_id = ids[-1]
+        total_orders += orders
+        total_items += items
+        log(f'Archived {total_orders} orders, {total_items} items')
+    return total_orders, total_items
+
+
+def restore_orders(ids, batch_size=None):
+    """
+    Moves archived orders back to Order/OrderItem, with the same ids. Returns (orders, items) restored
+    """
+    ids = list(ids)
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    total_orders = total_items = 0
+    for start in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            orders, items = move_batch(ids[start:start + batch_size], ArchivedOrder, ArchivedOrderItem, Order, OrderItem)
+        total_orders += orders
+        total_items += items
+    return total_orders, total_items
+
+
+# Order history and analytics: values() of both tables with UNION ALL, the same columns in the same order
+def order_rows(*fields, **filters):
+    fields = fields or ORDER_FIELDS
+    return Order.objects.filter(**filters).order_by().values_list(*fields) \
+        .union(ArchivedOrder.objects.filter(**filters).order_by().values_list(*fields), all=True)
+
+
+def order_item_rows(*fields, **filters):
+    fields = fields or ORDER_ITEM_FIELDS
+    return OrderItem.objects.filter(**filters).order_by().values_list(*fields) \
+        .union(ArchivedOrderItem.objects.filter(**filters).order_by().values_list(*fields), all=True)
+
+
+# Annotation with the number of orders of each customer in both tables, ex: Customer.objects.annotate(orders_count=...)
+# Two correlated subqueries instead of two joins, that would multiply the rows
+def customer_orders_count():
+    def count(model):
+        orders = model.objects.filter(customer=OuterRef('pk')).order_by().values('customer').annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(orders, output_field=IntegerField()), 0)
+    return count(Order) + count(ArchivedOrder)
+
+
+def product_has_orders(product_id):
+    return OrderItem.objects.filter(product_id=product_id).exists() or ArchivedOrderItem.objects.filter(product_id=product_id).exists()
+
+
+# Rows and bytes of the table and of its indexes, the bytes are None when the database doesn't report them
+def table_size(model):
+    table = model._meta.db_table
+    rows = model.objects.count()
+    data_bytes = index_bytes = None
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_relation_size(%s), pg_indexes_size(%s)', [table, table])
+            data_bytes, index_bytes = cursor.fetchone()
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT data_length, index_length FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', [table])
+            data_bytes, index_bytes = cursor.fetchone() or (None, None)
+        elif connection.vendor == 'sqlite':
+            # dbstat is only available when SQLite is compiled with SQLITE_ENABLE_DBSTAT_VTAB
+            try:
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+                data_bytes = cursor.fetchone()[0]
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s)', ['index', table])
+                index_bytes = cursor.fetchone()[0] or 0
+            except Exception:
+                pass
+    return {'table': table, 'rows': rows, 'data_bytes': data_bytes, 'index_bytes': index_bytes}
+
+
+def size_report():
+    return [table_size(model) for model in (Order, OrderItem, ArchivedOrder, ArchivedOrderItem)]
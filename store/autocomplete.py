@@ -0,0 +1,195 @@
+# Typeahead autocomplete of products, collections and customers from in-memory sorted prefix indexes
+# Titles are entries as a whole, like the LOWER(title) range of the database fallback, so a cold and a warm worker return
+# the same matches. Customer names have an entry per word start ("Ada Lovelace" has "ada lovelace" and "lovelace"), like
+# the first and last name prefixes of Customer.objects.search
+# The entries are kept sorted so the matches of a prefix are a contiguous range found with a binary search
+# The indexes are loaded in a background thread, while a worker doesn't have one (cold) the search falls back to a
+# range query on the LOWER(title) expression indexes (istartswith can't use an index: LIKE on SQLite, UPPER() on
+# Postgres). The signal handlers apply the changes to the index of the worker that made them and bump the shared
+# version, so the other workers reload it in the background
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.db import connections
+from django.db.models.functions import Lower
+
+from .caches import VersionedLocalCache, bump_version, get_version
+
+# Entries are cut to this length, longer searches match on their first MAX_KEY_LENGTH characters
+MAX_KEY_LENGTH = 40
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+def keys(label, word_starts=False):
+    words = normalize(label).split(' ')
+    if not word_starts:
+        return {' '.join(words)[:MAX_KEY_LENGTH]} if words[0] else set()
+    return {' '.join(words[start:])[:MAX_KEY_LENGTH] for start in range(len(words)) if words[start]}
+
+
+# lower(title) starts with term: lower(title) >= 'cof' AND lower(title) < 'cog', a range scan of the expression index
+# The LIKE filter only removes the false positives of non binary collations, ex: 'co-f' sorts between 'cof' and 'cog'
+def title_prefix(queryset, term):
+    prefix = ' '.join(term.lower().split())
+    queryset = queryset.alias(title_key=Lower('title')).order_by('title_key')
+    if not prefix:
+        return queryset
+    return queryset.filter(title_key__gte=prefix, title_key__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1), title_key__startswith=prefix)
+
+
+class PrefixIndex(VersionedLocalCache):
+    # An entry per word start of the label, or only the whole label
+    word_starts = False
+    
+    def __init__(self):
+        super().__init__()
+        self.loading = False
+    
+    # Subclasses return (id, label) for every object
+    def rows(self):
+        raise NotImplementedError
+    
+    # Subclasses return [(id, label)] from the database, for the cold index
+    def fallback(self, term, limit):
+        raise NotImplementedError
+    
+    # {'entries': sorted [(key, id)], 'labels': {id: label}}
+    def load(self):
+        labels = dict(self.rows())
+        entries = sorted((key, id) for id, label in labels.items() for key in keys(label, self.word_starts))
+        return {'entries': entries, 'labels': labels}
+    
+    def load_in_background(self):
+        def run():
+            try:
+                version = get_version(self.version_key)
+                data = self.load()
+                with self.lock:
+                    self.data = data
+                    self.version = version
+            finally:
+                self.loading = False
+                # The thread has its own database connections
+                connections.close_all()
+        
+        with self.lock:
+            if self.loading:
+                return
+            self.loading = True
+        threading.Thread(target=run, name=f'{type(self).__name__}-load', daemon=True).start()
+    
+    # Like get_data(), but it never waits for a load: a stale index is used while the new one loads, and a cold one returns None
+    def get_data_nowait(self):
+        now = time.monotonic()
+        with self.lock:
+            data = self.data
+            if data is None or now - self.checked_at > self.check_interval:
+                self.checked_at = now
+                if data is None or get_version(self.version_key) != self.version:
+                    self.load_in_background()
+        return data
+    
+    def search_index(self, data, term, limit):
+        prefix = normalize(term)[:MAX_KEY_LENGTH]
+        entries = data['entries']
+        results = {}
+        position = bisect_left(entries, (prefix,))
+        while position < len(entries) and len(results) < limit and entries[position][0].startswith(prefix):
+            id = entries[position][1]
+            results.setdefault(id, data['labels'][id])
+            position += 1
+        return list(results.items())
+    
+    # Returns ([(id, label)], source) with the first limit matches of term
+    def search(self, term, limit=10):
+        data = self.get_data_nowait()
+        if data is None:
+            return self.fallback(term, limit), 'database'
+        return self.search_index(data, term, limit), 'index'
+    
+    # Called by the signal handlers after the commit, label=None removes the object
+    def update(self, id, label):
+        with self.lock:
+            version = bump_version(self.version_key)
+            if self.data is None:
+                return
+            entries = self.data['entries']
+            old_label = self.data['labels'].pop(id, None)
+            if old_label is not None:
+                for key in keys(old_label, self.word_starts):
+                    position = bisect_left(entries, (key, id))
+                    if position < len(entries) and entries[position] == (key, id):
+                        del entries[position]
+            if label is not None:
+                self.data['labels'][id] = label
+                for key in keys(label, self.word_starts):
+                    insort(entries, (key, id))
+            self.version = version
+
+
+class ProductTitleIndex(PrefixIndex):
+    version_key = 'store:autocomplete:products:version'
+    
+    def rows(self):
+        from .models import Product
+        return Product.objects.values_list('id', 'title').iterator(chunk_size=10000)
+    
+    def fallback(self, term, limit):
+        from .models import Product
+        return list(title_prefix(Product.objects.all(), term).values_list('id', 'title')[:limit])
+
+
+class CollectionTitleIndex(PrefixIndex):
+    version_key = 'store:autocomplete:collections:version'
+    
+    def rows(self):
+        from .models import Collection
+        return Collection.objects.values_list('id', 'title')
+    
+    def fallback(self, term, limit):
+        from .models import Collection
+        return list(title_prefix(Collection.objects.all(), term).values_list('id', 'title')[:limit])
+
+
+def customer_label(first_name, last_name):
+    return f'{first_name} {last_name}'.strip()
+
+
+class CustomerNameIndex(PrefixIndex):
+    version_key = 'store:autocomplete:customers:version'
+    word_starts = True
+    
+    def rows(self):
+        from .models import Customer
+        rows = Customer.objects.values_list('id', 'user__first_name', 'user__last_name').iterator(chunk_size=10000)
+        return ((id, customer_label(first_name, last_name)) for id, first_name, last_name in rows)
+    
+    def fallback(self, term, limit):
+        from .models import Customer
+        rows = Customer.objects.search(term) \
+            .order_by('user__first_name', 'user__last_name') \
+            .values_list('id', 'user__first_name', 'user__last_name')[:limit]
+        return [(id, customer_label(first_name, last_name)) for id, first_name, last_name in rows]
+
+
+product_title_index = ProductTitleIndex()
+collection_title_index = CollectionTitleIndex()
+customer_name_index = CustomerNameIndex()
+
+
+# For the ModelAdmins that are the target of autocomplete_fields: the admin autocomplete requests (/admin/autocomplete/)
+# search the prefix index instead of running the search_fields query on every keystroke
+class PrefixIndexAdminMixin:
+    autocomplete_index = None
+    # Matches passed to the admin, it paginates them
+    autocomplete_limit = 100
+    
+    def get_search_results(self, request, queryset, search_term):
+        if search_term and request.path.endswith('/autocomplete/'):
+            matches, source = self.autocomplete_index.search(search_term, self.autocomplete_limit)
+            return queryset.filter(pk__in=[id for id, label in matches]), False
+        return super().get_search_results(request, queryset, search_term)
@@ -0,0 +1,293 @@
+# Process-local caches for data that changes rarely but is read on every request
+# Each process keeps its own copy, a version key in the shared Django cache (settings.CACHES) tells every worker when to reload
+# Use a shared backend (Redis, Memcached) in production, with LocMemCache each worker only sees its own invalidations
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+
+# Shared versions are random strings stored in the Django cache, changing them invalidates every key built with them
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # add() only sets the key if it doesn't exist, so concurrent workers end up with the same version
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    version = uuid4().hex
+    cache.set(key, version, None)
+    return version
+
+
+# Version of the product catalog (products and their tags), used by the facet counts cache
+CATALOG_VERSION_KEY = 'store:catalog:version'
+
+
+class VersionedLocalCache:
+    # Key of the shared version, and how often (seconds) we check it. Between checks a worker can serve stale data
+    version_key = None
+    check_interval = 1
+    
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = None
+        self.version = None
+        self.checked_at = 0
+    
+    # Subclasses load everything with a single query
+    def load(self):
+        raise NotImplementedError
+    
+    def get_data(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if force or self.data is None or now - self.checked_at > self.check_interval:
+                version = get_version(self.version_key)
+                self.checked_at = now
+                if force or self.data is None or version != self.version:
+                    self.data = self.load()
+                    self.version = version
+            return self.data
+    
+    # Called by the signal handlers, every worker will reload on its next check
+    def invalidate(self):
+        bump_version(self.version_key)
+        with self.lock:
+            self.data = None
+
+
+class CollectionCache(VersionedLocalCache):
+    version_key = 'store:collections:version'
+    
+    # {collection_id: {'title', 'object', 'path'}} with the serialized collection and the path of its detail endpoint
+    def load(self):
+        # Imported here to avoid a circular import (serializers imports this module)
+        from .models import Collection
+        from .serializers import CollectionSerializer
+        return {
+            collection.id: {
+                'title': str(collection),
+                'object': CollectionSerializer(collection).data,
+                'path': reverse('collection-detail', kwargs={'pk': collection.id}),
+            }
+            for collection in Collection.objects.all()
+        }
+    
+    def get(self, collection_id):
+        data = self.get_data()
+        if collection_id not in data:
+            # The collection may have been created after our last check, reloading once
+            data = self.get_data(force=True)
+        return data.get(collection_id)
+
+
+collection_cache = CollectionCache()
+
+
+# Bounded LRU cache with TTL for the current process
+# get_or_compute() has stampede protection: when an entry is missing or expired only one thread computes it, the others wait for its result
+class LRUCache:
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # OrderedDict remembers the order of the keys, the most recently used are moved to the end
+        self.entries = OrderedDict()
+        # {key: threading.Event} for the keys that are being computed
+        self.in_flight = {}
+        self.stats = {'hits': 0, 'misses': 0, 'waits': 0, 'evictions': 0, 'expirations': 0}
+    
+    def get_or_compute(self, key, compute):
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    value, expires_at = entry
+                    if expires_at > time.monotonic():
+                        self.entries.move_to_end(key)
+                        self.stats['hits'] += 1
+                        return value
+                    del self.entries[key]
+                    self.stats['expirations'] += 1
+                event = self.in_flight.get(key)
+                if event is None:
+                    # We are the one computing the value
+                    event = self.in_flight[key] = threading.Event()
+                    self.stats['misses'] += 1
+                    break
+                self.stats['waits'] += 1
+            # Another thread is computing it, when it finishes the loop finds the value (or computes it if that thread failed)
+            event.wait()
+        
+        try:
+            value = compute()
+            with self.lock:
+                self.entries[key] = (value, time.monotonic() + self.ttl)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            event.set()
+    
+    # Removes every entry whose key matches the condition
+    def invalidate(self, condition):
+        with self.lock:
+            for key in [key for key in self.entries if condition(key)]:
+                del self.entries[key]
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def get_stats(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hit_ratio': round(self.stats['hits'] / lookups, 4) if lookups else 0,
+            }
+
+
+# Pre-rendered JSON bytes of ProductViewSet.retrieve, keyed by (scheme, host, product id, last_update, collections version, related product ids)
+# Settings: PRODUCT_DETAIL_CACHE = {'MAX_SIZE': 1000, 'TTL': 60}
+product_detail_cache = LRUCache(
+    max_size=getattr(settings, 'PRODUCT_DETAIL_CACHE', {}).get('MAX_SIZE', 1000),
+    ttl=getattr(settings, 'PRODUCT_DETAIL_CACHE', {}).get('TTL', 60),
+)
+
+
+# Serialized customer profile of each user for /store/customers/me/, in the shared Django cache
+# It's updated by CustomerViewSet.me on PUT and deleted by the Customer signals (ex: changes from the admin)
+CUSTOMER_PROFILE_TIMEOUT = getattr(settings, 'CUSTOMER_PROFILE_TIMEOUT', 3600)
+
+
+def customer_profile_key(user_id):
+    return f'store:customer:{user_id}'
+
+
+# Statistics of the caches of this process, shown on /metrics/caches/
+def cache_stats():
+    return {
+        'collections': {'version': collection_cache.version, 'size': len(collection_cache.data or {})},
+        'product_detail': product_detail_cache.get_stats(),
+        'product_list_coalescing': dict(product_list_flight.stats),
+    }
+
+
+# Request coalescing: when several threads ask for the same key at the same time, only the first one runs the function
+# and the others wait and receive the same result. Nothing is kept after the call ends
+# It only coalesces the threads of one process, SharedFlight adds the other workers
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {key: [threading.Event, result, exception]}
+        self.calls = {}
+        self.stats = {'calls': 0, 'coalesced': 0}
+    
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = [threading.Event(), None, None]
+                self.stats['calls'] += 1
+                leader = True
+            else:
+                self.stats['coalesced'] += 1
+                leader = False
+        
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        
+        try:
+            call[1] = function()
+            return call[1]
+        except Exception as exc:
+            call[2] = exc
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call[0].set()
+
+
+# Request coalescing across workers, through the shared Django cache: the leader of a key is the worker whose cache.add()
+# of the lock succeeds, the lock holds a random token and the result is stored under that token for RESULT_TTL seconds.
+# The other workers poll for it up to WAIT seconds, a worker that doesn't get it (the leader failed or is too slow) runs
+# the function itself. The threads of each worker are still coalesced in memory first (SingleFlight)
+# With LocMemCache the workers don't share anything, it's the same as SingleFlight
+# Settings: PRODUCT_LIST_COALESCING = {'WAIT': 5, 'POLL_INTERVAL': 0.02, 'RESULT_TTL': 10}
+class SharedFlight(SingleFlight):
+    def __init__(self, prefix, wait=5, poll_interval=0.02, result_ttl=10):
+        super().__init__()
+        self.prefix = prefix
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.stats['shared'] = 0
+    
+    def do(self, key, function):
+        return super().do(key, lambda: self.do_shared(key, function))
+    
+    def do_shared(self, key, function):
+        lock_key = f'{self.prefix}:lock:{hashlib.sha256(repr(key).encode()).hexdigest()}'
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            token = uuid4().hex
+            # The lock expires by itself if the leader dies
+            if cache.add(lock_key, token, self.wait):
+                try:
+                    result = function()
+                    cache.set(f'{self.prefix}:result:{token}', result, self.result_ttl)
+                    return result
+                finally:
+                    # Unless it expired and another worker is the leader now
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+            token = cache.get(lock_key)
+            result = self.wait_for_result(lock_key, token, deadline) if token else None
+            if result is not None:
+                with self.lock:
+                    self.stats['shared'] += 1
+                return result
+            # The leader finished without a result (error) before we read its token: we try to be the leader
+        return function()
+    
+    # The result of the flight of token, or None if the leader released the lock without one or the wait is over
+    def wait_for_result(self, lock_key, token, deadline):
+        result_key = f'{self.prefix}:result:{token}'
+        while time.monotonic() < deadline:
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            if cache.get(lock_key) != token:
+                return cache.get(result_key)
+            time.sleep(self.poll_interval)
+        return None
+
+
+# Identical ProductViewSet.list requests running at the same time in every worker
+product_list_flight = SharedFlight(
+    'store:product_list_flight',
+    wait=getattr(settings, 'PRODUCT_LIST_COALESCING', {}).get('WAIT', 5),
+    poll_interval=getattr(settings, 'PRODUCT_LIST_COALESCING', {}).get('POLL_INTERVAL', 0.02),
+    result_ttl=getattr(settings, 'PRODUCT_LIST_COALESCING', {}).get('RESULT_TTL', 10),
+)
@@ -0,0 +1,113 @@
+# Change feed of the catalog: products changed and deleted since a cursor, so consumers sync only what changed
+# Products are read in (last_update, id) order (product_change_feed_idx) and deletions from the ProductDeletion log
+# The cursor is opaque for the consumers, it's the position reached in both streams encoded in base64
+# Settings:
+# CHANGE_FEED = {
+#     'PAGE_SIZE': 100,
+#     'MAX_PAGE_SIZE': 1000,
+#     'LAG': 5,                  # seconds, changes newer than this are not returned yet (transactions still committing)
+#     'RETENTION': 7 * 86400,    # seconds, tombstones older than this are purged and older cursors expire
+# }
+import base64
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Product, ProductDeletion
+
+DEFAULTS = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+    'LAG': 5,
+    'RETENTION': 7 * 86400,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'CHANGE_FEED', {}).get(name, DEFAULTS[name])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# The cursor is older than the retention of the deletion log, the consumer has to do a full sync again
+class ExpiredCursor(Exception):
+    pass
+
+
+def encode_cursor(products_position, deletions_position):
+    data = {
+        'p': [products_position[0].isoformat(), products_position[1]] if products_position else None,
+        'd': [deletions_position[0].isoformat(), deletions_position[1]],
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        products_position = (datetime.fromisoformat(data['p'][0]), int(data['p'][1])) if data['p'] else None
+        deletions_position = (datetime.fromisoformat(data['d'][0]), int(data['d'][1]))
+        # Naive timestamps can't be compared with the aware columns (TypeError later, in the queries)
+        if any(timezone.is_naive(position[0]) for position in (products_position, deletions_position) if position):
+            raise ValueError('The cursor timestamps must have a time zone.')
+    except (ValueError, TypeError, KeyError, IndexError) as exc:
+        raise InvalidCursor('Invalid cursor.') from exc
+    return products_position, deletions_position
+
+
+# Keyset condition: rows after (timestamp, id) in the (timestamp, id) order
+def after(field, position):
+    timestamp, id = position
+    return Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': id})
+
+
+def get_changes(cursor=None, limit=None):
+    """
+    Returns (products, deleted product ids, next cursor, has_more)
+    Without cursor the products start from the beginning (full sync) and the deletions from now
+    """
+    limit = min(limit or get_setting('PAGE_SIZE'), get_setting('MAX_PAGE_SIZE'))
+    now = timezone.now()
+    # Changes in the last LAG seconds may still have concurrent transactions with an older last_update committing
+    upper = now - timedelta(seconds=get_setting('LAG'))
+    
+    if cursor is None:
+        products_position = None
+        last_deletion = ProductDeletion.objects.filter(deleted_at__lte=upper).order_by('-deleted_at', '-id').values_list('deleted_at', 'id').first()
+        deletions_position = last_deletion or (upper, 0)
+    else:
+        products_position, deletions_position = decode_cursor(cursor)
+        if deletions_position[0] < now - timedelta(seconds=get_setting('RETENTION')):
+            raise ExpiredCursor('The cursor is older than the deletion log retention, sync the whole catalog again.')
+    
+    products = Product.objects.filter(last_update__lte=upper).order_by('last_update', 'id')
+    if products_position is not None:
+        products = products.filter(after('last_update', products_position))
+    products = list(products[:limit + 1])
+    
+    deletions = ProductDeletion.objects.filter(after('deleted_at', deletions_position), deleted_at__lte=upper).order_by('deleted_at', 'id')
+    deletions = list(deletions.values_list('deleted_at', 'id', 'product_id')[:limit + 1])
+    
+    has_more = len(products) > limit or len(deletions) > limit
+    products = products[:limit]
+    deletions = deletions[:limit]
+    if products:
+        products_position = (products[-1].last_update, products[-1].id)
+    if deletions:
+        deletions_position = deletions[-1][:2]
+    # A consumer that is up to date keeps the position of the deletions close to now, so its cursor doesn't expire
+    elif not has_more and deletions_position[0] < upper:
+        deletions_position = (upper, deletions_position[1])
+    next_cursor = encode_cursor(products_position, deletions_position)
+    return products, [product_id for deleted_at, id, product_id in deletions], next_cursor, has_more
+
+
+def purge_deletions():
+    limit = timezone.now() - timedelta(seconds=get_setting('RETENTION'))
+    count, _ = ProductDeletion.objects.filter(deleted_at__lt=limit).delete()
+    return count
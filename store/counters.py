@@ -0,0 +1,165 @@
+# View and purchase counters of products in a sliding time window
+# Events are counted in time buckets (BUCKET seconds) in a pluggable key-value backend, and the fold_popular_products
+# command periodically adds up the buckets of the last WINDOW seconds into the ProductPopularity table
+# The command runs in its own process, so it needs a shared backend (Redis): with LocMemCounterBackend it would read no
+# counts and empty the ranking, it refuses to run. fold_popularity() can still be called inside the process that counts
+# Settings:
+# PRODUCT_COUNTERS = {
+#     'BACKEND': 'store.counters.LocMemCounterBackend',  # or 'store.counters.RedisCounterBackend' shared by every worker
+#     'LOCATION': 'redis://localhost:6379/0',             # only for Redis
+#     'BUCKET': 3600,
+#     'WINDOW': 86400,
+#     'VIEW_SAMPLE_RATE': 1.0,                             # fraction of product views that are counted
+# }
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': 'store.counters.LocMemCounterBackend',
+    'LOCATION': None,
+    'BUCKET': 3600,
+    'WINDOW': 86400,
+    'VIEW_SAMPLE_RATE': 1.0,
+}
+
+VIEW = 'view'
+PURCHASE = 'purchase'
+
+
+def get_setting(name):
+    return getattr(settings, 'PRODUCT_COUNTERS', {}).get(name, DEFAULTS[name])
+
+
+# Counters of the current process, for tests and single process deployments
+class LocMemCounterBackend:
+    # Other processes (ex: manage.py fold_popular_products) can't see these counters
+    shared = False
+    
+    def __init__(self, location=None):
+        self.lock = threading.Lock()
+        # {(event, bucket): Counter({product_id: count})}
+        self.buckets = {}
+    
+    def incr(self, event, bucket, product_id, amount=1):
+        with self.lock:
+            self.buckets.setdefault((event, bucket), Counter())[product_id] += amount
+    
+    def read(self, event, buckets):
+        total = Counter()
+        with self.lock:
+            for bucket in buckets:
+                total.update(self.buckets.get((event, bucket), {}))
+        return total
+    
+    def discard_before(self, event, bucket):
+        with self.lock:
+            for key in [key for key in self.buckets if key[0] == event and key[1] < bucket]:
+                del self.buckets[key]
+
+
+# Shared counters in Redis, one hash per event and bucket (HINCRBY is atomic), buckets expire by themselves
+class RedisCounterBackend:
+    shared = True
+    
+    def __init__(self, location=None):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisCounterBackend requires the redis package (pip install redis)')
+        self.client = redis.Redis.from_url(location or 'redis://localhost:6379/0')
+    
+    def key(self, event, bucket):
+        return f'store:counter:{event}:{bucket}'
+    
+    def incr(self, event, bucket, product_id, amount=1):
+        key = self.key(event, bucket)
+        pipeline = self.client.pipeline()
+        pipeline.hincrby(key, product_id, amount)
+        pipeline.expire(key, get_setting('WINDOW') + get_setting('BUCKET'))
+        pipeline.execute()
+    
+    def read(self, event, buckets):
+        total = Counter()
+        for bucket in buckets:
+            for product_id, count in self.client.hgetall(self.key(event, bucket)).items():
+                total[int(product_id)] += int(count)
+        return total
+    
+    def discard_before(self, event, bucket):
+        # Old buckets expire in Redis
+        pass
+
+
+backend = None
+backend_lock = threading.Lock()
+
+
+def get_backend():
+    global backend
+    with backend_lock:
+        if backend is None:
+            backend = import_string(get_setting('BACKEND'))(get_setting('LOCATION'))
+        return backend
+
+
+def current_bucket():
+    return int(time.time() // get_setting('BUCKET'))
+
+
+def window_buckets():
+    last = current_bucket()
+    return range(last - get_setting('WINDOW') // get_setting('BUCKET') + 1, last + 1)
+
+
+# Only a sample of the views is counted, each counted view is worth 1 / sample rate
+def record_view(product_id):
+    sample_rate = get_setting('VIEW_SAMPLE_RATE')
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+    get_backend().incr(VIEW, current_bucket(), int(product_id), round(1 / sample_rate))
+
+
+def record_purchase(product_id, quantity=1):
+    get_backend().incr(PURCHASE, current_bucket(), int(product_id), quantity)
+
+
+# {product_id: count} of the last WINDOW seconds
+def window_counts(event):
+    buckets = window_buckets()
+    counter_backend = get_backend()
+    counter_backend.discard_before(event, buckets[0])
+    return counter_backend.read(event, buckets)
+
+
+# Replaces the ProductPopularity ranking with the counts of the current window
+# With a backend that isn't shared it has to run in the same process that counted the events
+def fold_popularity():
+    from django.db import transaction
+    from .models import Product, ProductPopularity
+    
+    views = window_counts(VIEW)
+    purchases = window_counts(PURCHASE)
+    product_ids = set(views) | set(purchases)
+    # Deleted products are ignored
+    collections = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'collection_id'))
+    rows = [
+        ProductPopularity(
+            product_id=product_id,
+            collection_id=collection_id,
+            views=views[product_id],
+            purchases=purchases[product_id],
+            score=views[product_id] + purchases[product_id] * ProductPopularity.PURCHASE_WEIGHT,
+        )
+        for product_id, collection_id in collections.items()
+    ]
+    # Readers keep seeing the previous ranking until the transaction is committed
+    with transaction.atomic():
+        ProductPopularity.objects.all().delete()
+        ProductPopularity.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,78 @@
+# Facet counts for the product list (?facets=true)
+# Each facet is calculated with a single grouped query over the filtered products, and the result is cached
+# in the shared Django cache by filter signature and catalog version
+import hashlib
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils.http import urlencode
+
+from tags.models import TaggedItem
+from .caches import CATALOG_VERSION_KEY, get_version
+from .models import Product
+
+# Same threshold as the InventoryFilter of the admin
+LOW_STOCK_THRESHOLD = 10
+# Lower limits of the price buckets, the last bucket has no upper limit
+PRICE_BUCKETS = getattr(settings, 'PRODUCT_FACET_PRICE_BUCKETS', [0, 10, 25, 50, 100, 250, 500])
+FACETS_TIMEOUT = getattr(settings, 'PRODUCT_FACETS_TIMEOUT', 300)
+# Query parameters that don't change which products are counted
+IGNORED_PARAMS = ['page', 'ordering', 'facets', 'format']
+
+
+def collection_facet(queryset):
+    rows = queryset.order_by().values('collection_id').annotate(count=Count('id'))
+    return {row['collection_id']: row['count'] for row in rows}
+
+
+# Conditional aggregation: one COUNT(...) FILTER (WHERE ...) per bucket, all in the same query
+def price_facet(queryset):
+    buckets = {}
+    for i, lower in enumerate(PRICE_BUCKETS):
+        upper = PRICE_BUCKETS[i + 1] if i + 1 < len(PRICE_BUCKETS) else None
+        name = f'{lower}-{upper}' if upper is not None else f'{lower}+'
+        condition = Q(unit_price__gte=lower) & Q(unit_price__lt=upper) if upper is not None else Q(unit_price__gte=lower)
+        buckets[name] = Count('id', filter=condition)
+    return queryset.order_by().aggregate(**buckets)
+
+
+def stock_facet(queryset):
+    return queryset.order_by().aggregate(
+        in_stock=Count('id', filter=Q(inventory__gte=LOW_STOCK_THRESHOLD)),
+        low_stock=Count('id', filter=Q(inventory__lt=LOW_STOCK_THRESHOLD)),
+    )
+
+
+# Tags use a generic relation, we group the TaggedItems of the filtered products by tag
+def tag_facet(queryset):
+    rows = TaggedItem.objects \
+        .filter(content_type=ContentType.objects.get_for_model(Product), object_id__in=queryset.order_by().values('id')) \
+        .values('tag_id', 'tag__label') \
+        .annotate(count=Count('object_id', distinct=True)) \
+        .order_by('-count')
+    return {row['tag__label']: row['count'] for row in rows}
+
+
+FACETS = {
+    'collection': collection_facet,
+    'price': price_facet,
+    'stock': stock_facet,
+    'tag': tag_facet,
+}
+
+
+# The signature only depends on the filters, so page=2 and ?ordering=title share the same facets
+def filter_signature(query_params):
+    params = sorted((key, value) for key in query_params if key not in IGNORED_PARAMS for value in query_params.getlist(key))
+    return hashlib.sha1(urlencode(params).encode()).hexdigest()
+
+
+def get_facets(queryset, query_params):
+    key = f'store:facets:{get_version(CATALOG_VERSION_KEY)}:{filter_signature(query_params)}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = {name: facet(queryset) for name, facet in FACETS.items()}
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
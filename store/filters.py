@@ -1,7 +1,9 @@
 # Custom Filter
 
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import CharFilter, FilterSet
+from rest_framework.exceptions import ValidationError
 from .models import Product
+from .tag_index import TagExpressionError, tag_index
 
 class ProductFilter(FilterSet):
     class Meta:
@@ -10,5 +12,17 @@ class ProductFilter(FilterSet):
             # There are several keywords to add filters in the documentation, the order matters
             # Creates several query parameters and implement methods automatically
             'collection_id':['exact'],
-            'unit_price': ['gt','lt']
-        }
\ No newline at end of file
+            'unit_price': ['gt','lt'],
+            # Filtering by the precomputed column, it's indexed
+            'price_with_tax': ['gt','lt']
+        }
+    
+    # ?tags=red,-sale or ?tags=(red | blue) & NOT sale, evaluated in the in-memory tag index (store/tag_index.py)
+    # The index returns ids, and the rest of the filters, the ordering and the pagination work on them as usual
+    tags = CharFilter(method='filter_tags')
+    
+    def filter_tags(self, queryset, name, value):
+        try:
+            return tag_index.filter(queryset, value)
+        except TagExpressionError as exc:
+            raise ValidationError({'tags': [str(exc)]})
@@ -0,0 +1,85 @@
+# Background jobs for bulk admin actions
+# The selected ids are processed in chunks, each chunk is committed in its own transaction so we never lock the whole table,
+# and the progress is saved in a BulkJob record that the admin can poll
+# The jobs run in the task queue (core/tasks.py, manage.py run_workers): the task row is written in the same transaction
+# as the job, so a rollback discards both. The progress is committed with each chunk, and each chunk refreshes the lock
+# of the task (heartbeat). If the worker dies, the task is claimed again after TASKS['TIMEOUT'] and the job resumes from
+# the first chunk that wasn't committed
+# A chunk that fails with a database OperationalError (lock wait timeout, deadlock) was rolled back, it runs again up to RETRIES times
+# The chunk function is given by its dotted path, like the tasks: function(queryset, **params) with JSON params
+# Settings: BULK_JOBS = {'EXECUTOR': 'queue' or 'sync', 'CHUNK_SIZE': 1000, 'RETRIES': 2}
+# 'sync' runs the job in the request after the commit, for local development without run_workers
+import traceback
+
+from django.apps import apps
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Task as TaskRecord
+from core.tasks import task
+from .caches import CATALOG_VERSION_KEY, bump_version
+from .models import BulkJob
+
+DEFAULTS = {
+    'EXECUTOR': 'queue',
+    'CHUNK_SIZE': 1000,
+    'RETRIES': 2,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'BULK_JOBS', {}).get(name, DEFAULTS[name])
+
+
+# Creates the job and enqueues it, function(queryset) runs for each chunk of ids once the current transaction is committed
+# function receives a queryset filtered by the chunk ids, params are its JSON serializable keyword arguments
+def start_job(description, queryset, function, params=None, user=None):
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    job = BulkJob.objects.create(description=description, total=len(ids), created_by=user)
+    args = (job.pk, queryset.model._meta.label, ids, function, params or {})
+    if get_setting('EXECUTOR') == 'sync':
+        transaction.on_commit(lambda: run_bulk_job(*args))
+    else:
+        run_bulk_job.delay(*args)
+    return job
+
+
+# Only one attempt: the errors are saved in the job. A task of a dead worker is still claimed again after the timeout
+@task(max_attempts=1)
+def run_bulk_job(job_id, model_label, ids, function, params):
+    job = BulkJob.objects.get(pk=job_id)
+    if job.status in (BulkJob.STATUS_DONE, BulkJob.STATUS_FAILED):
+        return
+    queryset = apps.get_model(model_label).objects.all()
+    apply_chunk = import_string(function)
+    chunk_size = get_setting('CHUNK_SIZE')
+    BulkJob.objects.filter(pk=job_id).update(status=BulkJob.STATUS_RUNNING)
+    try:
+        # The chunks before processed were committed by a previous run
+        for start in range(job.processed, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            for attempt in range(get_setting('RETRIES') + 1):
+                try:
+                    with transaction.atomic():
+                        apply_chunk(queryset.filter(pk__in=chunk), **params)
+                        # The progress is committed with the chunk
+                        BulkJob.objects.filter(pk=job_id).update(processed=F('processed') + len(chunk))
+                    break
+                except OperationalError:
+                    if attempt == get_setting('RETRIES'):
+                        raise
+            heartbeat(job_id)
+        BulkJob.objects.filter(pk=job_id).update(status=BulkJob.STATUS_DONE, finished_at=timezone.now())
+    except Exception:
+        BulkJob.objects.filter(pk=job_id).update(status=BulkJob.STATUS_FAILED, error=traceback.format_exc(), finished_at=timezone.now())
+    finally:
+        # update() doesn't send signals, the cached facet counts are invalidated once at the end
+        bump_version(CATALOG_VERSION_KEY)
+
+
+# Long jobs keep their task locked, otherwise another worker would claim it after TASKS['TIMEOUT']
+def heartbeat(job_id):
+    TaskRecord.objects.filter(name=run_bulk_job.name, args__0=job_id, status=TaskRecord.STATUS_RUNNING).update(locked_at=timezone.now())
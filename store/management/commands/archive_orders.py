@@ -0,0 +1,37 @@
+# Custom management command: python manage.py archive_orders
+# Run it periodically (ex: nightly with cron) to move the old finished orders to the archive tables (store/archive.py)
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.archive import archive_orders, get_setting, size_report
+
+
+class Command(BaseCommand):
+    help = 'Moves the Complete and Failed orders older than --days to the archive tables and reports the table sizes'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Default: ORDER_ARCHIVE["AFTER_DAYS"]')
+        parser.add_argument('--batch-size', type=int, default=None, help='Default: ORDER_ARCHIVE["BATCH_SIZE"]')
+        parser.add_argument('--report', action='store_true', help='Only report the table sizes')
+    
+    def write_report(self, title, report):
+        self.stdout.write(title)
+        for table in report:
+            sizes = ''
+            if table['data_bytes'] is not None:
+                sizes = f', table {table["data_bytes"] / 1024:.0f} KB, indexes {table["index_bytes"] / 1024:.0f} KB'
+            self.stdout.write(f'  {table["table"]}: {table["rows"]} rows{sizes}')
+    
+    def handle(self, *args, **options):
+        before = size_report()
+        if options['report']:
+            self.write_report('Table sizes:', before)
+            return
+        days = options['days'] if options['days'] is not None else get_setting('AFTER_DAYS')
+        orders, items = archive_orders(timezone.now() - timedelta(days=days), options['batch_size'], log=self.stdout.write)
+        self.stdout.write(f'{orders} orders and {items} items archived.')
+        self.write_report('Before:', before)
+        # Freed pages are reused by new rows, the files only shrink with VACUUM / OPTIMIZE TABLE
+        self.write_report('After:', size_report())
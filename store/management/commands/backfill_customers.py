@@ -0,0 +1,26 @@
+# Custom management command: python manage.py backfill_customers
+# Creates the missing Customer of the users that were registered before customers were created by the post_save signal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from store.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Creates a Customer for every user that does not have one'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(customer__isnull=True).only('pk', 'first_name', 'last_name', 'email')
+        created = 0
+        batch = []
+        for user in users.iterator():
+            # bulk_create doesn't call save(), the search columns are set here
+            batch.append(Customer(user=user, **Customer.search_values(user, '')))
+            if len(batch) == options['batch_size']:
+                created += len(Customer.objects.bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        created += len(Customer.objects.bulk_create(batch, ignore_conflicts=True))
+        self.stdout.write(f'{created} customers created.')
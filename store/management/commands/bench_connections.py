@@ -0,0 +1,93 @@
+# Custom management command: python manage.py bench_connections [--path /store/products/] [--threads 8] [--requests 200]
+# Sends requests through the real WSGI handler (which closes connections at the end of each request, like in production)
+# and compares requests per second and p95 latency with each database connection profile
+# Throttling and request coalescing are disabled during the run, otherwise we would measure 429s and shared responses.
+# Every response must be a 200, the status counts are printed and the command fails otherwise
+import statistics
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.views import APIView
+
+from store.caches import product_list_flight
+from storefront.database import PROFILES
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks requests per second and p95 latency with and without persistent/pooled database connections'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/store/products/')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per thread')
+        parser.add_argument('--profiles', nargs='+', default=['default', 'persistent', 'pool'], choices=list(PROFILES))
+    
+    def handle(self, *args, **options):
+        handler = WSGIHandler()
+        original_settings = {alias: dict(connections[alias].settings_dict) for alias in connections}
+        self.stdout.write(f'{"profile":<12} {"req/s":>10} {"p50 ms":>10} {"p95 ms":>10}  statuses')
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(APIView, 'check_throttles', lambda view, request: None))
+            stack.enter_context(mock.patch.object(product_list_flight, 'do', lambda key, function: function()))
+            try:
+                for profile in options['profiles']:
+                    self.use_profile(profile, original_settings)
+                    requests_per_second, latencies, statuses = self.run(handler, options)
+                    percentiles = statistics.quantiles(latencies, n=100)
+                    p50, p95 = percentiles[49], percentiles[94]
+                    counts = ' '.join(f'{code}x{count}' for code, count in sorted(statuses.items()))
+                    self.stdout.write(f'{profile:<12} {requests_per_second:>10.1f} {p50:>10.2f} {p95:>10.2f}  {counts}')
+                    if set(statuses) != {200}:
+                        raise CommandError(f'{options["path"]} answered {counts} with the {profile} profile, the timings are not comparable')
+            finally:
+                self.use_profile('default', original_settings)
+    
+    # Changing the connection settings in place, each thread opens its own connections with them
+    def use_profile(self, profile, original_settings):
+        connections.close_all()
+        for alias, database in original_settings.items():
+            settings_dict = connections[alias].settings_dict
+            settings_dict.clear()
+            settings_dict.update(PROFILES[profile](database))
+    
+    def run(self, handler, options):
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        
+        def worker():
+            thread_latencies = []
+            thread_statuses = Counter()
+            
+            def start_response(status, headers):
+                thread_statuses[int(status.split(' ', 1)[0])] += 1
+            
+            for _ in range(options['requests']):
+                environ = {'PATH_INFO': options['path'], 'REQUEST_METHOD': 'GET'}
+                setup_testing_defaults(environ)
+                start = time.perf_counter()
+                response = handler(environ, start_response)
+                b''.join(response)
+                # Closing the response sends request_finished, that's when Django closes or keeps the connection
+                response.close()
+                thread_latencies.append((time.perf_counter() - start) * 1000)
+            connections.close_all()
+            with lock:
+                latencies.extend(thread_latencies)
+                statuses.update(thread_statuses)
+        
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return len(latencies) / elapsed, latencies, statuses
@@ -0,0 +1,79 @@
+# Custom management command: python manage.py bench_customer_search
+# Creates N customers inside a transaction (rolled back at the end unless --keep) and compares the old search across
+# the join with core_user with the search on the indexed columns of Customer
+import random
+import string
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from store.models import Customer
+
+FIRST_NAMES = ['alice', 'bob', 'carla', 'daniel', 'elena', 'felix', 'grace', 'hugo', 'irene', 'jorge', 'karen', 'luis', 'maria', 'nora', 'oscar', 'paula']
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the customer search on generated customers'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated customers')
+    
+    def generate(self, count):
+        User = get_user_model()
+        rng = random.Random(42)
+        start = time.perf_counter()
+        last_names = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))).capitalize() for _ in range(20000)]
+        offset = User.objects.count()
+        for batch_start in range(0, count, 10000):
+            users = []
+            for i in range(batch_start + offset, min(batch_start + 10000, count) + offset):
+                first_name, last_name = rng.choice(FIRST_NAMES).capitalize(), rng.choice(last_names)
+                users.append(User(username=f'bench{i}', email=f'{first_name}.{last_name}{i}@example.com'.lower(), first_name=first_name, last_name=last_name, password='!'))
+            users = User.objects.bulk_create(users)
+            # bulk_create doesn't send post_save, we create the customers here
+            Customer.objects.bulk_create([
+                Customer(user=user, phone=phone, **Customer.search_values(user, phone))
+                for user in users
+                for phone in [f'+1 555 {rng.randint(1000000, 9999999)}']
+            ])
+        self.stdout.write(f'Created {count} customers in {time.perf_counter() - start:.1f}s')
+        return last_names
+    
+    def measure(self, name, make_queryset, terms):
+        start = time.perf_counter()
+        for term in terms:
+            list(make_queryset(term).values_list('id', flat=True)[:20])
+        self.stdout.write(f'  {name}: {(time.perf_counter() - start) / len(terms) * 1000:.2f} ms per search')
+    
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            last_names = self.generate(options['customers'])
+            rng = random.Random(7)
+            terms = [rng.choice(last_names)[:3] for _ in range(options['queries'])]
+            self.stdout.write(f'Prefix of 3 letters of a last name, first 20 matches, {len(terms)} searches:')
+            self.measure(
+                'before: user__first_name/last_name__istartswith (join)',
+                lambda term: Customer.objects.filter(Q(user__first_name__istartswith=term) | Q(user__last_name__istartswith=term)),
+                terms,
+            )
+            self.measure(
+                'before: icontains on names and email (join)',
+                lambda term: Customer.objects.filter(Q(user__first_name__icontains=term) | Q(user__last_name__icontains=term) | Q(user__email__icontains=term)),
+                terms,
+            )
+            self.measure('after: Customer.objects.search (indexed columns)', lambda term: Customer.objects.search(term), terms)
+            
+            query, params = Customer.objects.search(terms[0]).values_list('id', flat=True)[:20].query.sql_with_params()
+            with connection.cursor() as cursor:
+                explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+                cursor.execute(explain + query, params)
+                self.stdout.write('Plan of the new search:')
+                for row in cursor.fetchall():
+                    self.stdout.write(f'  {row[-1]}')
+            if not options['keep']:
+                transaction.set_rollback(True)
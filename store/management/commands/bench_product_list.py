@@ -0,0 +1,49 @@
+# Custom management command: python manage.py bench_product_list
+# Compares the product list serialization with the old per-row price_with_tax calculation and with the precomputed column
+from decimal import Decimal
+from timeit import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store.models import Collection, Product, compute_price_with_tax, DEFAULT_TAX_RATE
+from store.serializers import ProductSerializer
+
+
+# The serializer as it was before, calculating the price with tax in Python for each product
+class LegacyProductSerializer(ProductSerializer):
+    price_with_tax = serializers.SerializerMethodField(method_name='get_price_tax')
+    
+    def get_price_tax(self, product:Product):
+        return product.unit_price * Decimal(1.1)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the product list serialization before and after precomputing price_with_tax'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=200)
+    
+    def handle(self, *args, **options):
+        # Products are built in memory so we only measure the serialization, not the database
+        # They use an existing collection because the serializer reads it from the collection cache
+        collection = Collection.objects.first()
+        if collection is None:
+            raise CommandError('Create at least one collection before running the benchmark')
+        products = []
+        for i in range(options['products']):
+            unit_price = Decimal('1.00') + Decimal(i) / 7
+            unit_price = unit_price.quantize(Decimal('0.01'))
+            products.append(Product(
+                id=i + 1, title=f'Product {i}', slug=f'product-{i}', description='', inventory=10,
+                unit_price=unit_price, price_with_tax=compute_price_with_tax(unit_price, DEFAULT_TAX_RATE),
+                collection=collection
+            ))
+        request = Request(APIRequestFactory().get('/store/products/'))
+        
+        for name, serializer_class in [('before (SerializerMethodField)', LegacyProductSerializer), ('after (price_with_tax column)', ProductSerializer)]:
+            seconds = timeit(lambda: serializer_class(products, many=True, context={'request': request}).data, number=options['repeat'])
+            self.stdout.write(f'{name}: {seconds / options["repeat"] * 1000:.3f} ms per {len(products)} products')
@@ -0,0 +1,51 @@
+# Custom management command: python manage.py bench_related_products
+# Measures the co-purchase matrix and the top-k selection of build_related_products on synthetic order items
+# The database read is not included, the pairs are generated in memory
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.related import co_occurrence, load_scipy, merge, top_k
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the related products job on synthetic order items'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--order-items', type=int, default=10_000_000)
+        parser.add_argument('--products', type=int, default=50_000)
+        parser.add_argument('--top-k', type=int, default=10)
+        # Size of the incremental run, as a fraction of the order items
+        parser.add_argument('--increment', type=float, default=0.01)
+    
+    def generate(self, np, rng, n_items, n_products, first_order):
+        # Orders of 1 to 8 lines, products with a long tail popularity like a real catalog
+        sizes = rng.integers(1, 9, size=n_items // 4 + 1)
+        order_ids = np.repeat(np.arange(first_order, first_order + len(sizes)), sizes)[:n_items]
+        product_ids = (rng.zipf(1.2, size=len(order_ids)) - 1) % n_products + 1
+        return order_ids, product_ids
+    
+    def timed(self, name, func):
+        start = time.perf_counter()
+        result = func()
+        self.stdout.write(f'  {name}: {time.perf_counter() - start:.2f}s')
+        return result
+    
+    def handle(self, *args, **options):
+        np, sparse = load_scipy()
+        rng = np.random.default_rng(42)
+        n_products = options['products'] + 1
+        order_ids, product_ids = self.generate(np, rng, options['order_items'], options['products'], 1)
+        self.stdout.write(f'Full run: {len(order_ids)} order items, {order_ids[-1]} orders, {options["products"]} products')
+        matrix = self.timed('co-occurrence matrix', lambda: co_occurrence(order_ids, product_ids, n_products))
+        rows = np.unique(product_ids)
+        self.timed(f'top {options["top_k"]} of {len(rows)} products', lambda: top_k(matrix, rows, options['top_k']))
+        self.stdout.write(f'  {matrix.nnz} product pairs, {(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2**20:.0f} MB')
+        
+        n_new = int(len(order_ids) * options['increment'])
+        new_order_ids, new_product_ids = self.generate(np, rng, n_new, options['products'], int(order_ids[-1]) + 1)
+        self.stdout.write(f'Incremental run: {len(new_order_ids)} new order items')
+        delta = self.timed('co-occurrence matrix of the new orders', lambda: co_occurrence(new_order_ids, new_product_ids, n_products))
+        matrix = self.timed('merge', lambda: merge(matrix, delta))
+        rows = np.unique(new_product_ids)
+        self.timed(f'top {options["top_k"]} of {len(rows)} products', lambda: top_k(matrix, rows, options['top_k']))
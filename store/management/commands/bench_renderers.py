@@ -0,0 +1,61 @@
+# Custom management command: python manage.py bench_renderers
+# Compares DRF's JSONRenderer with FastJSONRenderer (and MessagePack if it's installed) on a product page and on a cart
+from decimal import Decimal
+from timeit import timeit
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store.models import Cart, CartItem, Collection, Product, compute_price_with_tax, DEFAULT_TAX_RATE
+from store.renderers import FastJSONRenderer, MessagePackRenderer, msgpack
+from store.serializers import CartItemSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the JSON renderers on a page of products and on a cart'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--cart-items', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=500)
+    
+    def handle(self, *args, **options):
+        # Objects are built in memory and serialized once, we only measure the rendering
+        collection = Collection.objects.first()
+        if collection is None:
+            raise CommandError('Create at least one collection before running the benchmark')
+        products = []
+        for i in range(max(options['products'], options['cart_items'])):
+            unit_price = (Decimal('1.00') + Decimal(i) / 7).quantize(Decimal('0.01'))
+            products.append(Product(
+                id=i + 1, title=f'Product {i}', slug=f'product-{i}', description='Description ' * 5, inventory=10,
+                unit_price=unit_price, price_with_tax=compute_price_with_tax(unit_price, DEFAULT_TAX_RATE),
+                collection=collection
+            ))
+        request = Request(APIRequestFactory().get('/store/products/'))
+        product_page = {
+            'count': 1000, 'next': 'http://testserver/store/products/?page=2', 'previous': None,
+            'results': ProductSerializer(products[:options['products']], many=True, context={'request': request}).data,
+        }
+        cart = Cart(id=uuid4())
+        items = [CartItem(id=i + 1, cart=cart, product=product, quantity=i % 5 + 1) for i, product in enumerate(products[:options['cart_items']])]
+        cart_data = {
+            'id': cart.id,
+            'items': CartItemSerializer(items, many=True).data,
+            'total_price': sum(item.quantity * item.product.unit_price for item in items),
+        }
+        
+        renderers = [('JSONRenderer', JSONRenderer()), ('FastJSONRenderer', FastJSONRenderer())]
+        if msgpack is not None:
+            renderers.append(('MessagePackRenderer', MessagePackRenderer()))
+        for payload_name, data in [(f'{options["products"]} products page', product_page), (f'{options["cart_items"]} items cart', cart_data)]:
+            self.stdout.write(payload_name)
+            expected = JSONRenderer().render(data)
+            for name, renderer in renderers:
+                body = renderer.render(data)
+                seconds = timeit(lambda: renderer.render(data), number=options['repeat'])
+                same = '' if isinstance(renderer, MessagePackRenderer) else (' same bytes' if body == expected else ' DIFFERENT bytes')
+                self.stdout.write(f'  {name}: {seconds / options["repeat"] * 1000:.3f} ms, {len(body)} bytes{same}')
@@ -0,0 +1,16 @@
+# Custom management command: python manage.py build_related_products
+# Run it periodically (ex: every hour with cron), each run only processes the orders placed since the previous one
+from django.core.management.base import BaseCommand
+
+from store.related import build_related_products
+
+
+class Command(BaseCommand):
+    help = 'Updates the "customers also bought" products from the co-purchases of the new orders'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild from the first order, ignoring the saved matrix')
+    
+    def handle(self, *args, **options):
+        count = build_related_products(full=options['full'], log=self.stdout.write)
+        self.stdout.write(f'{count} products updated.')
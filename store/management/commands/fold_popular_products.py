@@ -0,0 +1,21 @@
+# Custom management command: python manage.py fold_popular_products
+# Run it periodically (ex: every few minutes with cron) to refresh the popular products ranking
+# It needs a shared counter backend (PRODUCT_COUNTERS['BACKEND'] = 'store.counters.RedisCounterBackend')
+from django.core.management.base import BaseCommand, CommandError
+
+from store.counters import fold_popularity, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Folds the product view and purchase counters of the current window into the ProductPopularity table'
+    
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if not getattr(backend, 'shared', False):
+            # This process didn't count anything, folding would replace the ranking with an empty one
+            raise CommandError(
+                f'{type(backend).__name__} keeps the counters in the memory of each web process, this command can\'t read them. '
+                'Configure a shared backend like store.counters.RedisCounterBackend in PRODUCT_COUNTERS["BACKEND"].'
+            )
+        count = fold_popularity()
+        self.stdout.write(f'{count} products ranked.')
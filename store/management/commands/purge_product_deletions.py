@@ -0,0 +1,13 @@
+# Custom management command: python manage.py purge_product_deletions
+# Run it periodically (ex: daily with cron) to keep the deletion log of the change feed small
+from django.core.management.base import BaseCommand
+
+from store.changes import purge_deletions
+
+
+class Command(BaseCommand):
+    help = 'Deletes the product tombstones older than CHANGE_FEED["RETENTION"] seconds'
+    
+    def handle(self, *args, **options):
+        count = purge_deletions()
+        self.stdout.write(f'{count} tombstones purged.')
@@ -0,0 +1,17 @@
+# Custom management command: python manage.py reconcile_payments
+# Run it periodically (ex: every few minutes with cron) to move the pending orders to Complete or Failed (store/payments.py)
+from django.core.management.base import BaseCommand
+
+from store.models import Order
+from store.payments import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Checks the pending orders against the payment gateway and saves their final payment status'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Default: PAYMENTS["BATCH_SIZE"]')
+    
+    def handle(self, *args, **options):
+        updated = reconcile_payments(options['batch_size'], log=self.stdout.write)
+        self.stdout.write(f'{updated[Order.PS_COMPLETE]} orders complete, {updated[Order.PS_FAILED]} orders failed.')
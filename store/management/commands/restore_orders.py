@@ -0,0 +1,16 @@
+# Custom management command: python manage.py restore_orders 12 15 20
+# Moves archived orders back to the Order and OrderItem tables
+from django.core.management.base import BaseCommand
+
+from store.archive import restore_orders
+
+
+class Command(BaseCommand):
+    help = 'Restores archived orders by id'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='+', type=int)
+    
+    def handle(self, *args, **options):
+        orders, items = restore_orders(options['ids'])
+        self.stdout.write(f'{orders} orders and {items} items restored.')
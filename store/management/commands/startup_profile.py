@@ -0,0 +1,54 @@
+# Custom management command: python manage.py startup_profile [--budget 800]
+# Starts a fresh Python process with -X importtime, loads Django and the URLconf like a worker does, and reports the import time per module
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does on a cold start: setup the apps and resolve the URLconf (this imports every views/serializers module)
+WORKER_STARTUP = 'import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns'
+
+
+class Command(BaseCommand):
+    help = 'Reports import time per module for a cold worker start, optionally failing when it exceeds a budget'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='How many modules to show')
+        parser.add_argument('--budget', type=float, help='Fail if the total import time in milliseconds is bigger than this')
+    
+    def handle(self, *args, **options):
+        # The child process uses the same settings module we were called with, ex: --settings storefront.settings_api
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', WORKER_STARTUP],
+            env=env, capture_output=True, text=True, cwd=settings.BASE_DIR
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        
+        modules = self.parse_importtime(result.stderr)
+        total_ms = sum(self_us for self_us, cumulative_us in modules.values()) / 1000
+        
+        self.stdout.write(f'Settings: {settings.SETTINGS_MODULE}')
+        self.stdout.write(f'{"self ms":>9} {"cumulative ms":>14}  module')
+        # Sorting by cumulative time shows which top level imports are expensive (ex: debug_toolbar)
+        ranking = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in ranking[:options['top']]:
+            self.stdout.write(f'{self_us / 1000:>9.1f} {cumulative_us / 1000:>14.1f}  {name}')
+        self.stdout.write(f'Total import time: {total_ms:.1f} ms in {len(modules)} modules')
+        
+        if options['budget'] is not None and total_ms > options['budget']:
+            raise CommandError(f'Import time {total_ms:.1f} ms exceeds the budget of {options["budget"]:.1f} ms')
+    
+    # Lines look like: "import time:       268 |        268 |   django.utils.version"
+    @staticmethod
+    def parse_importtime(output):
+        modules = {}
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+        return modules
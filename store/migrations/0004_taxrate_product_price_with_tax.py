@@ -0,0 +1,37 @@
+# Generated by Django 5.2.10 on 2026-10-19 10:12
+
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models.functions import Round
+
+
+# Filling price_with_tax for existing products with the default 10% rate
+def fill_price_with_tax(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Product.objects.update(price_with_tax=Round(models.F('unit_price') * Decimal('1.10'), 2, output_field=models.DecimalField(max_digits=8, decimal_places=2)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_alter_order_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('membership', models.CharField(blank=True, choices=[('B', 'Bronze'), ('S', 'Silver'), ('G', 'Gold')], max_length=1, null=True, unique=True)),
+                ('rate', models.DecimalField(decimal_places=4, max_digits=5, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_with_tax',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=8),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_price_with_tax, migrations.RunPython.noop),
+    ]
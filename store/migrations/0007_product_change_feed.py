@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_productpopularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['last_update', 'id'], name='product_change_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productdeletion',
+            index=models.Index(fields=['deleted_at', 'id'], name='product_deletion_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_product_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProducts',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='related_products', serialize=False, to='store.product')),
+                ('related_ids', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:11
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_relatedproducts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(django.db.models.functions.text.Lower('title'), name='collection_title_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Lower('title'), name='product_title_lower_idx'),
+        ),
+    ]
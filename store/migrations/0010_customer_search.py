@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:12
+
+from django.db import migrations, models
+
+
+def normalize(value):
+    return ' '.join((value or '').casefold().split())
+
+
+# Filling the search columns of the existing customers, the same values that Customer.save() sets
+def fill_search_columns(apps, schema_editor):
+    Customer = apps.get_model('store', 'Customer')
+    customers = []
+    for customer in Customer.objects.select_related('user').iterator(chunk_size=2000):
+        customer.search_first_name = normalize(customer.user.first_name)
+        customer.search_last_name = normalize(customer.user.last_name)
+        customer.search_email = normalize(customer.user.email)
+        customer.search_phone = ''.join(character for character in customer.phone or '' if character.isdigit())
+        customers.append(customer)
+        if len(customers) == 2000:
+            Customer.objects.bulk_update(customers, ['search_first_name', 'search_last_name', 'search_email', 'search_phone'])
+            customers = []
+    Customer.objects.bulk_update(customers, ['search_first_name', 'search_last_name', 'search_email', 'search_phone'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_title_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='search_email',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='search_first_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='search_last_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='search_phone',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_search_columns, migrations.RunPython.noop),
+    ]
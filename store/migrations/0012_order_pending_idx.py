@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('payment_status', 'P')), fields=['id'], name='order_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:05
+
+from django.db import migrations
+
+
+# The membership rates were never applied to price_with_tax, only the storefront row (membership=None) is kept
+def delete_membership_rates(apps, schema_editor):
+    TaxRate = apps.get_model('store', 'TaxRate')
+    TaxRate.objects.using(schema_editor.connection.alias).filter(membership__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_order_pending_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_membership_rates, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='taxrate',
+            name='membership',
+        ),
+    ]
@@ -3,8 +3,22 @@ from django.conf import settings
 # Module for Data Validation
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Lower, Round
+from decimal import Decimal, ROUND_HALF_UP
 from uuid import uuid4
 
+# Tax rate used when there is no TaxRate row
+DEFAULT_TAX_RATE = Decimal('0.10')
+
+# Rounding Decimals with quantize, ROUND_HALF_UP matches the SQL ROUND() for positive prices
+def compute_price_with_tax(unit_price, rate):
+    return (unit_price * (1 + rate)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+# The same calculation as an SQL expression, for updating or annotating many products in a single query
+# unit_price can be another expression, ex: the new price inside the same UPDATE
+def price_with_tax_expression(rate, unit_price=models.F('unit_price')):
+    return Round(unit_price * (1 + rate), 2, output_field=models.DecimalField(max_digits=8, decimal_places=2))
+
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
     discount = models.FloatField()
@@ -32,6 +46,9 @@ class Product(models.Model):
                                      validators=[MinValueValidator(1)])
     
     inventory = models.IntegerField(validators=[MinValueValidator(1)])
+    # Precomputed price with the storefront tax rate, stored in a column so we can filter and sort by it with an index
+    # editable=False hides it from forms and ModelSerializers, it's always calculated on save() or by the TaxRate signals
+    price_with_tax = models.DecimalField(max_digits=8, decimal_places=2, editable=False, db_index=True)
     # To storing the date of the last object update
     # auto_now=True Automatically saves the current date on this field
     last_update = models.DateTimeField(auto_now=True)
@@ -47,13 +64,54 @@ class Product(models.Model):
         # Now it will return it's title
         return self.title
     
+    # Overwriting save() to keep price_with_tax in sync with unit_price
+    def save(self, *args, **kwargs):
+        self.price_with_tax = compute_price_with_tax(self.unit_price, TaxRate.objects.current_rate())
+        super().save(*args, **kwargs)
+    
     # Creating a Meta class to define the specific order of our collection objects
     # A Djando Meta class it's a way to configure our models. Are instructions for Django
     class Meta:
         # Allows you to define an order
         ordering = ['title']
+        # Keyset index of the change feed (store/changes.py), products ordered by (last_update, id)
+        # Prefix ranges of the autocomplete fallback (store/autocomplete.py), on LOWER(title)
+        indexes = [
+            models.Index(fields=['last_update', 'id'], name='product_change_feed_idx'),
+            models.Index(Lower('title'), name='product_title_lower_idx'),
+        ]
     
+# Search columns of Customer are lower-cased with collapsed spaces, phones only keep the digits
+def normalize_search(value):
+    return ' '.join((value or '').casefold().split())
+
+def normalize_phone(value):
+    return ''.join(character for character in value or '' if character.isdigit())
+
+# Prefix lookup as a range, col >= 'smi' AND col < 'smj', it's a range scan of the index in every database
+# (LIKE 'smi%' can't use the index in SQLite, and in PostgreSQL it needs a pattern_ops index)
+def prefix_condition(field, prefix):
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return models.Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+
+class CustomerQuerySet(models.QuerySet):
+    # Prefix search by name, email or phone on the normalized columns
+    # "alice smi" also matches the first name "alice" with a last name starting with "smi"
+    def search(self, term):
+        term = normalize_search(term)
+        if not term:
+            return self
+        condition = prefix_condition('search_first_name', term) | prefix_condition('search_last_name', term) | prefix_condition('search_email', term)
+        first, _, rest = term.partition(' ')
+        if rest:
+            condition |= models.Q(search_first_name=first) & prefix_condition('search_last_name', rest)
+        phone = normalize_phone(term)
+        if len(phone) >= 3 and not any(character.isalpha() for character in term):
+            condition |= prefix_condition('search_phone', phone)
+        return self.filter(condition)
+
 class Customer(models.Model):
+    objects = CustomerQuerySet.as_manager()
     phone = models.CharField(max_length=255)
     birth_date = models.DateField(null=True, blank=True)
     # Uppercase to indicate that this is a fix list of values, we don't have to mess with it
@@ -80,11 +138,50 @@ class Customer(models.Model):
     # We had to delete first_name and last_name fields, now them will be stored in the user model, so we will need to make a relation, and change parameters names
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     
+    # Normalized copies of the user names, email and phone for Customer.objects.search(), indexed so the prefix lookups
+    # don't need a case insensitive LIKE across the join with core_user
+    # They are set on save() and by the User signal handler (store/signals/handlers.py)
+    search_first_name = models.CharField(max_length=150, db_index=True, editable=False, default='')
+    search_last_name = models.CharField(max_length=150, db_index=True, editable=False, default='')
+    search_email = models.CharField(max_length=254, db_index=True, editable=False, default='')
+    search_phone = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    
     def __str__(self):
         # Now it will return it's first and lastname when calling the object
         return f'{self.user.first_name} {self.user.last_name}'
     
+    # Returns the search columns of a customer with this user and phone
+    @staticmethod
+    def search_values(user, phone):
+        return {
+            'search_first_name': normalize_search(user.first_name),
+            'search_last_name': normalize_search(user.last_name),
+            'search_email': normalize_search(user.email),
+            'search_phone': normalize_phone(phone),
+        }
+    
+    def save(self, *args, **kwargs):
+        for field, value in self.search_values(self.user, self.phone).items():
+            setattr(self, field, value)
+        super().save(*args, **kwargs)
+    
     
+class TaxRateManager(models.Manager):
+    # Returns the storefront rate, falling back to DEFAULT_TAX_RATE when there is no row
+    def current_rate(self):
+        rate = self.order_by('-pk').values_list('rate', flat=True).first()
+        return DEFAULT_TAX_RATE if rate is None else rate
+
+# The storefront tax rate used for Product.price_with_tax, the admin allows a single row
+# There is no rate per membership: price_with_tax is one column shared by every customer, so it can be filtered and sorted in SQL
+class TaxRate(models.Model):
+    objects = TaxRateManager()
+    # 0.1000 means 10%
+    rate = models.DecimalField(max_digits=5, decimal_places=4, validators=[MinValueValidator(0)])
+    
+    def __str__(self):
+        return f'Storefront: {self.rate}'
+
 class Order(models.Model):
     placed_at = models.DateTimeField(auto_now_add=True)
     # We should never delete orders, because orders represent our sales
@@ -106,6 +203,11 @@ class Order(models.Model):
             # (codename/description to show)
             ('cancel_order', 'Can cancel order')
         ]
+        indexes = [
+            # Partial index with only the pending orders, the payment reconciliation (store/payments.py) walks it by id
+            # without reading the finished orders. MySQL doesn't support conditions, Django skips it there (models.W037)
+            models.Index(fields=['id'], name='order_pending_idx', condition=models.Q(payment_status='P')),
+        ]
     
 # Defining a 1 to 1 relationship
 class Adress(models.Model):
@@ -134,6 +236,8 @@ class Collection(models.Model):
     class Meta:
         # Allows you to define an order
         ordering = ['title']
+        # Prefix ranges of the autocomplete fallback (store/autocomplete.py), on LOWER(title)
+        indexes = [models.Index(Lower('title'), name='collection_title_lower_idx')]
         
 # Defining a * to 1 relationship with ForeignKey
 class OrderItem(models.Model):
@@ -176,4 +280,93 @@ class Review(models.Model):
     description = models.TextField(null=True, blank=True)
     name = models.CharField(max_length=255)
     date = models.DateField(auto_now_add=True)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='review')
\ No newline at end of file
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='review')
+
+
+# Progress record of a bulk admin action that runs in the background (see store/jobs.py)
+class BulkJob(models.Model):
+    STATUS_QUEUED = 'Q'
+    STATUS_RUNNING = 'R'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    description = models.CharField(max_length=255)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f'{self.description} ({self.processed}/{self.total})'
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+# Ranking of products by views and purchases in the last PRODUCT_COUNTERS['WINDOW'] seconds
+# It's rebuilt by the fold_popular_products command from the counters (store/counters.py)
+class ProductPopularity(models.Model):
+    # A purchase is worth this many views in the score
+    PURCHASE_WEIGHT = 10
+    
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    # Copy of product.collection_id so the ranking per collection is a single index scan
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+    views = models.PositiveIntegerField(default=0)
+    purchases = models.PositiveIntegerField(default=0)
+    score = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='popularity_score_idx'),
+            models.Index(fields=['collection', '-score'], name='popularity_collection_idx'),
+        ]
+
+
+# Tombstones of deleted products for the change feed (store/changes.py), written by a post_delete signal
+# Only the id is kept, rows older than CHANGE_FEED['RETENTION'] are removed by the purge_product_deletions command
+class ProductDeletion(models.Model):
+    product_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [models.Index(fields=['deleted_at', 'id'], name='product_deletion_feed_idx')]
+
+
+# "Customers also bought": the top products bought in the same orders as each product, most frequent first
+# Rebuilt incrementally by the build_related_products command (store/related.py), read with a primary key lookup
+class RelatedProducts(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='related_products')
+    # Product ids, the list is short (RELATED_PRODUCTS['TOP_K']) so one row per product is enough
+    related_ids = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+# Archive of old Complete/Failed orders, moved by the archive_orders command (store/archive.py) to keep Order and
+# OrderItem small. The rows keep their original ids, so they can be restored
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    placed_at = models.DateTimeField()
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f'Order #{self.id}'
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='+')
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -0,0 +1,108 @@
+# Payment reconciliation: the pending orders are checked against the payment gateway and moved to Complete or Failed
+# manage.py reconcile_payments walks the pending orders by id in batches (order_pending_idx only has the pending rows)
+# The gateway is asked outside of any transaction, so a slow gateway never holds locks. Then the orders with a final status
+# are claimed with select_for_update(skip_locked), checked again (still pending) and written with one UPDATE per status.
+# Orders locked by another transaction (a checkout, another reconciler) are left for the next run
+# Settings:
+# PAYMENTS = {
+#     'GATEWAY': 'store.payments.FakePaymentGateway',  # class with statuses(order_ids) -> {order_id: status}
+#     'OPTIONS': {},                                     # keyword arguments of the gateway class
+#     'BATCH_SIZE': 500,
+#     'MIN_AGE': 60,                                     # seconds, newer orders can still be paying
+# }
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order
+
+DEFAULTS = {
+    'GATEWAY': 'store.payments.FakePaymentGateway',
+    'OPTIONS': {},
+    'BATCH_SIZE': 500,
+    'MIN_AGE': 60,
+}
+
+FINAL_STATUSES = [Order.PS_COMPLETE, Order.PS_FAILED]
+
+
+def get_setting(name):
+    return getattr(settings, 'PAYMENTS', {}).get(name, DEFAULTS[name])
+
+
+# Gateway of the current process, for tests and local development: the payments are set with set_status()
+# The orders it doesn't know are still pending, or default_status if it's given
+class FakePaymentGateway:
+    def __init__(self, default_status=Order.PS_PENDING):
+        self.lock = threading.Lock()
+        self.default_status = default_status
+        self.payments = {}
+        self.requests = 0
+    
+    def set_status(self, order_id, status):
+        with self.lock:
+            self.payments[order_id] = status
+    
+    # One call per batch, real gateways should use their bulk lookup endpoint
+    def statuses(self, order_ids):
+        with self.lock:
+            self.requests += 1
+            return {order_id: self.payments.get(order_id, self.default_status) for order_id in order_ids}
+
+
+gateway = None
+gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global gateway
+    with gateway_lock:
+        if gateway is None:
+            gateway = import_string(get_setting('GATEWAY'))(**get_setting('OPTIONS'))
+        return gateway
+
+
+def reconcile_payments(batch_size=None, gateway=None, log=None):
+    """
+    Asks the gateway for the status of the pending orders older than PAYMENTS['MIN_AGE'] and saves the final ones
+    Returns {status: orders updated}
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    gateway = gateway or get_gateway()
+    log = log or (lambda message: None)
+    placed_before = timezone.now() - timedelta(seconds=get_setting('MIN_AGE'))
+    updated = {status: 0 for status in FINAL_STATUSES}
+    checked = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Order.objects.filter(pk__gt=last_id, payment_status=Order.PS_PENDING, placed_at__lt=placed_before)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        by_status = {}
+        for order_id, status in gateway.statuses(ids).items():
+            if status in FINAL_STATUSES:
+                by_status.setdefault(status, []).append(order_id)
+        if by_status:
+            with transaction.atomic():
+                # The orders could have changed while we were waiting for the gateway
+                claimed = set(
+                    Order.objects.select_for_update(skip_locked=True)
+                    .filter(pk__in=[order_id for order_ids in by_status.values() for order_id in order_ids], payment_status=Order.PS_PENDING)
+                    .values_list('pk', flat=True)
+                )
+                for status, order_ids in by_status.items():
+                    order_ids = [order_id for order_id in order_ids if order_id in claimed]
+                    if order_ids:
+                        updated[status] += Order.objects.filter(pk__in=order_ids).update(payment_status=status)
+        last_id = ids[-1]
+        checked += len(ids)
+        log(f'Checked {checked} pending orders, {updated[Order.PS_COMPLETE]} complete, {updated[Order.PS_FAILED]} failed')
+    return updated
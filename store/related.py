@@ -0,0 +1,173 @@
+# "Customers also bought" recommendations from the co-purchases of OrderItem
+# B is the order x product matrix (1 if the order has the product), C = B.T @ B is the product x product matrix of how many
+# orders have both products. The TOP_K columns of each row of C are saved in RelatedProducts
+# C is saved to a file with the last order processed, so the next run only reads the orders placed since then and
+# recalculates the rows of the products in those orders
+# NumPy and SciPy are only needed by the build_related_products command (pip install numpy scipy), not by the API
+# Settings:
+# RELATED_PRODUCTS = {
+#     'TOP_K': 10,
+#     'MATRIX_PATH': BASE_DIR / 'co_purchases.npz',
+#     'LAG': 60,              # seconds, orders newer than this are left for the next run (their items may not be committed)
+#     'CHUNK_SIZE': 10000,    # orders read from the database at a time
+# }
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .archive import order_item_rows
+from .models import ArchivedOrder, Order, Product, RelatedProducts
+
+DEFAULTS = {
+    'TOP_K': 10,
+    'MATRIX_PATH': None,
+    'LAG': 60,
+    'CHUNK_SIZE': 10000,
+}
+
+
+def get_setting(name):
+    value = getattr(settings, 'RELATED_PRODUCTS', {}).get(name, DEFAULTS[name])
+    if name == 'MATRIX_PATH' and value is None:
+        value = os.path.join(getattr(settings, 'BASE_DIR', '.'), 'co_purchases.npz')
+    return value
+
+
+def load_scipy():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError:
+        raise ImproperlyConfigured('Related products require numpy and scipy (pip install numpy scipy)')
+    return numpy, sparse
+
+
+# order_ids and product_ids are the two columns of the OrderItem rows, product ids are used as the matrix indexes
+def co_occurrence(order_ids, product_ids, n_products):
+    np, sparse = load_scipy()
+    orders, order_index = np.unique(order_ids, return_inverse=True)
+    purchases = sparse.csr_matrix(
+        (np.ones(len(product_ids), dtype=np.int32), (order_index, product_ids)),
+        shape=(len(orders), n_products),
+    )
+    # The same product in two lines of an order counts once
+    purchases.sum_duplicates()
+    purchases.data[:] = 1
+    matrix = (purchases.T @ purchases).tocsr()
+    # The diagonal is how many orders have the product, a product is not related to itself
+    matrix = (matrix - sparse.diags(matrix.diagonal(), format='csr', dtype=matrix.dtype)).tocsr()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+# Adds the co-purchases of the new orders to the saved matrix, the shapes grow with the product ids
+def merge(matrix, delta):
+    size = max(matrix.shape[0], delta.shape[0])
+    matrix = matrix.tocsr(copy=True)
+    matrix.resize((size, size))
+    delta = delta.tocsr(copy=True)
+    delta.resize((size, size))
+    return (matrix + delta).tocsr()
+
+
+# {row: [top k columns]} ordered by count and then by id, only for the given rows
+def top_k(matrix, rows, k):
+    np, sparse = load_scipy()
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    result = {}
+    for row in rows:
+        start, end = indptr[row], indptr[row + 1]
+        columns, counts = indices[start:end], data[start:end]
+        if len(columns) > k:
+            # argpartition selects the k biggest counts without sorting the whole row
+            best = np.argpartition(-counts, k - 1)[:k]
+            columns, counts = columns[best], counts[best]
+        result[int(row)] = columns[np.lexsort((columns, -counts))].tolist()
+    return result
+
+
+def load_state(path):
+    np, sparse = load_scipy()
+    if not os.path.exists(path):
+        return None, 0
+    with np.load(path) as state:
+        matrix = sparse.csr_matrix((state['data'], state['indices'], state['indptr']), shape=tuple(state['shape']))
+        return matrix, int(state['last_order_id'])
+
+
+# Written to a temporary file and renamed, so a failed run never leaves a half written state
+def save_state(path, matrix, last_order_id):
+    np, sparse = load_scipy()
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        np.savez(file, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=matrix.shape, last_order_id=last_order_id)
+    os.replace(temporary, path)
+
+
+# (order_id, product_id) pairs of the orders in (after, until], read in ranges of orders through the order_id index
+# so the rows are never loaded all at once in Python objects and every chunk has complete orders
+def read_pairs(after, until):
+    np, sparse = load_scipy()
+    chunk_size = get_setting('CHUNK_SIZE')
+    chunks = [np.empty((0, 2), dtype=np.int64)]
+    for start in range(after, until, chunk_size):
+        # Archived orders too (store/archive.py), a full rebuild still sees the old orders
+        rows = order_item_rows('order_id', 'product_id', order_id__gt=start, order_id__lte=min(start + chunk_size, until))
+        chunk = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+        chunks.append(chunk)
+    return np.concatenate(chunks)
+
+
+def build_related_products(full=False, log=None):
+    """
+    Adds the orders placed since the last run to the co-purchase matrix and saves the top products of every product
+    in those orders. full=True rebuilds everything from the first order
+    Returns how many products were updated
+    """
+    np, sparse = load_scipy()
+    log = log or (lambda message: None)
+    path = get_setting('MATRIX_PATH')
+    matrix, last_order_id = (None, 0) if full else load_state(path)
+    new_orders = {'pk__gt': last_order_id, 'placed_at__lte': timezone.now() - timedelta(seconds=get_setting('LAG'))}
+    until = max(
+        (model.objects.filter(**new_orders).aggregate(Max('id'))['id__max'] or 0 for model in (Order, ArchivedOrder)),
+    ) or None
+    if until is None:
+        log('No new orders.')
+        return 0
+    
+    start = time.perf_counter()
+    pairs = read_pairs(last_order_id, until)
+    log(f'Read {len(pairs)} order items of orders {last_order_id + 1}..{until} in {time.perf_counter() - start:.2f}s')
+    
+    start = time.perf_counter()
+    n_products = max(Product.objects.aggregate(Max('id'))['id__max'] or 0, int(pairs[:, 1].max(initial=0))) + 1
+    delta = co_occurrence(pairs[:, 0], pairs[:, 1], n_products)
+    matrix = delta if matrix is None else merge(matrix, delta)
+    rows = np.unique(pairs[:, 1])
+    related = top_k(matrix, rows, get_setting('TOP_K'))
+    log(f'Co-purchase matrix with {matrix.nnz} pairs, {len(rows)} products to update in {time.perf_counter() - start:.2f}s')
+    
+    # The state is saved before writing the table, if the write fails the next run doesn't add these orders twice
+    # (build_related_products --full rebuilds the table)
+    save_state(path, matrix, until)
+    start = time.perf_counter()
+    existing = set(Product.objects.values_list('id', flat=True))
+    with transaction.atomic():
+        if full:
+            RelatedProducts.objects.all().delete()
+        RelatedProducts.objects.bulk_create(
+            [RelatedProducts(product_id=product_id, related_ids=related_ids) for product_id, related_ids in related.items() if product_id in existing],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['related_ids', 'updated_at'],
+        )
+    log(f'Saved the related products in {time.perf_counter() - start:.2f}s')
+    return len(related)
@@ -0,0 +1,50 @@
+# Custom renderers for the store API
+# FastJSONRenderer encodes with orjson (written in Rust) and produces the same bytes as DRF's JSONRenderer for what the
+# store API renders: strings, integers, Decimals, UUIDs, datetimes and floats between 1e-4 and 1e16
+# Other floats are not the same: orjson writes 1e-7 and 1e16 where DRF writes 1e-07 and 1e+16, and null for NaN and
+# Infinity where DRF raises an error (STRICT_JSON). Walking the data or searching the output to find them would cost
+# as much as orjson saves, the store serializers don't have float fields (prices are Decimals rendered as strings)
+# MessagePackRenderer is an optional binary format for our internal services, it needs the msgpack package
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# DRF's encoder knows how to convert the types that orjson doesn't (Decimal, lazy strings, timedelta, QuerySets...)
+# Datetimes are also passed to it because DRF writes UTC as 'Z' and orjson as '+00:00'
+encoder = JSONEncoder()
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Pretty printing (?indent=4, browsable API) and non default JSON settings use DRF's renderer
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # Ex: integers bigger than 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as DRF, so the output is a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encoder.default, use_bin_type=True)
@@ -4,7 +4,7 @@ from django.db.models.aggregates import Sum
 # Serializers are classes that convert model instances to dictionaries/JSON and vice versa
 # Deserialization: convert JSON/dictionaries to model instances
 from rest_framework import serializers
-from decimal import Decimal
+from .caches import collection_cache
 from .models import Product, Collection, Customer, Review, Cart, CartItem
 
 # It's not te best way to serialize, Model Serializers are better
@@ -19,6 +19,14 @@ class CollectionSerializer(serializers.ModelSerializer):
     # Adding an Annotated() field to the model
     product_count = serializers.IntegerField(read_only=True)
     
+# Hyperlink to the collection built with the cached path, instead of calling reverse() for each product
+# When writing it still works like a normal HyperlinkedRelatedField
+class CachedCollectionLinkField(serializers.HyperlinkedRelatedField):
+    def to_representation(self, value):
+        path = collection_cache.get(value.pk)['path']
+        request = self.context.get('request')
+        return request.build_absolute_uri(path) if request is not None else path
+    
 # Creating a class to serialize Products
 # It's exactly like defining a model
 # Serializers not necesary have to look like model objects, they can have their own fields
@@ -34,8 +42,9 @@ class ProductSerializer(serializers.ModelSerializer):
     # source Django asumes that serializer fields/atributes will match models fields/atributes, if not, you need to use this parameter to indicate the model field/atributes source, but is not a good practice changing field names bc you are breaking consistency
     price = serializers.DecimalField(max_digits=6, decimal_places=2, source='unit_price')
     
-    # Custom Serializer Method Field
-    price_with_tax = serializers.SerializerMethodField(method_name='get_price_tax')
+    # price_with_tax is precomputed in the database (see Product.save() and TaxRate), so we only read the column
+    # Before it was a SerializerMethodField that calculated unit_price * Decimal(1.1) for every product on every request
+    price_with_tax = serializers.DecimalField(max_digits=8, decimal_places=2, read_only=True)
     
     # Serializing Relationships
     # Accesing the PK of a related object, the most common way. This way we can select the product from a list in the Browsable API
@@ -45,11 +54,12 @@ class ProductSerializer(serializers.ModelSerializer):
         source='collection'
     )
     # Accesing to the string representation of a related object
-    collection_title = serializers.StringRelatedField(source='collection', read_only=True)
+    # The collection fields are read from the collection cache (store/caches.py), so the product query doesn't need to join store_collection
+    collection_title = serializers.SerializerMethodField(method_name='get_collection_title')
     # Nesting the collection object
-    collection_object = CollectionSerializer(source='collection', read_only=True)
+    collection_object = serializers.SerializerMethodField(method_name='get_collection_object')
     # Generating hyperlinks of a related object
-    collection_link = serializers.HyperlinkedRelatedField(
+    collection_link = CachedCollectionLinkField(
         source='collection',
         queryset= Collection.objects.all(),
         # name of the view in urls.py
@@ -57,10 +67,11 @@ class ProductSerializer(serializers.ModelSerializer):
         required=False
     )
     
-    # Method that will be passed to SerializerMethodField, to create a Custom Serializer Field
-    # If we annotate parameters with it's corresponsant type, we will get intelisense
-    def get_price_tax(self, product:Product):
-        return product.unit_price * Decimal(1.1)
+    def get_collection_title(self, product:Product):
+        return collection_cache.get(product.collection_id)['title']
+    
+    def get_collection_object(self, product:Product):
+        return collection_cache.get(product.collection_id)['object']
 
     # Overwriting create() method. This method takes the validated_data and creates a new field "other". It's called by the save() method if we try to create a new product
     # def create(self, validated_data):
@@ -75,6 +86,18 @@ class ProductSerializer(serializers.ModelSerializer):
     #     instance.save()
     #     return instance
     
+# Serializer for each row of the bulk product endpoint (ProductViewSet.bulk)
+# It doesn't touch the database: collections and existing products are resolved for all the rows at once in the view
+class BulkProductSerializer(serializers.Serializer):
+    # Rows with id update that product (only the fields that are sent), rows without id create a new product
+    id = serializers.IntegerField(required=False)
+    title = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(max_length=50)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    inventory = serializers.IntegerField(min_value=1)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1, source='unit_price')
+    collection_id = serializers.IntegerField()
+    
 # Model Serializers
 # It's a much better way
 # This way, there is no need to define the validaton rules two times, in the serializer and the model
@@ -162,6 +185,12 @@ class AddCartItemSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('No product with the given ID was found')
         return value
     
+# Serializer for each line of the bulk cart item endpoint, it only checks the shape of the data
+# Products are validated all together in CartItemViewSet.bulk with a single query, not one query per line
+class BulkCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+    
 # Serializer to limit fields when updating a cart item
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
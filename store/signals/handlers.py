@@ -0,0 +1,131 @@
+# Signal handlers, they are connected when the app is ready (see StoreConfig.ready)
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.functions import Now
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from store.autocomplete import collection_title_index, customer_label, customer_name_index, product_title_index
+from store.caches import CATALOG_VERSION_KEY, bump_version, collection_cache, customer_profile_key, product_detail_cache
+from store.counters import record_purchase
+from store.tag_index import tag_index
+from store.tasks import LOW_INVENTORY_THRESHOLD, alert_low_inventory, send_order_confirmation
+from store.models import Collection, Customer, Order, OrderItem, Product, ProductDeletion, TaxRate, price_with_tax_expression
+from tags.models import Tag, TaggedItem
+
+# The first request of each worker process starts loading the tag index, usually before a ?tags= request needs it
+@receiver(request_started)
+def warm_up_tag_index(sender, **kwargs):
+    tag_index.warm_up()
+
+# When the storefront tax rate changes we recalculate every price_with_tax in one UPDATE, instead of saving each product
+@receiver([post_save, post_delete], sender=TaxRate)
+def update_prices_with_tax(sender, instance, **kwargs):
+    # last_update is not changed automatically by update(), we set it so caches and consumers see the new prices
+    Product.objects.update(price_with_tax=price_with_tax_expression(TaxRate.objects.current_rate()), last_update=Now())
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION_KEY))
+
+# Changing the shared version after the commit, so other workers don't reload the old data
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection_cache(sender, instance, **kwargs):
+    transaction.on_commit(collection_cache.invalidate)
+
+# A new last_update already changes the cache key, here we just free the memory of the old entries of this worker
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_detail_cache(sender, instance, **kwargs):
+    product_detail_cache.invalidate(lambda key: key[2] == instance.pk)
+
+# Tombstone for the change feed, in the same transaction as the delete
+@receiver(post_delete, sender=Product)
+def log_product_deletion(sender, instance, **kwargs):
+    ProductDeletion.objects.create(product_id=instance.pk, deleted_at=timezone.now())
+
+# Products and their tags are counted in the facets, any change invalidates every cached facet
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=TaggedItem)
+def invalidate_facets(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION_KEY))
+
+# Keeping the tag index of this worker up to date, the other workers reload it
+@receiver([post_save, post_delete], sender=TaggedItem)
+def update_tag_index(sender, instance, created=False, **kwargs):
+    if instance.content_type_id != ContentType.objects.get_for_model(Product).id:
+        return
+    # An existing TaggedItem that changes doesn't tell us its old tag or product
+    if kwargs['signal'] is post_save and not created:
+        transaction.on_commit(tag_index.invalidate)
+    else:
+        added = kwargs['signal'] is post_save
+        transaction.on_commit(lambda: tag_index.update(instance.tag_id, instance.object_id, added))
+
+# Labels are only loaded with the whole index
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag_index(sender, instance, **kwargs):
+    transaction.on_commit(tag_index.invalidate)
+
+# Autocomplete indexes (store/autocomplete.py), applied in this worker and reloaded by the others
+@receiver([post_save, post_delete], sender=Product)
+def update_product_title_index(sender, instance, **kwargs):
+    title = instance.title if kwargs['signal'] is post_save else None
+    transaction.on_commit(lambda: product_title_index.update(instance.pk, title))
+
+@receiver([post_save, post_delete], sender=Collection)
+def update_collection_title_index(sender, instance, **kwargs):
+    title = instance.title if kwargs['signal'] is post_save else None
+    transaction.on_commit(lambda: collection_title_index.update(instance.pk, title))
+
+@receiver([post_save, post_delete], sender=Customer)
+def update_customer_name_index(sender, instance, **kwargs):
+    label = customer_label(instance.user.first_name, instance.user.last_name) if kwargs['signal'] is post_save else None
+    transaction.on_commit(lambda: customer_name_index.update(instance.pk, label))
+
+# The customer names are in the user
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_customer_name_index_from_user(sender, instance, created, **kwargs):
+    if not created:
+        label = customer_label(instance.first_name, instance.last_name)
+        customer_id = Customer.objects.filter(user_id=instance.pk).values_list('id', flat=True).first()
+        if customer_id is not None:
+            transaction.on_commit(lambda: customer_name_index.update(customer_id, label))
+
+# Keeping the search columns of the customer (Customer.search_values) in sync with the user
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_customer_search_columns(sender, instance, created, **kwargs):
+    if not created:
+        values = Customer.search_values(instance, '')
+        del values['search_phone']
+        Customer.objects.filter(user_id=instance.pk).update(**values)
+
+# Every order item placed counts as a purchase for the popular products ranking
+@receiver(post_save, sender=OrderItem)
+def count_purchase(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: record_purchase(instance.product_id, instance.quantity))
+
+# Side effects of the checkout run in the background workers (core/tasks.py), not in the request
+# The task rows are written in the same transaction, the workers only see them once it's committed
+@receiver(post_save, sender=Order)
+def enqueue_order_confirmation(sender, instance, created, **kwargs):
+    if created:
+        send_order_confirmation.delay(instance.pk)
+
+# One alert per product and day (store/tasks.py), claimed after the commit so a rolled back save doesn't use it
+@receiver(post_save, sender=Product)
+def enqueue_low_inventory_alert(sender, instance, **kwargs):
+    if instance.inventory < LOW_INVENTORY_THRESHOLD:
+        alert_low_inventory([instance.pk])
+
+# Creating the customer profile once, when the user is created (registration with djoser, admin, createsuperuser)
+# This way /store/customers/me/ doesn't need a get_or_create on every request
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_customer_for_new_user(sender, instance, created, **kwargs):
+    if created:
+        Customer.objects.create(user=instance)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_customer_profile(sender, instance, **kwargs):
+    transaction.on_commit(lambda: cache.delete(customer_profile_key(instance.user_id)))
@@ -0,0 +1,254 @@
+# In-memory inverted index of the product tags, for ?tags= boolean expressions on the product list
+# Each tag has a bitmap of its products: a Python int where bit n is set if product n has the tag, so AND, OR and
+# AND NOT of tags are single big integer operations instead of self-joins of tags_taggeditem in SQL
+# The index is loaded once per worker, in the background when the worker receives its first request (warm_up), and kept
+# up to date by the TaggedItem signals (store/signals/handlers.py). Not at import: pre-fork servers (uWSGI, gunicorn
+# --preload) import the application in the master, the workers would inherit the lock held by the loading thread
+# Results with more than MAX_IDS products aren't sent as an id IN (...) list, the expression becomes tag subqueries in SQL
+# Expression syntax: labels (case insensitive, "quoted" if they have spaces or operators) combined with
+#   AND , &     OR |     NOT ! -     ( )
+# ex: ?tags=red,blue,-sale    ?tags=(red | blue) & NOT "on sale"
+# Settings:
+# TAG_INDEX = {'MAX_IDS': 1000}
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db.models import Q
+
+from .caches import VersionedLocalCache, bump_version
+
+DEFAULTS = {
+    'MAX_IDS': 1000,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TAG_INDEX', {}).get(name, DEFAULTS[name])
+
+
+class TagExpressionError(ValueError):
+    pass
+
+
+TOKEN = re.compile(r'\s*(?:(?P<op>[(),&|!-])|"(?P<quoted>[^"]*)"|(?P<word>[^\s(),&|!"]+))')
+KEYWORDS = {'AND': '&', 'OR': '|', 'NOT': '!'}
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None:
+            raise TagExpressionError(f'Unexpected character at position {position}.')
+        position = match.end()
+        if match.group('op') is not None:
+            tokens.append(('op', '&' if match.group('op') == ',' else '!' if match.group('op') == '-' else match.group('op')))
+        elif match.group('quoted') is not None:
+            tokens.append(('label', match.group('quoted')))
+        elif match.group('word').upper() in KEYWORDS:
+            tokens.append(('op', KEYWORDS[match.group('word').upper()]))
+        else:
+            tokens.append(('label', match.group('word')))
+    return tokens
+
+
+# Recursive descent parser, the result is a tree of tuples: ('label', 'red'), ('not', node), ('and', a, b), ('or', a, b)
+# expression := term (| term)*     term := factor (& factor)*     factor := ! factor | ( expression ) | label
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+    
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+    
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+    
+    def parse(self):
+        if not self.tokens:
+            raise TagExpressionError('Empty tag expression.')
+        node = self.expression()
+        if self.position < len(self.tokens):
+            raise TagExpressionError(f'Unexpected "{self.peek()[1]}".')
+        return node
+    
+    def expression(self):
+        node = self.term()
+        while self.peek() == ('op', '|'):
+            self.take()
+            node = ('or', node, self.term())
+        return node
+    
+    def term(self):
+        node = self.factor()
+        while self.peek() == ('op', '&'):
+            self.take()
+            node = ('and', node, self.factor())
+        return node
+    
+    def factor(self):
+        kind, value = self.take()
+        if (kind, value) == ('op', '!'):
+            return ('not', self.factor())
+        if (kind, value) == ('op', '('):
+            node = self.expression()
+            if self.take() != ('op', ')'):
+                raise TagExpressionError('Missing ")".')
+            return node
+        if kind == 'label':
+            return ('label', value)
+        raise TagExpressionError('Expected a tag.' if kind is None else f'Unexpected "{value}".')
+
+
+def parse(expression):
+    return Parser(tokenize(expression)).parse()
+
+
+# Results are (bitmap, negated): negated means "every product except the bitmap", so NOT doesn't need the list of
+# every product, the queryset uses exclude() instead
+def combine_and(a, b):
+    (x, x_negated), (y, y_negated) = a, b
+    if x_negated and y_negated:
+        return x | y, True
+    if x_negated:
+        return y & ~x, False
+    if y_negated:
+        return x & ~y, False
+    return x & y, False
+
+
+def combine_or(a, b):
+    (x, x_negated), (y, y_negated) = a, b
+    if x_negated and y_negated:
+        return x & y, True
+    if x_negated:
+        return x & ~y, True
+    if y_negated:
+        return y & ~x, True
+    return x | y, False
+
+
+def bitmap_from_ids(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for id in ids:
+        bits[id >> 3] |= 1 << (id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def ids_from_bitmap(bitmap):
+    ids = []
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        if byte:
+            ids.extend(index * 8 + bit for bit in range(8) if byte >> bit & 1)
+    return ids
+
+
+class TagIndex(VersionedLocalCache):
+    version_key = 'store:tag_index:version'
+    # Process that started the warm up
+    warmed_pid = None
+    
+    # {'labels': {label: [tag ids]}, 'tags': {tag ids}, 'bitmaps': {tag id: bitmap of product ids}}
+    def load(self):
+        # Imported here like in CollectionCache.load
+        from tags.models import Tag, TaggedItem
+        from .models import Product
+        labels = {}
+        tags = set()
+        for tag_id, label in Tag.objects.values_list('id', 'label'):
+            labels.setdefault(label.lower(), []).append(tag_id)
+            tags.add(tag_id)
+        product_ids = {}
+        rows = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Product)).values_list('tag_id', 'object_id')
+        for tag_id, product_id in rows.iterator(chunk_size=10000):
+            product_ids.setdefault(tag_id, []).append(product_id)
+        return {'labels': labels, 'tags': tags, 'bitmaps': {tag_id: bitmap_from_ids(ids) for tag_id, ids in product_ids.items()}}
+    
+    # Applies a TaggedItem change to the index of this worker, the other workers reload the whole index
+    def update(self, tag_id, product_id, added):
+        with self.lock:
+            version = bump_version(self.version_key)
+            if self.data is None:
+                return
+            bitmaps = self.data['bitmaps']
+            if added:
+                bitmaps[tag_id] = bitmaps.get(tag_id, 0) | 1 << product_id
+            else:
+                bitmaps[tag_id] = bitmaps.get(tag_id, 0) & ~(1 << product_id)
+            self.version = version
+            # A new tag, its label is only in the database
+            if tag_id not in self.data['tags']:
+                self.data = None
+    
+    def evaluate(self, node, data):
+        kind = node[0]
+        if kind == 'label':
+            bitmap = 0
+            for tag_id in data['labels'].get(node[1].lower(), ()):
+                bitmap |= data['bitmaps'].get(tag_id, 0)
+            return bitmap, False
+        if kind == 'not':
+            bitmap, negated = self.evaluate(node[1], data)
+            return bitmap, not negated
+        combine = combine_and if kind == 'and' else combine_or
+        return combine(self.evaluate(node[1], data), self.evaluate(node[2], data))
+    
+    # Returns (product ids, negated) for the expression, negated means every product except those ids
+    def query(self, expression):
+        bitmap, negated = self.evaluate(parse(expression), self.get_data())
+        return ids_from_bitmap(bitmap), negated
+    
+    # Filters a product queryset with the expression: the ids of the index, or subqueries when there are too many ids
+    def filter(self, queryset, expression):
+        node = parse(expression)
+        bitmap, negated = self.evaluate(node, self.get_data())
+        if bitmap.bit_count() > get_setting('MAX_IDS'):
+            return queryset.filter(self.to_q(node, ContentType.objects.get_for_model(queryset.model)))
+        if negated:
+            return queryset.exclude(id__in=ids_from_bitmap(bitmap))
+        return queryset.filter(id__in=ids_from_bitmap(bitmap))
+    
+    # The expression in SQL, each label is a subquery of tags_taggeditem
+    def to_q(self, node, content_type):
+        from tags.models import TaggedItem
+        kind = node[0]
+        if kind == 'label':
+            items = TaggedItem.objects.filter(content_type=content_type, tag__label__iexact=node[1])
+            return Q(id__in=items.values('object_id'))
+        if kind == 'not':
+            return ~self.to_q(node[1], content_type)
+        if kind == 'and':
+            return self.to_q(node[1], content_type) & self.to_q(node[2], content_type)
+        return self.to_q(node[1], content_type) | self.to_q(node[2], content_type)
+    
+    # Loads the index in a thread, once per process. The requests that arrive meanwhile wait for it in get_data() instead
+    # of loading it again
+    def warm_up(self):
+        with self.lock:
+            if self.warmed_pid == os.getpid():
+                return
+            self.warmed_pid = os.getpid()
+        
+        def run():
+            try:
+                self.get_data()
+            finally:
+                # The thread has its own database connections
+                connections.close_all()
+        
+        threading.Thread(target=run, name='TagIndex-load', daemon=True).start()
+
+
+tag_index = TagIndex()
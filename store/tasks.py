@@ -0,0 +1,57 @@
+# Background tasks of the store, executed by manage.py run_workers (see core/tasks.py)
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import mail_admins, send_mail
+from django.db import transaction
+
+from core.tasks import task
+from .models import Order, Product
+
+# Products with less units than this send an alert to the admins
+LOW_INVENTORY_THRESHOLD = 10
+
+
+@task
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('customer__user').get(pk=order_id)
+    items = order.orderitem_set.select_related('product')
+    lines = [f'{item.quantity} x {item.product.title}: {item.quantity * item.unit_price}' for item in items]
+    user = order.customer.user
+    send_mail(
+        subject=f'Order #{order.pk} confirmation',
+        message=f'Hi {user.first_name},\n\nWe received your order:\n' + '\n'.join(lines),
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        recipient_list=[user.email],
+    )
+
+
+@task
+def send_low_inventory_alert(product_id):
+    product = Product.objects.filter(pk=product_id).first()
+    # The product could be restocked or deleted before the task runs
+    if product is None or product.inventory >= LOW_INVENTORY_THRESHOLD:
+        return
+    mail_admins(
+        subject=f'Low inventory: {product.title}',
+        message=f'Product #{product.pk} "{product.title}" has {product.inventory} units left.',
+    )
+
+
+# One alert per product and day, saving a product with low inventory again doesn't send more emails
+# The day is claimed after the commit, a rolled back change doesn't use it. The post_save signal calls it for
+# Product.save(), the paths that don't send signals (update() of the bulk jobs, bulk_update() of the bulk endpoint) call it
+# with the ids of the products they left under LOW_INVENTORY_THRESHOLD
+def alert_low_inventory(product_ids):
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: [claim_low_inventory_alert(product_id) for product_id in product_ids])
+
+
+def claim_low_inventory_alert(product_id):
+    key = f'store:inventory_alert:{product_id}'
+    if not cache.add(key, True, 86400):
+        return
+    try:
+        send_low_inventory_alert.delay(product_id)
+    except Exception:
+        cache.delete(key)
+        raise
@@ -1,3 +1,1189 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib.util import find_spec
+from io import StringIO
+from unittest import mock, skipUnless
+from uuid import uuid4
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core import tasks
+from core.models import Task
+from core.nplusone import NPlusOneError, detect_n_plus_one
+from .admin import clear_inventory_chunk
+from .autocomplete import PrefixIndex, product_title_index, title_prefix
+from . import counters, jobs
+from .caches import CollectionCache, LRUCache, SharedFlight, collection_cache, product_detail_cache, product_list_flight
+from .archive import archive_orders, order_rows, restore_orders
+from .changes import encode_cursor
+from .facets import get_facets
+from .tag_index import tag_index
+from .payments import FakePaymentGateway, reconcile_payments
+from .related import build_related_products
+from .renderers import FastJSONRenderer
+from .serializers import ProductSerializer
+from .tasks import send_low_inventory_alert
+from .throttling import ProductListThrottle, ProductSearchThrottle
+from tags.models import Tag, TaggedItem
+from .models import ArchivedOrder, ArchivedOrderItem, BulkJob, Cart, CartItem, Collection, Customer, Order, OrderItem, Product, ProductPopularity, RelatedProducts, Review, TaxRate, compute_price_with_tax
+
+# More rows than the threshold in every list, so an N+1 in any of them is reported
+ROWS = 6
+THRESHOLD = 3
+
+
+# Every store endpoint and admin changelist is requested with the N+1 detector raising (core/nplusone.py)
+@override_settings(N_PLUS_ONE={'ENABLED': True, 'RAISE': True, 'THRESHOLD': THRESHOLD})
+@modify_settings(MIDDLEWARE={'append': 'core.middleware.NPlusOneMiddleware'})
+class NPlusOneTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password', first_name='Ada', last_name='Admin')
+        TaxRate.objects.create(rate=Decimal('0.10'))
+        collections = [Collection.objects.create(title=f'Collection {i}') for i in range(ROWS)]
+        cls.products = [
+            Product.objects.create(
+                title=f'Product {i}', slug=f'product-{i}', description='', inventory=20,
+                unit_price=Decimal('10.00') + i, collection=collections[i % ROWS]
+            )
+            for i in range(ROWS)
+        ]
+        for product in cls.products:
+            Review.objects.create(product=cls.products[0], name='Reviewer', title='Good', description=product.title)
+        customers = []
+        for i in range(ROWS):
+            user = User.objects.create_user(f'user{i}', f'user{i}@example.com', 'password', first_name=f'First{i}', last_name=f'Last{i}')
+            customers.append(Customer.objects.get(user=user))
+        cls.cart = Cart.objects.create()
+        for product in cls.products:
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=2)
+        old = timezone.now() - timedelta(days=400)
+        for i, customer in enumerate(customers):
+            order = Order.objects.create(customer=customer, payment_status=Order.PS_COMPLETE)
+            OrderItem.objects.create(order=order, product=cls.products[i], quantity=1, unit_price=cls.products[i].unit_price)
+            archived = ArchivedOrder.objects.create(id=1000 + i, customer=customer, placed_at=old, payment_status=Order.PS_COMPLETE)
+            ArchivedOrderItem.objects.create(id=1000 + i, order=archived, product=cls.products[i], quantity=1, unit_price=cls.products[i].unit_price)
+            BulkJob.objects.create(description=f'Job {i}', total=10, processed=10, created_by=cls.admin)
+    
+    def setUp(self):
+        # Throttle buckets and cached responses of other tests
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+    
+    # The autocomplete indexes load in a thread with its own connection, it can't see the test data, the database fallback is used
+    @mock.patch.object(PrefixIndex, 'load_in_background')
+    def test_api_endpoints(self, load_in_background):
+        product = self.products[0]
+        urls = [
+            reverse('products-list'),
+            reverse('products-list') + '?facets=true',
+            reverse('products-detail', args=[product.pk]),
+            reverse('products-popular'),
+            reverse('products-changes'),
+            reverse('products-autocomplete') + '?q=prod',
+            reverse('collection-list'),
+            reverse('collection-detail', args=[product.collection_id]),
+            reverse('collection-autocomplete') + '?q=coll',
+            reverse('product-reviews-list', args=[product.pk]),
+            reverse('cart-detail', args=[self.cart.pk]),
+            reverse('cart-items-list', args=[self.cart.pk]),
+            reverse('customer-list'),
+            reverse('customer-list') + '?search=first',
+            reverse('customer-me'),
+            reverse('customer-autocomplete') + '?q=first',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.api.get(url)
+                self.assertEqual(response.status_code, 200)
+    
+    def test_admin_changelists(self):
+        for model in admin.site._registry:
+            if model._meta.app_label != 'store':
+                continue
+            with self.subTest(model=model.__name__):
+                response = self.client.get(reverse(f'admin:store_{model._meta.model_name}_changelist'))
+                self.assertEqual(response.status_code, 200)
+
+
+class NPlusOneDetectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collections = [Collection.objects.create(title=f'Collection {i}') for i in range(ROWS)]
+        for i in range(ROWS):
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', inventory=1, unit_price=1, collection=collections[i])
+    
+    def test_reports_the_serializer_field(self):
+        class ProductTitleSerializer(serializers.ModelSerializer):
+            collection_title = serializers.StringRelatedField(source='collection')
+    
+            class Meta:
+                model = Product
+                fields = ['id', 'collection_title']
+    
+        with self.assertRaisesMessage(NPlusOneError, 'ProductTitleSerializer.collection_title'):
+            with detect_n_plus_one(threshold=THRESHOLD, raise_error=True):
+                ProductTitleSerializer(Product.objects.all(), many=True).data
+    
+        with detect_n_plus_one(threshold=THRESHOLD, raise_error=True):
+            ProductTitleSerializer(Product.objects.select_related('collection'), many=True).data
+    
+    def test_logs_when_not_raising(self):
+        with self.assertLogs('core.nplusone', 'WARNING') as logs:
+            with detect_n_plus_one('loop', threshold=THRESHOLD, raise_error=False):
+                [product.collection.title for product in Product.objects.all()]
+        self.assertIn(f'{ROWS} x SELECT', logs.output[0])
+        self.assertIn('store/tests.py', logs.output[0])
+
+
+class AutocompleteFallbackTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        for title in ['coffee beans', 'Coffee Cake', 'Cocoa', 'Bread Coffee Cake']:
+            Product.objects.create(title=title, slug='product', inventory=1, unit_price=1, collection=collection)
+    
+    def test_prefix_matches_ignore_the_case(self):
+        self.assertEqual([label for id, label in product_title_index.fallback('COF', 10)], ['coffee beans', 'Coffee Cake'])
+        self.assertEqual([label for id, label in product_title_index.fallback('co', 1)], ['Cocoa'])
+    
+    def test_cold_and_warm_workers_return_the_same_matches(self):
+        data = product_title_index.load()
+        for term in ['cof', 'COFFEE  c', 'bea', 'bread', 'co', 'cake', 'x']:
+            self.assertEqual(product_title_index.search_index(data, term, 10), product_title_index.fallback(term, 10), term)
+    
+    # The autocomplete indexes load in a thread with its own connection, the endpoint uses the database fallback
+    @mock.patch.object(PrefixIndex, 'load_in_background')
+    def test_limit_is_clamped(self, load_in_background):
+        url = reverse('products-autocomplete')
+        for limit, count in [('-1', 1), ('0', 1), ('2', 2), ('500', 3)]:
+            response = self.client.get(url, {'q': 'c', 'limit': limit})
+            self.assertEqual((response.status_code, len(response.json()['results'])), (200, count), limit)
+    
+    @skipUnless(connection.vendor == 'sqlite', 'the plan is checked on SQLite')
+    def test_the_expression_index_is_used(self):
+        self.assertIn('USING INDEX product_title_lower_idx', title_prefix(Product.objects.all(), 'cof').explain())
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle-tests'}},
+    PRODUCT_THROTTLE_RATES={'product_list': '5/min', 'product_search': '2/min'},
+    PRODUCT_THROTTLE_API_KEYS={'partner-key': 'partner'},
+)
+class ThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def allowed(self, throttle_class, count, **extra):
+        factory = APIRequestFactory()
+        results = [throttle_class().allow_request(Request(factory.get('/store/products/', **extra)), None) for i in range(count)]
+        return results.count(True)
+    
+    def test_budget(self):
+        self.assertEqual(self.allowed(ProductListThrottle, 8), 5)
+        throttle = ProductListThrottle()
+        self.assertFalse(throttle.allow_request(Request(APIRequestFactory().get('/store/products/')), None))
+        self.assertGreater(throttle.wait(), 0)
+    
+    def test_search_has_its_own_budget(self):
+        self.assertEqual(self.allowed(ProductListThrottle, 5), 5)
+        factory = APIRequestFactory()
+        searches = [ProductSearchThrottle().allow_request(Request(factory.get('/store/products/', {'search': 'x'})), None) for i in range(3)]
+        self.assertEqual(searches, [True, True, False])
+    
+    def test_unknown_api_keys_use_the_ip_budget(self):
+        factory = APIRequestFactory()
+        results = [
+            ProductListThrottle().allow_request(Request(factory.get('/store/products/', HTTP_X_API_KEY=f'random-{i}')), None)
+            for i in range(8)
+        ]
+        self.assertEqual(results.count(True), 5)
+    
+    def test_known_api_key_has_its_own_budget(self):
+        self.assertEqual(self.allowed(ProductListThrottle, 5), 5)
+        self.assertEqual(self.allowed(ProductListThrottle, 8, HTTP_X_API_KEY='partner-key'), 5)
+    
+    def test_concurrent_requests_dont_overspend(self):
+        factory = APIRequestFactory()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda i: ProductListThrottle().allow_request(Request(factory.get('/store/products/')), None), range(40)))
+        self.assertEqual(results.count(True), 5)
+
+
+class CollectionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        Product.objects.create(title='Product', slug='product', inventory=20, unit_price=1, collection=cls.collection)
+    
+    def setUp(self):
+        cache.clear()
+        collection_cache.invalidate()
+    
+    def collection_fields(self):
+        product = self.client.get(reverse('products-list')).json()['results'][0]
+        return product['collection_title'], product['collection_object']['title'], product['collection_link']
+    
+    def test_products_are_serialized_without_joining_the_collections(self):
+        collection_cache.get_data()
+        with CaptureQueriesContext(connection) as queries:
+            fields = self.collection_fields()
+        self.assertEqual(fields, ('Collection', 'Collection', f'http://testserver/store/collections/{self.collection.pk}/'))
+        self.assertFalse([query['sql'] for query in queries.captured_queries if 'store_collection' in query['sql']])
+    
+    def test_saving_a_collection_reloads_the_cache(self):
+        self.collection_fields()
+        self.collection.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.save()
+        self.assertEqual(self.collection_fields()[:2], ('Renamed', 'Renamed'))
+    
+    def test_new_collection_is_loaded_on_first_use(self):
+        collection_cache.get_data()
+        collection = Collection.objects.create(title='New')
+        self.assertEqual(collection_cache.get(collection.pk)['title'], 'New')
+    
+    # Another worker only sees the new version on its next check, at most check_interval seconds later
+    def test_other_workers_reload_after_the_check_interval(self):
+        worker = CollectionCache()
+        with mock.patch('store.caches.time.monotonic', return_value=1000):
+            self.assertEqual(worker.get(self.collection.pk)['title'], 'Collection')
+        Collection.objects.filter(pk=self.collection.pk).update(title='Renamed')
+        collection_cache.invalidate()
+        with mock.patch('store.caches.time.monotonic', return_value=1000.5):
+            self.assertEqual(worker.get(self.collection.pk)['title'], 'Collection')
+        with mock.patch('store.caches.time.monotonic', return_value=1002):
+            self.assertEqual(worker.get(self.collection.pk)['title'], 'Renamed')
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_entries_expire_after_the_ttl(self):
+        lru = LRUCache(max_size=10, ttl=60)
+        with mock.patch('store.caches.time.monotonic', return_value=1000):
+            self.assertEqual(lru.get_or_compute('a', lambda: 1), 1)
+            self.assertEqual(lru.get_or_compute('a', lambda: 2), 1)
+        with mock.patch('store.caches.time.monotonic', return_value=1061):
+            self.assertEqual(lru.get_or_compute('a', lambda: 3), 3)
+        self.assertEqual((lru.stats['hits'], lru.stats['misses'], lru.stats['expirations']), (1, 2, 1))
+    
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = LRUCache(max_size=2, ttl=60)
+        lru.get_or_compute('a', lambda: 1)
+        lru.get_or_compute('b', lambda: 2)
+        # 'a' is used again, 'b' is now the least recently used
+        lru.get_or_compute('a', lambda: None)
+        lru.get_or_compute('c', lambda: 3)
+        self.assertEqual(list(lru.entries), ['a', 'c'])
+        self.assertEqual(lru.stats['evictions'], 1)
+    
+    def test_only_one_thread_computes_a_missing_entry(self):
+        lru = LRUCache(max_size=10, ttl=60)
+        calls = []
+        started = threading.Event()
+        
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return 'value'
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(lru.get_or_compute, 'a', compute)
+            started.wait(2)
+            results = [first.result()] + list(executor.map(lambda i: lru.get_or_compute('a', compute), range(7)))
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+    
+    def test_a_waiting_thread_computes_when_the_first_one_fails(self):
+        lru = LRUCache(max_size=10, ttl=60)
+        started = threading.Event()
+        
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(lru.get_or_compute, 'a', fail)
+            started.wait(2)
+            second = executor.submit(lru.get_or_compute, 'a', lambda: 'value')
+            with self.assertRaises(ValueError):
+                first.result()
+            self.assertEqual(second.result(), 'value')
+
+
+class ProductDetailCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(title='Product', slug='product', inventory=20, unit_price=1, collection=collection)
+    
+    def setUp(self):
+        product_detail_cache.clear()
+    
+    # collection_link is an absolute URL, an http response can't be served to an https client
+    def test_scheme_is_part_of_the_key(self):
+        url = reverse('products-detail', args=[self.product.pk])
+        http = self.client.get(url).json()
+        https = self.client.get(url, secure=True).json()
+        self.assertTrue(http['collection_link'].startswith('http://'))
+        self.assertTrue(https['collection_link'].startswith('https://'))
+        self.assertEqual(product_detail_cache.get_stats()['size'], 2)
+    
+    def test_saving_the_product_frees_its_entries(self):
+        self.client.get(reverse('products-detail', args=[self.product.pk]))
+        self.product.save()
+        self.assertEqual(product_detail_cache.get_stats()['size'], 0)
+
+
+class TaxRateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        for i, price in enumerate(['10.00', '19.99', '0.05']):
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', inventory=20, unit_price=Decimal(price), collection=collection)
+    
+    def test_default_rate_without_a_row(self):
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('price_with_tax', flat=True)), [Decimal('11.00'), Decimal('21.99'), Decimal('0.06')])
+    
+    def test_changing_the_rate_recomputes_every_price_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            TaxRate.objects.create(rate=Decimal('0.2000'))
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "store_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('price_with_tax', flat=True)), [Decimal('12.00'), Decimal('23.99'), Decimal('0.06')])
+        # The Python and the SQL rounding agree
+        for product in Product.objects.all():
+            self.assertEqual(product.price_with_tax, compute_price_with_tax(product.unit_price, Decimal('0.2000')))
+    
+    def test_deleting_the_rate_goes_back_to_the_default(self):
+        rate = TaxRate.objects.create(rate=Decimal('0.2000'))
+        rate.delete()
+        self.assertEqual(TaxRate.objects.current_rate(), Decimal('0.10'))
+        self.assertEqual(Product.objects.get(title='Product 0').price_with_tax, Decimal('11.00'))
+    
+    def test_admin_allows_a_single_rate(self):
+        model_admin = admin.site._registry[TaxRate]
+        self.assertTrue(model_admin.has_add_permission(None))
+        TaxRate.objects.create(rate=Decimal('0.2000'))
+        self.assertFalse(model_admin.has_add_permission(None))
+
+
+class FastJSONRendererTests(TestCase):
+    def assertSameBytes(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+    
+    def test_product_page(self):
+        collection = Collection.objects.create(title='Collection')
+        # Serialized in memory, like the bench_renderers command
+        products = [
+            Product(
+                id=i + 1, title=f'Product {i} \u00e9\u2028\U0001f600', slug=f'product-{i}', description='Description', inventory=10,
+                unit_price=Decimal('9.99') + i, price_with_tax=compute_price_with_tax(Decimal('9.99') + i, Decimal('0.10')),
+                collection=collection, last_update=timezone.now()
+            )
+            for i in range(20)
+        ]
+        request = Request(APIRequestFactory().get('/store/products/'))
+        self.assertSameBytes({
+            'count': 20, 'next': 'http://testserver/store/products/?page=2', 'previous': None,
+            'results': ProductSerializer(products, many=True, context={'request': request}).data,
+        })
+    
+    def test_cart_and_other_values(self):
+        self.assertSameBytes({
+            'id': uuid4(),
+            'items': [{'id': 1, 'quantity': 2, 'total_price': Decimal('19.98')}],
+            'total_price': Decimal('19.98'),
+            'placed_at': datetime(2026, 10, 19, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            'duration': timedelta(minutes=5),
+            'counts': {1: 3, 2: 0},
+            'floats': [0.0, -0.0, 0.5, 0.0001, 1234.25, 1 / 3, 1e15],
+            'big': 2 ** 70,
+            'flags': [True, False, None],
+        })
+    
+    # The differences documented in store/renderers.py, floats that the store serializers don't produce
+    def test_floats_with_an_exponent_and_non_finite_floats_differ(self):
+        self.assertEqual(FastJSONRenderer().render([1e-7, 1e16]), b'[1e-7,1e16]')
+        self.assertEqual(JSONRenderer().render([1e-7, 1e16]), b'[1e-07,1e+16]')
+        self.assertEqual(FastJSONRenderer().render([float('nan')]), b'[null]')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render([float('nan')])
+
+
+# Two SharedFlight instances with the same prefix are two workers sharing the cache
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'flight-tests'}})
+class SharedFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.workers = [SharedFlight('test:flight', wait=2, poll_interval=0.01) for i in range(2)]
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+    
+    def slow(self, result):
+        def function():
+            self.calls.append(result)
+            self.started.set()
+            self.release.wait(2)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return function
+    
+    def run_both(self, leader_result):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            leader = executor.submit(self.workers[0].do, 'key', self.slow(leader_result))
+            self.started.wait(2)
+            timer = threading.Timer(0.1, self.release.set)
+            timer.start()
+            follower = self.workers[1].do('key', lambda: self.calls.append('follower') or 'follower')
+            timer.join()
+            return leader, follower
+    
+    def test_other_worker_receives_the_result_of_the_leader(self):
+        leader, follower = self.run_both({'results': [1]})
+        self.assertEqual((leader.result(), follower), ({'results': [1]}, {'results': [1]}))
+        self.assertEqual(self.calls, [{'results': [1]}])
+        self.assertEqual(self.workers[1].stats['shared'], 1)
+    
+    def test_other_worker_runs_the_function_when_the_leader_fails(self):
+        error = ValueError('leader')
+        leader, follower = self.run_both(error)
+        self.assertEqual(follower, 'follower')
+        with self.assertRaises(ValueError):
+            leader.result()
+    
+    def test_the_next_call_runs_again(self):
+        self.assertEqual(self.workers[0].do('key', lambda: 1), 1)
+        self.assertEqual(self.workers[1].do('key', lambda: 2), 2)
+    
+    # The lists have absolute URLs, http and https requests can't share them
+    # (no database here, the first request of the process would start the tag index warm up)
+    @mock.patch.object(tag_index, 'warm_up')
+    def test_product_list_key_has_the_scheme(self, warm_up):
+        keys = []
+        with mock.patch.object(product_list_flight, 'do', lambda key, function: keys.append(key) or {}):
+            self.client.get(reverse('products-list'))
+            self.client.get(reverse('products-list'), secure=True)
+        self.assertEqual([key[0] for key in keys], ['http', 'https'])
+        self.assertEqual(keys[0][1:], keys[1][1:])
+
+
+class CustomerProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user', 'user@example.com', 'password', first_name='Ada', last_name='Lovelace')
+    
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+    
+    def me(self):
+        response = self.api.get(reverse('customer-me'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_customer_is_created_with_the_user(self):
+        self.assertEqual(Customer.objects.filter(user=self.user).count(), 1)
+        self.user.save()
+        self.assertEqual(Customer.objects.filter(user=self.user).count(), 1)
+    
+    def test_registration_saves_the_birth_date_in_the_customer(self):
+        response = self.client.post('/auth/users/', {
+            'username': 'new', 'password': 'a-Long-passw0rd', 'email': 'new@example.com',
+            'first_name': 'New', 'last_name': 'User', 'birth_date': '1990-05-17',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('birth_date', response.data)
+        self.assertEqual(Customer.objects.get(user_id=response.data['id']).birth_date.isoformat(), '1990-05-17')
+    
+    def test_profile_is_read_from_the_cache(self):
+        self.assertEqual(self.me()['membership'], Customer.MEMBERSHIP_BRONZE)
+        with self.assertNumQueries(0):
+            self.me()
+    
+    def test_put_refreshes_the_cached_profile(self):
+        self.me()
+        response = self.api.put(reverse('customer-me'), {'phone': '555-0100', 'birth_date': None, 'membership': Customer.MEMBERSHIP_GOLD}, format='json')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me()['membership'], Customer.MEMBERSHIP_GOLD)
+    
+    def test_changes_outside_the_endpoint_drop_the_cached_profile(self):
+        self.me()
+        customer = Customer.objects.get(user=self.user)
+        customer.membership = Customer.MEMBERSHIP_SILVER
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.save()
+        self.assertEqual(self.me()['membership'], Customer.MEMBERSHIP_SILVER)
+    
+    def test_users_without_customer(self):
+        Customer.objects.filter(user=self.user).delete()
+        self.assertEqual(self.me()['user_id'], self.user.pk)
+        self.assertEqual(Customer.objects.filter(user=self.user).count(), 1)
+    
+    def test_backfill_customers(self):
+        other = get_user_model().objects.create_user('other', 'other@example.com', 'password')
+        Customer.objects.filter(user__in=[self.user, other]).delete()
+        output = StringIO()
+        call_command('backfill_customers', batch_size=1, stdout=output)
+        self.assertEqual(output.getvalue().strip(), '2 customers created.')
+        self.assertEqual(Customer.objects.filter(user__in=[self.user, other]).count(), 2)
+
+
+class CustomerSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password', first_name='Ada', last_name='Admin')
+        for username, first_name, last_name, phone in [('alice', 'Alice', 'Smith', '(555) 010-0001'), ('bob', 'Bob', 'Alison', '555 020 0002'), ('carol', 'Carol', 'Smithers', '')]:
+            user = User.objects.create_user(username, f'{username}@shop.example.com', 'password', first_name=first_name, last_name=last_name)
+            customer = Customer.objects.get(user=user)
+            customer.phone = phone
+            customer.save()
+    
+    def usernames(self, term):
+        return sorted(Customer.objects.search(term).values_list('user__username', flat=True))
+    
+    def test_prefixes_of_the_name_email_and_phone(self):
+        self.assertEqual(self.usernames('ALI'), ['alice', 'bob'])
+        self.assertEqual(self.usernames('smith'), ['alice', 'carol'])
+        self.assertEqual(self.usernames('  Alice   smi '), ['alice'])
+        self.assertEqual(self.usernames('carol@shop'), ['carol'])
+        self.assertEqual(self.usernames('555-01'), ['alice'])
+        self.assertEqual(self.usernames('555'), ['alice', 'bob'])
+        self.assertEqual(self.usernames('lice'), [])
+        self.assertEqual(len(self.usernames('')), 4)
+    
+    def test_user_changes_update_the_search_columns(self):
+        user = get_user_model().objects.get(username='bob')
+        user.last_name = 'Jones'
+        user.save()
+        self.assertEqual(self.usernames('jon'), ['bob'])
+        self.assertEqual(self.usernames('alis'), [])
+    
+    def test_api_and_admin_search(self):
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        response = api.get(reverse('customer-list'), {'search': 'smi'})
+        self.assertEqual(sorted(customer['user_id'] for customer in response.json()), sorted(Customer.objects.filter(user__username__in=['alice', 'carol']).values_list('user_id', flat=True)))
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:store_customer_changelist'), {'q': 'Smithe'})
+        self.assertEqual([customer.user.username for customer in response.context['cl'].result_list], ['carol'])
+    
+    @skipUnless(connection.vendor == 'sqlite', 'the plan is checked on SQLite')
+    def test_the_indexes_are_used(self):
+        plan = Customer.objects.search('smi').explain()
+        self.assertNotIn('SCAN store_customer', plan)
+        self.assertIn('search_last_name', plan)
+
+
+class TagFilterTests(TestCase):
+    EXPRESSIONS = ['red', 'red & blue', 'red | blue', '-red', 'NOT (red | blue)', 'blue, -red', 'missing']
+    
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        products = [Product.objects.create(title=f'Product {i}', slug='product', inventory=1, unit_price=1, collection=collection) for i in range(6)]
+        red, blue = Tag.objects.create(label='Red'), Tag.objects.create(label='blue')
+        for tag, tagged in [(red, products[:3]), (blue, products[2:5])]:
+            for product in tagged:
+                TaggedItem.objects.create(tag=tag, content_object=product)
+    
+    def setUp(self):
+        tag_index.get_data(force=True)
+    
+    @mock.patch.object(tag_index, 'warmed_pid', None)
+    @mock.patch('store.tag_index.threading.Thread')
+    def test_warm_up_once_per_process(self, Thread):
+        tag_index.warm_up()
+        tag_index.warm_up()
+        self.assertEqual(Thread.call_count, 1)
+        # A forked worker doesn't use the warm up of the master
+        with mock.patch('store.tag_index.os.getpid', return_value=-1):
+            tag_index.warm_up()
+        self.assertEqual(Thread.call_count, 2)
+    
+    def ids(self, expression):
+        return sorted(tag_index.filter(Product.objects.all(), expression).values_list('pk', flat=True))
+    
+    def test_large_results_use_subqueries_with_the_same_results(self):
+        with override_settings(TAG_INDEX={'MAX_IDS': 100}):
+            expected = {expression: self.ids(expression) for expression in self.EXPRESSIONS}
+        with override_settings(TAG_INDEX={'MAX_IDS': 0}):
+            for expression in self.EXPRESSIONS:
+                queryset = tag_index.filter(Product.objects.all(), expression)
+                if expected[expression]:
+                    self.assertIn('tags_taggeditem', str(queryset.query))
+                self.assertEqual(self.ids(expression), expected[expression], expression)
+        self.assertEqual(len(expected['red & blue']), 1)
+        self.assertEqual(len(expected['NOT (red | blue)']), 1)
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first, cls.second = Collection.objects.create(title='First'), Collection.objects.create(title='Second')
+        cls.products = [
+            Product.objects.create(title=f'Product {i}', slug='product', inventory=inventory, unit_price=price, collection=collection)
+            for i, (collection, price, inventory) in enumerate([(cls.first, 5, 5), (cls.first, 15, 20), (cls.first, 30, 20), (cls.second, 600, 1)])
+        ]
+        red = Tag.objects.create(label='Red')
+        for product in cls.products[:2]:
+            TaggedItem.objects.create(tag=red, content_object=product)
+    
+    def setUp(self):
+        cache.clear()
+        tag_index.get_data(force=True)
+    
+    def facets(self, **params):
+        response = self.client.get(reverse('products-list'), {'facets': 'true', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets']
+    
+    def test_counts(self):
+        facets = self.facets()
+        self.assertEqual(facets['collection'], {self.first.pk: 3, self.second.pk: 1})
+        self.assertEqual(facets['price'], {'0-10': 1, '10-25': 1, '25-50': 1, '50-100': 0, '100-250': 0, '250-500': 0, '500+': 1})
+        self.assertEqual(facets['stock'], {'in_stock': 2, 'low_stock': 2})
+        self.assertEqual(facets['tag'], {'Red': 2})
+    
+    def test_counts_follow_the_filters(self):
+        facets = self.facets(collection_id=self.second.pk)
+        self.assertEqual(facets['collection'], {self.second.pk: 1})
+        self.assertEqual(facets['stock'], {'in_stock': 0, 'low_stock': 1})
+        self.assertEqual(facets['tag'], {})
+        self.assertEqual(self.facets(tags='red')['collection'], {self.first.pk: 2})
+    
+    def test_without_facets(self):
+        response = self.client.get(reverse('products-list'))
+        self.assertNotIn('facets', response.data)
+    
+    def test_page_and_ordering_share_the_cached_facets(self):
+        get_facets(Product.objects.all(), QueryDict('facets=true'))
+        with self.assertNumQueries(0):
+            facets = get_facets(Product.objects.all(), QueryDict('facets=true&page=2&ordering=-unit_price'))
+        self.assertEqual(facets['stock'], {'in_stock': 2, 'low_stock': 2})
+    
+    def test_saving_a_product_updates_the_counts(self):
+        self.assertEqual(self.facets()['stock'], {'in_stock': 2, 'low_stock': 2})
+        product = self.products[0]
+        product.inventory = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.facets()['stock'], {'in_stock': 3, 'low_stock': 1})
+
+
+# numpy and scipy are optional, only the build_related_products command needs them
+@skipUnless(find_spec('scipy'), 'needs numpy and scipy')
+class RelatedProductsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.products = [Product.objects.create(title=f'Product {i}', slug='product', inventory=20, unit_price=1, collection=collection) for i in range(5)]
+        user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        cls.customer = Customer.objects.get(user=user)
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(RELATED_PRODUCTS={'TOP_K': 2, 'LAG': 0, 'CHUNK_SIZE': 2, 'MATRIX_PATH': os.path.join(directory.name, 'co_purchases.npz')})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        product_detail_cache.clear()
+    
+    def order(self, *indexes):
+        order = Order.objects.create(customer=self.customer)
+        for index in indexes:
+            OrderItem.objects.create(order=order, product=self.products[index], quantity=1, unit_price=1)
+    
+    def related(self, index):
+        return [self.products.index(Product.objects.get(pk=pk)) for pk in RelatedProducts.objects.get(product=self.products[index]).related_ids]
+    
+    def test_top_products_by_co_purchases(self):
+        self.order(0, 1, 2)
+        self.order(0, 1)
+        # The same product twice in an order counts once
+        self.order(0, 3, 3)
+        self.assertEqual(build_related_products(), 4)
+        # Ties are ordered by id
+        self.assertEqual(self.related(0), [1, 2])
+        self.assertEqual(self.related(1), [0, 2])
+        self.assertEqual(self.related(3), [0])
+        self.assertFalse(RelatedProducts.objects.filter(product=self.products[4]).exists())
+    
+    def test_next_run_only_updates_the_products_of_the_new_orders(self):
+        self.order(0, 1)
+        self.order(2, 3)
+        build_related_products()
+        RelatedProducts.objects.filter(product=self.products[2]).update(related_ids=[])
+        self.order(0, 4)
+        self.order(0, 4)
+        self.assertEqual(build_related_products(), 2)
+        # The saved matrix still has the co-purchases of the first run
+        self.assertEqual(self.related(0), [4, 1])
+        self.assertEqual(self.related(4), [0])
+        # The rows are updated in place, the products of the old orders are not recalculated
+        self.assertEqual(RelatedProducts.objects.count(), 5)
+        self.assertEqual(self.related(2), [])
+        self.assertEqual(build_related_products(), 0)
+    
+    def test_full_rebuild(self):
+        self.order(0, 1)
+        build_related_products()
+        RelatedProducts.objects.filter(product=self.products[0]).update(related_ids=[])
+        self.assertEqual(build_related_products(full=True), 2)
+        self.assertEqual(self.related(0), [1])
+    
+    def test_product_detail(self):
+        self.order(0, 1, 2)
+        self.order(0, 2)
+        build_related_products()
+        url = reverse('products-detail', args=[self.products[0].pk])
+        related = self.client.get(url).json()['related_products']
+        self.assertEqual([product['id'] for product in related], [self.products[2].pk, self.products[1].pk])
+        self.assertEqual(set(related[0]), {'id', 'title', 'unit_price'})
+        # Ids of deleted products are skipped, and the browsable API returns the same list
+        RelatedProducts.objects.filter(product=self.products[0]).update(related_ids=[0, self.products[1].pk])
+        related = self.client.get(url).json()['related_products']
+        self.assertEqual([product['id'] for product in related], [self.products[1].pk])
+        response = self.client.get(url, {'format': 'api'})
+        self.assertEqual([product['id'] for product in response.data['related_products']], [self.products[1].pk])
+
+
+class ChangeFeedTests(TestCase):
+    def changes(self, cursor):
+        return self.client.get(reverse('products-changes'), {'cursor': cursor})
+    
+    def test_cursor_round_trip(self):
+        response = self.client.get(reverse('products-changes'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.changes(response.json()['next_cursor']).status_code, 200)
+    
+    def test_cursor_without_time_zone_is_invalid(self):
+        naive = datetime.now() - timedelta(minutes=1)
+        self.assertEqual(self.changes(encode_cursor((naive, 1), (timezone.now(), 1))).status_code, 400)
+        self.assertEqual(self.changes(encode_cursor(None, (naive, 1))).status_code, 400)
+    
+    def test_limit_must_be_positive(self):
+        for limit in ['-1', 'x']:
+            self.assertEqual(self.client.get(reverse('products-changes'), {'limit': limit}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('products-changes'), {'limit': '1'}).status_code, 200)
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user('customer', 'customer@example.com', 'password')
+        customer = Customer.objects.get(user=user)
+        collection = Collection.objects.create(title='Collection')
+        product = Product.objects.create(title='Product', slug='product', inventory=10, unit_price=5, collection=collection)
+        cls.placed_at = timezone.now() - timedelta(days=400)
+        cls.orders = []
+        for status in [Order.PS_COMPLETE, Order.PS_FAILED, Order.PS_PENDING]:
+            order = Order.objects.create(customer=customer, payment_status=status)
+            OrderItem.objects.create(order=order, product=product, quantity=2, unit_price=5)
+            cls.orders.append(order)
+        # placed_at is auto_now_add, old orders are made with update()
+        Order.objects.update(placed_at=cls.placed_at)
+    
+    def test_archive_and_restore_keep_ids_and_dates(self):
+        before = sorted(order_rows())
+        self.assertEqual(archive_orders(batch_size=1), (2, 2))
+        # Pending orders stay in the hot table
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [self.orders[2].pk])
+        self.assertEqual(set(ArchivedOrder.objects.values_list('placed_at', flat=True)), {self.placed_at})
+        self.assertEqual(sorted(order_rows()), before)
+        
+        self.assertEqual(restore_orders([self.orders[0].pk, self.orders[1].pk]), (2, 2))
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertEqual(set(Order.objects.values_list('placed_at', flat=True)), {self.placed_at})
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertEqual(sorted(order_rows()), before)
+
+
+class BulkProductTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(title='Product', slug='product', inventory=20, unit_price=Decimal('10.00'), collection=cls.collection)
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+    
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+    
+    def row(self, i):
+        return {'title': f'New {i}', 'slug': f'new-{i}', 'inventory': 20, 'price': '19.99', 'collection_id': self.collection.pk}
+    
+    def post(self, rows):
+        return self.api.post(reverse('products-bulk'), rows, format='json')
+    
+    def test_staff_only(self):
+        self.api.force_authenticate(get_user_model().objects.create_user('user', 'user@example.com', 'password'))
+        self.assertEqual(self.post([self.row(0)]).status_code, 403)
+    
+    def test_expects_a_list(self):
+        response = self.post(self.row(0))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Expected a list of products.'})
+    
+    def test_each_row_has_its_own_result(self):
+        response = self.post([
+            self.row(0),
+            {'id': self.product.pk, 'price': '20.00'},
+            {**self.row(2), 'price': '0.50'},
+            {**self.row(3), 'collection_id': 0},
+            {'id': 0, 'title': 'Missing'},
+            {'title': 'No slug'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['errors']), (1, 1, 4))
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3, 4, 5])
+        self.assertEqual([result['status'] for result in results], ['created', 'updated', 'error', 'error', 'error', 'error'])
+        self.assertIn('price', results[2]['errors'])
+        self.assertEqual(results[3]['errors'], {'collection_id': ['No collection with the given ID was found']})
+        self.assertEqual(results[4]['errors'], {'id': ['No product with the given ID was found']})
+        self.assertEqual(set(results[5]['errors']), {'slug', 'inventory', 'price', 'collection_id'})
+        
+        created = Product.objects.get(pk=results[0]['id'])
+        self.assertEqual((created.title, created.unit_price, created.price_with_tax), ('New 0', Decimal('19.99'), Decimal('21.99')))
+        # Partial update: the other fields are kept, price_with_tax follows the new price
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.title, self.product.unit_price, self.product.price_with_tax), ('Product', Decimal('20.00'), Decimal('22.00')))
+        self.assertEqual(Product.objects.count(), 2)
+    
+    def test_queries_dont_grow_with_the_rows(self):
+        def count_queries(rows):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post(rows).status_code, 200)
+            return len(queries)
+        
+        few = count_queries([self.row(i) for i in range(2)] + [{'id': self.product.pk, 'inventory': 30}])
+        many = count_queries([self.row(i) for i in range(100, 130)] + [{'id': self.product.pk, 'inventory': 40}])
+        self.assertEqual(few, many)
+
+
+class BulkCartItemTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.large = Product.objects.create(title='Large', slug='large', inventory=40000, unit_price=1, collection=collection)
+        cls.small = Product.objects.create(title='Small', slug='small', inventory=5, unit_price=1, collection=collection)
+    
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.api = APIClient()
+    
+    def post(self, lines):
+        response = self.api.post(reverse('cart-items-bulk', args=[self.cart.pk]), lines, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [error['index'] for error in response.data['errors']]
+    
+    def quantity(self, product):
+        return CartItem.objects.get(cart=self.cart, product=product).quantity
+    
+    def test_merged_lines_cant_exceed_the_column_maximum(self):
+        errors = self.post([{'product_id': self.large.pk, 'quantity': 32767}, {'product_id': self.large.pk, 'quantity': 32767}])
+        self.assertEqual(errors, [1])
+        self.assertEqual(self.quantity(self.large), 32767)
+    
+    def test_existing_quantity_counts_against_the_inventory(self):
+        CartItem.objects.create(cart=self.cart, product=self.small, quantity=3)
+        errors = self.post([{'product_id': self.small.pk, 'quantity': 2}, {'product_id': self.small.pk, 'quantity': 1}])
+        self.assertEqual(errors, [1])
+        self.assertEqual(self.quantity(self.small), 5)
+    
+    def test_invalid_lines_dont_stop_the_valid_ones(self):
+        errors = self.post([{'product_id': 0, 'quantity': 1}, {'product_id': self.small.pk, 'quantity': 6}, {'product_id': self.large.pk, 'quantity': 2}])
+        self.assertEqual(errors, [0, 1])
+        self.assertEqual(self.quantity(self.large), 2)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart, product=self.small).exists())
+
+
+class LowInventoryAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(title='Product', slug='product', inventory=50, unit_price=1, collection=collection)
+    
+    def setUp(self):
+        cache.clear()
+        self.product.inventory = 2
+    
+    def alerts(self):
+        return Task.objects.filter(name=send_low_inventory_alert.name, args=[self.product.pk]).count()
+    
+    def test_rolled_back_save_doesnt_use_the_daily_alert(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.product.save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(self.alerts(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.alerts(), 1)
+    
+    def test_one_alert_per_day(self):
+        for i in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+        self.assertEqual(self.alerts(), 1)
+    
+    # bulk_update() and update() don't send post_save, the bulk paths enqueue the alerts themselves
+    def test_bulk_endpoint_alerts(self):
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api.post(reverse('products-bulk'), [{'id': self.product.pk, 'inventory': 3}, {'id': self.product.pk, 'title': 'Renamed'}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.alerts(), 1)
+    
+    def test_clear_inventory_job_alerts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            clear_inventory_chunk(Product.objects.filter(pk=self.product.pk))
+        self.assertEqual(self.alerts(), 1)
+
+
+class PopularityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.viewed = Product.objects.create(title='Viewed', slug='viewed', inventory=1, unit_price=1, collection=collection)
+        cls.bought = Product.objects.create(title='Bought', slug='bought', inventory=1, unit_price=1, collection=collection)
+    
+    def setUp(self):
+        # A new LocMemCounterBackend for each test
+        patcher = mock.patch.object(counters, 'backend', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def count_events(self):
+        for i in range(3):
+            counters.record_view(self.viewed.pk)
+        counters.record_purchase(self.bought.pk)
+    
+    def test_fold_in_the_process_that_counted(self):
+        self.count_events()
+        self.assertEqual(counters.fold_popularity(), 2)
+        self.assertEqual(dict(ProductPopularity.objects.values_list('product_id', 'score')), {self.viewed.pk: 3, self.bought.pk: 10})
+    
+    def test_command_refuses_a_process_local_backend(self):
+        ProductPopularity.objects.create(product=self.viewed, collection_id=self.viewed.collection_id, score=5)
+        with self.assertRaises(CommandError):
+            call_command('fold_popular_products')
+        self.assertTrue(ProductPopularity.objects.exists())
+    
+    @mock.patch.object(counters.LocMemCounterBackend, 'shared', True)
+    def test_command_with_a_shared_backend(self):
+        self.count_events()
+        call_command('fold_popular_products', stdout=mock.MagicMock())
+        self.assertEqual(ProductPopularity.objects.count(), 2)
+    
+    def test_popular_limit_is_clamped(self):
+        self.count_events()
+        counters.fold_popularity()
+        url = reverse('products-popular')
+        self.assertEqual([product['id'] for product in self.client.get(url, {'limit': '-1'}).json()], [self.bought.pk])
+        self.assertEqual([product['id'] for product in self.client.get(url, {'limit': '0'}).json()], [self.bought.pk])
+        self.assertEqual([product['score'] for product in self.client.get(url, {'limit': '500'}).json()], [10, 3])
+        self.assertEqual(self.client.get(url, {'limit': 'x'}).status_code, 400)
+
+
+# Chunk functions of the bulk job tests, the jobs import them by their dotted path
+chunk_calls = []
+
+
+def clear_inventory(chunk):
+    chunk_calls.append(sorted(chunk.values_list('pk', flat=True)))
+    chunk.update(inventory=0)
+
+
+def lock_error_once(chunk):
+    clear_inventory(chunk)
+    if len(chunk_calls) == 1:
+        raise OperationalError('database is locked')
+
+
+def fail_second_chunk(chunk):
+    if chunk_calls:
+        raise ValueError('second chunk')
+    clear_inventory(chunk)
+
+
+@override_settings(BULK_JOBS={'CHUNK_SIZE': 2, 'RETRIES': 1})
+class BulkJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.products = [
+            Product.objects.create(title=f'Product {i}', slug=f'product-{i}', inventory=20, unit_price=1, collection=collection)
+            for i in range(5)
+        ]
+    
+    def setUp(self):
+        chunk_calls.clear()
+    
+    def start(self, function):
+        with transaction.atomic():
+            job = jobs.start_job('Test job', Product.objects.all(), f'{__name__}.{function.__name__}')
+        self.assertEqual(job.status, BulkJob.STATUS_QUEUED)
+        return job
+    
+    # What manage.py run_workers does, in the connection of the test (the workers close their old connections first)
+    @mock.patch.object(tasks, 'close_old_connections')
+    def run_workers(self, close_old_connections):
+        for task_id in tasks.claim(10):
+            tasks.execute(task_id)
+    
+    def test_job_runs_in_the_task_queue(self):
+        job = self.start(clear_inventory)
+        self.assertEqual(Task.objects.get().name, jobs.run_bulk_job.name)
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.total), (BulkJob.STATUS_DONE, 5, 5))
+        self.assertFalse(Product.objects.exclude(inventory=0).exists())
+        self.assertEqual(Task.objects.get().status, Task.STATUS_DONE)
+    
+    def test_rolled_back_job_is_never_queued(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                jobs.start_job('Test job', Product.objects.all(), f'{__name__}.clear_inventory')
+                raise ValueError
+        self.assertFalse(BulkJob.objects.exists())
+        self.assertFalse(Task.objects.exists())
+    
+    def test_chunk_is_retried_after_an_operational_error(self):
+        job = self.start(lock_error_once)
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (BulkJob.STATUS_DONE, 5))
+        self.assertEqual(len(chunk_calls), 4)
+        self.assertFalse(Product.objects.exclude(inventory=0).exists())
+    
+    def test_failed_chunk_keeps_the_committed_ones(self):
+        job = self.start(fail_second_chunk)
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (BulkJob.STATUS_FAILED, 2))
+        self.assertIn('ValueError: second chunk', job.error)
+        self.assertEqual(Product.objects.filter(inventory=0).count(), 2)
+    
+    def test_job_of_a_dead_worker_resumes_after_the_timeout(self):
+        job = self.start(clear_inventory)
+        # The worker committed the first chunk and died: the job stays running and the task keeps its old lock
+        Product.objects.filter(pk__in=[product.pk for product in self.products[:2]]).update(inventory=0)
+        BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.STATUS_RUNNING, processed=2)
+        Task.objects.update(status=Task.STATUS_RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (BulkJob.STATUS_DONE, 5))
+        self.assertEqual(chunk_calls, [[product.pk for product in self.products[2:4]], [self.products[4].pk]])
+        self.assertFalse(Product.objects.exclude(inventory=0).exists())
+    
+    def test_admin_chunk_functions(self):
+        collection = Collection.objects.create(title='Other')
+        with transaction.atomic():
+            jobs.start_job('Price', Product.objects.all(), 'store.admin.change_price_chunk', {'percentage': '10'})
+            jobs.start_job('Move', Product.objects.all(), 'store.admin.move_to_collection_chunk', {'collection_id': collection.pk})
+        self.run_workers()
+        self.assertEqual(set(Product.objects.values_list('unit_price', 'collection_id')), {(Decimal('1.10'), collection.pk)})
+    
+    def test_running_job_keeps_its_task_locked(self):
+        job = self.start(clear_inventory)
+        Task.objects.update(status=Task.STATUS_RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        jobs.heartbeat(job.pk)
+        self.assertEqual(tasks.claim(10), [])
+
+
+# A gateway that checks it's never called inside a transaction, and runs on_call (a checkout, another worker) meanwhile
+class CheckedGateway(FakePaymentGateway):
+    def __init__(self, atomic_blocks, on_call=None):
+        super().__init__()
+        self.atomic_blocks = atomic_blocks
+        self.on_call = on_call
+    
+    def statuses(self, order_ids):
+        # TestCase wraps each test in atomic blocks, a reconciler transaction would add one
+        assert len(connection.atomic_blocks) == self.atomic_blocks, 'the gateway was called inside a transaction'
+        if self.on_call:
+            self.on_call(order_ids)
+        return super().statuses(order_ids)
+
+
+@override_settings(PAYMENTS={'MIN_AGE': 60})
+class PaymentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user('customer', 'customer@example.com', 'password')
+        customer = Customer.objects.get(user=user)
+        cls.orders = [Order.objects.create(customer=customer) for i in range(5)]
+        Order.objects.update(placed_at=timezone.now() - timedelta(minutes=5))
+        # Still paying
+        cls.new_order = Order.objects.create(customer=customer)
+    
+    def gateway(self, on_call=None):
+        gateway = CheckedGateway(len(connection.atomic_blocks), on_call)
+        gateway.set_status(self.orders[0].pk, Order.PS_COMPLETE)
+        gateway.set_status(self.orders[1].pk, Order.PS_FAILED)
+        gateway.set_status(self.new_order.pk, Order.PS_COMPLETE)
+        return gateway
+    
+    def statuses(self):
+        return dict(Order.objects.values_list('pk', 'payment_status'))
+    
+    def test_final_statuses_are_saved(self):
+        gateway = self.gateway()
+        self.assertEqual(reconcile_payments(batch_size=2, gateway=gateway), {Order.PS_COMPLETE: 1, Order.PS_FAILED: 1})
+        statuses = self.statuses()
+        self.assertEqual(statuses[self.orders[0].pk], Order.PS_COMPLETE)
+        self.assertEqual(statuses[self.orders[1].pk], Order.PS_FAILED)
+        # Unknown to the gateway
+        self.assertEqual({statuses[order.pk] for order in self.orders[2:]}, {Order.PS_PENDING})
+        # Newer than MIN_AGE
+        self.assertEqual(statuses[self.new_order.pk], Order.PS_PENDING)
+        # One request per batch of 2
+        self.assertEqual(gateway.requests, 3)
+    
+    def test_orders_changed_during_the_gateway_call_are_not_overwritten(self):
+        def checkout(order_ids):
+            Order.objects.filter(pk=self.orders[0].pk).update(payment_status=Order.PS_FAILED)
+        
+        gateway = self.gateway(checkout)
+        self.assertEqual(reconcile_payments(gateway=gateway), {Order.PS_COMPLETE: 0, Order.PS_FAILED: 1})
+        self.assertEqual(self.statuses()[self.orders[0].pk], Order.PS_FAILED)
+        self.assertEqual(gateway.requests, 1)
+    
+    def test_second_run_has_nothing_to_do(self):
+        reconcile_payments(gateway=self.gateway())
+        gateway = self.gateway()
+        self.assertEqual(reconcile_payments(gateway=gateway), {Order.PS_COMPLETE: 0, Order.PS_FAILED: 0})
+        self.assertEqual(gateway.requests, 1)
@@ -0,0 +1,105 @@
+# Custom throttles for the catalog, with a sliding window counter per client (API key, user or IP)
+# Each client can make CAPACITY requests per PERIOD: the requests of the current window are counted, and the ones of the
+# previous window are weighted by the part of it that is still inside the sliding window. Like a token bucket of
+# CAPACITY tokens refilled at CAPACITY per PERIOD, it allows bursts of CAPACITY and a steady rate of CAPACITY / PERIOD
+# The counters only use cache.add() and cache.incr(), that are atomic in LocMemCache (tests), Redis and Memcached, so
+# concurrent workers can't spend more than the budget
+# Settings:
+# PRODUCT_THROTTLE_RATES = {'product_search': '30/min', 'product_list': '120/min'}
+# PRODUCT_THROTTLE_CACHE = 'default'
+# PRODUCT_THROTTLE_API_KEYS = {'<key>': 'partner-name'}  # only these X-API-Key values get their own budget
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_RATES = {
+    'product_search': '30/min',
+    'product_list': '120/min',
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+API_KEY_HEADER = 'HTTP_X_API_KEY'
+
+
+def parse_rate(rate):
+    # '30/min' -> (30, 60)
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    scope = None
+    
+    def __init__(self):
+        rates = {**DEFAULT_RATES, **getattr(settings, 'PRODUCT_THROTTLE_RATES', {})}
+        self.capacity, self.period = parse_rate(rates[self.scope])
+        self.cache = caches[getattr(settings, 'PRODUCT_THROTTLE_CACHE', 'default')]
+        self.wait_seconds = None
+    
+    # Subclasses decide which requests count against their budget
+    def applies_to(self, request):
+        return True
+    
+    # Unknown API keys are ignored, otherwise sending a random key in each request would give a new budget each time
+    def get_client(self, request):
+        client = getattr(settings, 'PRODUCT_THROTTLE_API_KEYS', {}).get(request.META.get(API_KEY_HEADER))
+        if client is not None:
+            return f'key:{client}'
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.id}'
+        return f'ip:{self.get_ident(request)}'
+    
+    # Atomic increment of the counter of a window, created if it doesn't exist (or just expired)
+    def incr(self, key):
+        for attempt in range(2):
+            self.cache.add(key, 0, self.period * 2)
+            try:
+                return self.cache.incr(key)
+            except ValueError:
+                continue
+        return 1
+    
+    def allow_request(self, request, view):
+        if not self.applies_to(request) or (request.user and request.user.is_staff):
+            return True
+        prefix = f'throttle:{self.scope}:{self.get_client(request)}'
+        now = time.time()
+        window, elapsed = divmod(now, self.period)
+        current_key = f'{prefix}:{int(window)}'
+        count = self.incr(current_key)
+        previous = self.cache.get(f'{prefix}:{int(window) - 1}', 0)
+        weight = 1 - elapsed / self.period
+        if previous * weight + count <= self.capacity:
+            return True
+        # Rejected requests don't use the budget
+        try:
+            self.cache.decr(current_key)
+        except ValueError:
+            pass
+        count -= 1
+        # The previous window leaves the sliding window little by little, the current one only when the window changes
+        if previous and count < self.capacity:
+            self.wait_seconds = max(0, (1 - (self.capacity - count - 1) / previous) * self.period - elapsed)
+        else:
+            self.wait_seconds = self.period - elapsed
+        return False
+    
+    # Seconds until the next allowed request, DRF sends it in the Retry-After header
+    def wait(self):
+        return self.wait_seconds
+
+
+# Searches are expensive and can't be cached, they have a smaller budget
+class ProductSearchThrottle(SlidingWindowThrottle):
+    scope = 'product_search'
+    
+    def applies_to(self, request):
+        return bool(request.query_params.get('search'))
+
+
+class ProductListThrottle(SlidingWindowThrottle):
+    scope = 'product_list'
+    
+    def applies_to(self, request):
+        return not request.query_params.get('search')
@@ -1,5 +1,3 @@
-# A function to make pretty printss
-from pprint import pprint
 # Object to define URLS
 from django.urls import path
 # Our views module
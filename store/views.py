@@ -1,5 +1,11 @@
+import time
+
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
 # Shortcut to
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.db import transaction
 from django.db.models.aggregates import Count
 # Djangofilters library
 from django_filters.rest_framework import DjangoFilterBackend
@@ -14,6 +20,7 @@ from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 # Pagination default
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 # Mixins are classes that encapsulate some patterns of code (Create, List, Retrive, Delete, Update)
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, ListModelMixin, UpdateModelMixin
@@ -21,18 +28,51 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 # Our app
+from .archive import product_has_orders
+from .autocomplete import collection_title_index, customer_name_index, product_title_index
+from .caches import CATALOG_VERSION_KEY, CUSTOMER_PROFILE_TIMEOUT, bump_version, collection_cache, customer_profile_key, product_detail_cache, product_list_flight
+from .changes import ExpiredCursor, InvalidCursor, get_changes
+from .counters import record_view
+from .facets import get_facets
 from .filters import ProductFilter
-from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Customer
+from .models import Product, Collection, Review, Cart, CartItem, Customer, ProductPopularity, RelatedProducts, TaxRate, compute_price_with_tax
 from .pagination import DefaultPagination
-from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartItemSerializer, CartSerializer, AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer
+from .tasks import LOW_INVENTORY_THRESHOLD, alert_low_inventory
+from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartItemSerializer, CartSerializer, AddCartItemSerializer, UpdateCartItemSerializer, BulkCartItemSerializer, BulkProductSerializer, CustomerSerializer, SimpleProductSerializer
 from .permissions import IsAdminOrReadOnly
+from .renderers import FastJSONRenderer
+from .throttling import ProductListThrottle, ProductSearchThrottle
+
+# Rows per INSERT/UPDATE statement in the bulk product endpoint
+BULK_BATCH_SIZE = 1000
+
+# Largest value of CartItem.quantity (PositiveSmallIntegerField)
+CART_ITEM_MAX_QUANTITY = 32767
+
+# Maximum matches of the autocomplete endpoints
+AUTOCOMPLETE_LIMIT = 10
+
+# GET .../autocomplete/?q=cof&limit=10 -> {'results': [{'id', 'label'}], 'source': 'index' or 'database'}
+def autocomplete_response(request, index):
+    term = request.query_params.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT)), AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return Response({'error': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not term:
+        return Response({'results': [], 'source': None})
+    matches, source = index.search(term, limit)
+    return Response({'results': [{'id': id, 'label': label} for id, label in matches], 'source': source})
 
 # API RESTful Views
 # View Sets
 # ModelViewSet is just a combination of all the Mixins
 class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.select_related('collection').all()
+    # No select_related('collection') here, the serializer reads the collections from the collection cache
+    queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    # Safe methods (GET, HEAD, OPTIONS) read from a replica when ReplicaMiddleware is enabled
+    read_from_replica = True
     # Generic Filters/Backend, beside giving us generic filters, also implement a button to change between filters
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     # We only have to choose the fields we want to filter (Old)
@@ -45,7 +85,7 @@ class ProductViewSet(ModelViewSet):
     # Also we can search for later classes like collection__title
     search_fields = ['title', 'description']
     # Ordering - Django restframework give us a backend for ordering by fields
-    ordering_fields = ['unit_price', 'title', 'last_update']
+    ordering_fields = ['unit_price', 'price_with_tax', 'title', 'last_update']
     permission_classes = [IsAdminOrReadOnly]
     
     # Filters (Old)
@@ -62,12 +102,197 @@ class ProductViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'request':self.request}
     
+    # ?facets=true adds the facet counts of the filtered products (store/facets.py) to the paginated response
+    # Identical lists requested at the same time are coalesced: one query and one serialization, the same data for every request
+    # in every worker (store/caches.py SharedFlight)
+    def list(self, request, *args, **kwargs):
+        # The responses have absolute URLs (collection links, pagination), the scheme and the host are part of the key
+        key = (request.scheme, request.get_host(), request.get_full_path())
+        return Response(product_list_flight.do(key, lambda: self.get_list_data(request, *args, **kwargs)))
+    
+    def get_list_data(self, request, *args, **kwargs):
+        data = super().list(request, *args, **kwargs).data
+        if request.query_params.get('facets') in ('true', '1'):
+            data['facets'] = get_facets(self.filter_queryset(self.get_queryset()), request.query_params)
+        return data
+    
+    # Rate limits for anonymous and regular users, only for the list (search and plain list have their own budgets)
+    def get_throttles(self):
+        if self.action == 'list':
+            return [ProductSearchThrottle(), ProductListThrottle()]
+        return super().get_throttles()
+    
+    # GET /store/products/popular/?collection_id=&limit=10
+    # Reads the precomputed ranking (ProductPopularity), it's an index scan of limit rows
+    @action(detail=False)
+    def popular(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            return Response({'error': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        ranking = ProductPopularity.objects.order_by('-score')
+        collection_id = request.query_params.get('collection_id')
+        if collection_id is not None:
+            if not collection_id.isdigit():
+                return Response({'error': 'collection_id must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+            ranking = ranking.filter(collection_id=collection_id)
+        scores = list(ranking.values_list('product_id', 'score')[:limit])
+        products = Product.objects.in_bulk([product_id for product_id, score in scores])
+        return Response([
+            {**ProductSerializer(products[product_id], context=self.get_serializer_context()).data, 'score': score}
+            for product_id, score in scores
+            if product_id in products
+        ])
+    
+    # GET /store/products/changes/?cursor=&limit=100
+    # Products changed and deleted since the cursor (store/changes.py), the first call without cursor returns the whole catalog
+    # Consumers keep calling with next_cursor until has_more is false, and later start again from the last next_cursor
+    @action(detail=False)
+    def changes(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 0)) or None
+        except ValueError:
+            return Response({'error': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit is not None and limit < 1:
+            return Response({'error': 'limit must be a positive number.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            products, deleted, next_cursor, has_more = get_changes(request.query_params.get('cursor'), limit)
+        except InvalidCursor as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except ExpiredCursor as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_410_GONE)
+        return Response({
+            'results': ProductSerializer(products, many=True, context=self.get_serializer_context()).data,
+            'deleted': deleted,
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+        })
+    
+    # Typeahead of the storefront search box, prefix matches of the product titles (store/autocomplete.py)
+    @action(detail=False)
+    def autocomplete(self, request):
+        return autocomplete_response(request, product_title_index)
+    
+    # POST /store/products/bulk/ with a list of products, for the catalog sync
+    # Collections and existing products are loaded with one query each, and the rows are written with bulk_create/bulk_update in batches
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        start = time.perf_counter()
+        if not isinstance(request.data, list):
+            return Response({'error': 'Expected a list of products.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Validating the shape of every row in memory
+        rows = []
+        results = []
+        for index, data in enumerate(request.data):
+            is_update = isinstance(data, dict) and 'id' in data
+            serializer = BulkProductSerializer(data=data, partial=is_update)
+            if serializer.is_valid():
+                rows.append((index, serializer.validated_data))
+            else:
+                results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+        
+        collection_ids = set(Collection.objects.filter(pk__in={row['collection_id'] for index, row in rows if 'collection_id' in row}).values_list('pk', flat=True))
+        existing = Product.objects.in_bulk([row['id'] for index, row in rows if 'id' in row])
+        rate = TaxRate.objects.current_rate()
+        now = timezone.now()
+        
+        to_create = []
+        to_update = []
+        update_fields = set()
+        # bulk_create/bulk_update don't send post_save, the low inventory alerts are enqueued here
+        low_inventory = []
+        for index, row in rows:
+            if 'collection_id' in row and row['collection_id'] not in collection_ids:
+                results.append({'index': index, 'status': 'error', 'errors': {'collection_id': ['No collection with the given ID was found']}})
+                continue
+            if 'id' in row:
+                product = existing.get(row['id'])
+                if product is None:
+                    results.append({'index': index, 'status': 'error', 'errors': {'id': ['No product with the given ID was found']}})
+                    continue
+                for field, value in row.items():
+                    setattr(product, field, value)
+                update_fields.update(field for field in row if field != 'id')
+                to_update.append((index, product))
+            else:
+                product = Product(**row)
+                to_create.append((index, product))
+            # Same values that Product.save() would calculate
+            product.price_with_tax = compute_price_with_tax(product.unit_price, rate)
+            product.last_update = now
+            if 'inventory' in row and product.inventory < LOW_INVENTORY_THRESHOLD:
+                low_inventory.append(product)
+        
+        for batch_start in range(0, max(len(to_create), len(to_update)), BULK_BATCH_SIZE):
+            with transaction.atomic():
+                Product.objects.bulk_create([product for index, product in to_create[batch_start:batch_start + BULK_BATCH_SIZE]])
+                if update_fields:
+                    Product.objects.bulk_update(
+                        [product for index, product in to_update[batch_start:batch_start + BULK_BATCH_SIZE]],
+                        list(update_fields | {'price_with_tax', 'last_update'})
+                    )
+        
+        results += [{'index': index, 'status': 'created', 'id': product.pk} for index, product in to_create]
+        results += [{'index': index, 'status': 'updated', 'id': product.pk} for index, product in to_update]
+        results.sort(key=lambda result: result['index'])
+        # bulk_create/bulk_update don't send signals, we invalidate the facet counts and the autocomplete index here
+        if to_create or to_update:
+            bump_version(CATALOG_VERSION_KEY)
+            product_title_index.invalidate()
+        if low_inventory:
+            alert_low_inventory(product.pk for product in low_inventory)
+        
+        seconds = time.perf_counter() - start
+        return Response({
+            'created': len(to_create),
+            'updated': len(to_update),
+            'errors': len(results) - len(to_create) - len(to_update),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(len(request.data) / seconds, 1) if seconds else None,
+            'results': results,
+        })
+    
+    # Fast path for the product detail: the rendered JSON is cached (store/caches.py) and reused while the product doesn't change
+    # We only query last_update, when the product or its collection changes the cache key changes too
+    def retrieve(self, request, *args, **kwargs):
+        pk = str(kwargs['pk'])
+        # The browsable API and other formats use the normal path
+        if not pk.isdigit() or not isinstance(request.accepted_renderer, JSONRenderer):
+            response = super().retrieve(request, *args, **kwargs)
+            related_ids = RelatedProducts.objects.filter(pk=pk).values_list('related_ids', flat=True).first()
+            response.data['related_products'] = self.get_related_products(related_ids)
+            record_view(pk)
+            return response
+        # The related products (store/related.py) come in the same primary key lookup, a new ranking changes the cache key
+        row = Product.objects.filter(pk=pk).values_list('last_update', 'related_products__related_ids').first()
+        if row is None:
+            raise Http404
+        last_update, related_ids = row
+        record_view(pk)
+        collection_cache.get_data()
+        # The scheme and the host are part of the key because collection_link is an absolute URL
+        key = (request.scheme, request.get_host(), int(pk), last_update, collection_cache.version, tuple(related_ids or ()))
+        body = product_detail_cache.get_or_compute(key, lambda: FastJSONRenderer().render({
+            **self.get_serializer(self.get_object()).data,
+            'related_products': self.get_related_products(related_ids),
+        }))
+        return HttpResponse(body, content_type='application/json')
+    
+    # "Customers also bought", in the order of the ranking. Deleted products are skipped
+    def get_related_products(self, related_ids):
+        if not related_ids:
+            return []
+        products = Product.objects.only('id', 'title', 'unit_price').in_bulk(related_ids)
+        return SimpleProductSerializer([products[id] for id in related_ids if id in products], many=True).data
+    
     # We have the delete method to this, because ModelViewSet need it 
     # *args & **kwargs are used for a function to be able to recive aruguments without needed to know how many neither how much. Allow to overwrite methods without breakup
     # *args posicional arguments
     # **kwargs named arguments (dictionary)
     def destroy(self, request, *args, **kwargs):
-        if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
+        # Archived orders count too (store/archive.py), their items also reference the product
+        if product_has_orders(kwargs['pk']):
             return Response({'error': 'Product cannot be deleted because is associated with an order item.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         
         return super().destroy(request, *args, **kwargs)
@@ -205,8 +430,14 @@ def product_detail(request, id):
 class CollectionViewSet(ModelViewSet):
     queryset = Collection.objects.annotate(product_count=Count('product')).all()
     serializer_class = CollectionSerializer
+    # Safe methods (GET, HEAD, OPTIONS) read from a replica when ReplicaMiddleware is enabled
+    read_from_replica = True
     permission_classes = [IsAdminOrReadOnly]
     
+    @action(detail=False)
+    def autocomplete(self, request):
+        return autocomplete_response(request, collection_title_index)
+    
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(collection_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Collection cannot be deleted because is associated with a product.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -215,6 +446,8 @@ class CollectionViewSet(ModelViewSet):
     
 class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
+    # Safe methods (GET, HEAD, OPTIONS) read from a replica when ReplicaMiddleware is enabled
+    read_from_replica = True
     
     def get_serializer_context(self, *args, **kwargs):
         # In this case kwargs contain URL parameters
@@ -252,6 +485,60 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
     
+    # POST /carts/{id}/cart-items/bulk/ with a list of {product_id, quantity}
+    # Like POST on cart-items, quantities are added to the items that are already in the cart
+    # Invalid lines are reported in 'errors' and the valid ones are still applied
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, cart_pk=None):
+        cart = get_object_or_404(Cart, pk=cart_pk)
+        if not isinstance(request.data, list):
+            return Response({'error': 'Expected a list of {product_id, quantity} operations.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        errors = []
+        # {product_id: [(index, quantity)]} Repeated products in the same batch are added together, in order
+        lines = {}
+        for index, operation in enumerate(request.data):
+            serializer = BulkCartItemSerializer(data=operation)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            lines.setdefault(serializer.validated_data['product_id'], []).append((index, serializer.validated_data['quantity']))
+        
+        # A single query to validate every product of the batch and read its inventory
+        inventories = dict(Product.objects.filter(pk__in=lines).values_list('pk', 'inventory'))
+        for product_id in list(lines):
+            if product_id not in inventories:
+                for index, quantity in lines.pop(product_id):
+                    errors.append({'index': index, 'errors': {'product_id': ['No product with the given ID was found']}})
+        
+        # Upserting all the items in one transaction: one SELECT, one bulk UPDATE and one bulk INSERT
+        with transaction.atomic():
+            items = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=lines)}
+            items_to_update = []
+            items_to_create = []
+            for product_id, product_lines in lines.items():
+                item = items.get(product_id)
+                total = item.quantity if item is not None else 0
+                # The quantity in the cart can't be more than the inventory nor the column maximum
+                limit = min(inventories[product_id], CART_ITEM_MAX_QUANTITY)
+                for index, quantity in product_lines:
+                    if total + quantity > limit:
+                        errors.append({'index': index, 'errors': {'quantity': [f'The cart would have {total + quantity} units of this product, the maximum is {limit}.']}})
+                    else:
+                        total += quantity
+                if item is None:
+                    if total:
+                        items_to_create.append(CartItem(cart=cart, product_id=product_id, quantity=total))
+                elif total != item.quantity:
+                    item.quantity = total
+                    items_to_update.append(item)
+            CartItem.objects.bulk_update(items_to_update, ['quantity'])
+            CartItem.objects.bulk_create(items_to_create)
+        
+        cart = Cart.objects.prefetch_related('items__product').get(pk=cart.pk)
+        errors.sort(key=lambda error: error['index'])
+        return Response({'cart': CartSerializer(cart).data, 'errors': errors})
+    
 # View set for Profile API
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
@@ -260,6 +547,19 @@ class CustomerViewSet(ModelViewSet):
     permission_classes = [IsAdminUser]
     # authentication_classes = [JWTAuthentication]
     
+    # Staff only like the rest of the customers endpoints
+    @action(detail=False)
+    def autocomplete(self, request):
+        return autocomplete_response(request, customer_name_index)
+    
+    # ?search= prefix of the first name, last name, email or phone, on the indexed search columns (CustomerQuerySet.search)
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        search = self.request.query_params.get('search')
+        if self.action == 'list' and search:
+            queryset = queryset.search(search)
+        return queryset
+    
     # Asigning permissions depending on the request
     # Here we are enabling get request for any users but anyting else is only avilable for authenticated users
     # def get_permissions(self):
@@ -275,12 +575,26 @@ class CustomerViewSet(ModelViewSet):
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
         # Every request have an user atribute that will contain data about the user or anonymus if not logged 
-        (customer, created) = Customer.objects.get_or_create(user_id=request.user.id)
+        # The customer is created with the user (post_save signal, or the backfill_customers command), so GET is a cached read
+        key = customer_profile_key(request.user.id)
         if request.method == 'GET':
-            serializer = CustomerSerializer(customer)
-            return Response(serializer.data)
+            data = cache.get(key)
+            if data is None:
+                serializer = CustomerSerializer(self.get_customer(request))
+                data = serializer.data
+                cache.set(key, data, CUSTOMER_PROFILE_TIMEOUT)
+            return Response(data)
         elif request.method == 'PUT':
-            serializer = CustomerSerializer(customer, data=request.data)
+            serializer = CustomerSerializer(self.get_customer(request), data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data)
\ No newline at end of file
+            cache.set(key, serializer.data, CUSTOMER_PROFILE_TIMEOUT)
+            return Response(serializer.data)
+    
+    def get_customer(self, request):
+        try:
+            return Customer.objects.get(user_id=request.user.id)
+        except Customer.DoesNotExist:
+            # Only for users created before the signal that were not backfilled yet
+            (customer, created) = Customer.objects.get_or_create(user_id=request.user.id)
+            return customer
\ No newline at end of file
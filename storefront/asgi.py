@@ -11,6 +11,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'storefront.settings')
+# The connection profile is applied by storefront.settings_connections (storefront.settings_api is built on it)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'storefront.settings_connections')
+# Persistent connections don't work well with async requests, ASGI workers use an in-process pool (see storefront/database.py)
+os.environ.setdefault('DB_CONNECTIONS', 'pool')
 
 application = get_asgi_application()
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+Database connection profiles.
+
+By default Django opens a new connection for each request and closes it at the end.
+These functions return a copy of a DATABASES entry configured for one of the profiles:
+
+- 'default': one connection per request (Django default)
+- 'persistent': connections are reused for CONN_MAX_AGE seconds and checked before reuse (sync/WSGI workers)
+- 'pool': in-process connection pool (ASGI workers), needs PostgreSQL with psycopg 3 and psycopg_pool
+
+Usage in a settings module: DATABASES = apply_profile(DATABASES, 'persistent')
+"""
+
+
+def persistent_connections(database, max_age=60):
+    # CONN_HEALTH_CHECKS avoids errors when the database closed a connection that we kept open
+    return {**database, 'CONN_MAX_AGE': max_age, 'CONN_HEALTH_CHECKS': True}
+
+
+def pooled_connections(database, min_size=2, max_size=10, timeout=10):
+    # Django only has a built-in pool for PostgreSQL, other databases use persistent connections instead
+    if 'postgresql' not in database['ENGINE']:
+        return persistent_connections(database)
+    options = {**database.get('OPTIONS', {}), 'pool': {'min_size': min_size, 'max_size': max_size, 'timeout': timeout}}
+    # The pool manages the connections itself, Django requires CONN_MAX_AGE = 0 when it's enabled
+    return {**database, 'CONN_MAX_AGE': 0, 'OPTIONS': options}
+
+
+PROFILES = {
+    'default': lambda database, **kwargs: database,
+    'persistent': persistent_connections,
+    'pool': pooled_connections,
+}
+
+
+def apply_profile(databases, profile, **kwargs):
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown database connection profile {profile!r}, use one of {", ".join(PROFILES)}')
+    return {alias: PROFILES[profile](database, **kwargs) for alias, database in databases.items()}
@@ -0,0 +1,53 @@
+"""
+Settings profile for API-only workers.
+
+Usage: DJANGO_SETTINGS_MODULE=storefront.settings_api gunicorn storefront.wsgi
+It inherits everything from storefront.settings_connections (the DB_CONNECTIONS profile) and removes what the API doesn't
+need at startup: the admin, the playground app and the debug toolbar.
+The other optimizations can be turned off one by one with environment variables (1 by default, 0 disables them):
+API_REPLICAS (catalog reads on the replicas), API_STATELESS_JWT (claims in the tokens) and API_FAST_JSON (orjson, MessagePack)
+"""
+import os
+from importlib.util import find_spec
+
+from .settings_connections import *
+
+
+def enabled(name):
+    return os.environ.get(name, '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+# Apps that are only used by humans (admin) or for learning (playground)
+API_EXCLUDED_APPS = ['django.contrib.admin', 'playground', 'debug_toolbar']
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in API_EXCLUDED_APPS]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if not middleware.startswith('debug_toolbar.')]
+
+ROOT_URLCONF = 'storefront.urls_api'
+
+# Production visibility of the ORM, the debug toolbar can't be used here
+MIDDLEWARE = ['core.middleware.QueryInstrumentationMiddleware'] + MIDDLEWARE
+
+# Safe-method reads of the catalog go to the replicas listed in DATABASE_REPLICAS, writes, carts and checkout stay on 'default'
+if enabled('API_REPLICAS'):
+    DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+    MIDDLEWARE = MIDDLEWARE + ['core.replicas.ReplicaMiddleware']
+
+# Stateless JWT: the claims travel in the token, authenticated requests don't load the user from the database
+if enabled('API_STATELESS_JWT'):
+    SIMPLE_JWT = {
+        **SIMPLE_JWT,
+        'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
+        'TOKEN_REFRESH_SERIALIZER': 'core.serializers.TokenRefreshSerializer',
+    }
+    REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_AUTHENTICATION_CLASSES': ['core.authentication.StatelessJWTAuthentication']}
+
+# orjson based JSON for every response, and MessagePack (application/msgpack) when the msgpack package is installed
+if enabled('API_FAST_JSON'):
+    API_RENDERER_CLASSES = ['store.renderers.FastJSONRenderer', 'rest_framework.renderers.BrowsableAPIRenderer']
+    API_PARSER_CLASSES = ['store.parsers.FastJSONParser', 'rest_framework.parsers.FormParser', 'rest_framework.parsers.MultiPartParser']
+    if find_spec('msgpack') is not None:
+        API_RENDERER_CLASSES.append('store.renderers.MessagePackRenderer')
+        API_PARSER_CLASSES.append('store.parsers.MessagePackParser')
+    REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_RENDERER_CLASSES': API_RENDERER_CLASSES, 'DEFAULT_PARSER_CLASSES': API_PARSER_CLASSES}
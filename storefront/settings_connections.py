@@ -0,0 +1,16 @@
+"""
+Settings profile that only changes the database connections.
+
+Usage: DJANGO_SETTINGS_MODULE=storefront.settings_connections gunicorn storefront.wsgi
+ASGI workers use it by default (asgi.py), with DB_CONNECTIONS=pool: uvicorn storefront.asgi:application
+It inherits everything from storefront.settings and applies the connection profile of DB_CONNECTIONS to every database:
+'default', 'persistent' (WSGI, the default here) or 'pool' (ASGI, asgi.py sets it). See storefront/database.py
+storefront.settings_api is built on top of it.
+"""
+import os
+
+from .settings import *
+from .database import apply_profile
+
+DB_CONNECTIONS = os.environ.get('DB_CONNECTIONS', 'persistent')
+DATABASES = apply_profile(DATABASES, DB_CONNECTIONS)
@@ -0,0 +1,22 @@
+"""
+Settings profile for the test suite.
+
+Usage: python manage.py test --settings=storefront.settings_test
+It inherits everything from storefront.settings and uses two SQLite files, a primary and a replica alias, so the tests
+of core.replicas can check which database answered each query. Routing is only enabled by those tests (override_settings),
+every other test reads and writes the primary.
+"""
+from .settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test-primary.sqlite3'},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test-replica.sqlite3'},
+    },
+}
@@ -14,10 +14,10 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 # include: Include urls from another app
 from django.urls import path, include
-import debug_toolbar
 
 # Changing the admin interface header
 admin.site.site_header = 'Storefront Admin'
@@ -36,5 +36,11 @@ urlpatterns = [
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
 
-    path('__debug__/', include(debug_toolbar.urls))
-]
\ No newline at end of file
+    # Staff only operational endpoints (query and cache statistics)
+    path('metrics/', include('core.urls')),
+]
+
+# The debug toolbar is only imported when it's installed, API-only workers (storefront.settings_api) don't pay for it
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    import debug_toolbar
+    urlpatterns += [path('__debug__/', include(debug_toolbar.urls))]
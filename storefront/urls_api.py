@@ -0,0 +1,16 @@
+"""
+URL configuration for API-only workers.
+
+Used by storefront.settings_api, it only mounts the store API and the djoser user and JWT endpoints.
+The admin, the playground and the debug toolbar are not imported at all.
+"""
+from django.urls import path, include
+
+urlpatterns = [
+    path('store/', include('store.urls')),
+    path('auth/', include('djoser.urls')),
+    path('auth/', include('djoser.urls.jwt')),
+
+    # Staff only operational endpoints (query and cache statistics)
+    path('metrics/', include('core.urls')),
+]